@@ -7,13 +7,15 @@ import Tkinter as tk
 import tkMessageBox
 from argparse import Namespace
 from copy import copy, deepcopy
+from multiprocessing import cpu_count
 
-import numpy as np
-
-from common.io_utils import (delete_all_genes, load_session_data,
-                             save_session_data)
-from common.parameters import (DEFAULT_SESSION_DATA, GLOBAL_STATS_NAMES,
+from common.io_utils import (SESSION_EXTENSION, delete_all_genes,
+                             load_session_data, save_session_data)
+from common.parameters import (DEFAULT_SESSION_DATA,
+                               EVOLVE_PROPERTY_SETTINGS, GLOBAL_STATS_NAMES,
                                PARAM_INFO)
+from common.profiling import PROFILER
+from common.stats_export import StatsStream, export_stats, save_stats
 from common.styles import APP_COLOR
 from common.tools import is_within
 from frame.advanced_mutate import AdvancedMutateFrame
@@ -23,6 +25,7 @@ from frame.top import (ButtonsFrame, CrossFrame, EvolvingFrame, InsertLibFrame,
                        MutateFrame)
 from menu.menu_bar import MenuBar
 from model.genetic import Population
+from model.scheduler import ADAPTIVE, POLL_INTERVAL
 
 
 class SessionData(object):
@@ -63,8 +66,9 @@ class SessionData(object):
 
     def update(self, attr):
         """Call all bindings of a given data."""
-        for each in self.bindings[attr]:
-            each()
+        with PROFILER.span("session bindings ({})".format(attr), "gui"):
+            for each in self.bindings[attr]:
+                each()
 
     def set(self, attr, value):
         """Update values of stored data and trigger bindings. All changes in
@@ -75,9 +79,14 @@ class SessionData(object):
 
     @property
     def movement(self):
-        """Shortcut for obtaining the value of the show-movement setting."""
-        return False if self.general_settings["show_movement"] == 0\
-            else self.general_settings["show_movement_value"]
+        """Shortcut for obtaining the value of the show-movement setting:
+        False, a number of steps, or ADAPTIVE (see model.scheduler)."""
+        if self.general_settings["show_movement"] == 0:
+            return False
+        # Settings saved by older versions lack show_movement_adaptive
+        if self.general_settings.get("show_movement_adaptive", 0):
+            return ADAPTIVE
+        return self.general_settings["show_movement_value"]
 
     @property
     def vt(self):
@@ -98,6 +107,16 @@ class SessionData(object):
         """Shortcut for obtaining the value of periodic boundary setting."""
         return self.general_settings["periodic_boundary"] == 1
 
+    @property
+    def n_threads(self):
+        """Shortcut for obtaining the number of threads of the simulations:
+        0 (the sequential update scheme) unless parallel update is on, see
+        model.DA.Model."""
+        # Settings saved by older versions lack parallel_update
+        if self.general_settings.get("parallel_update", 0):
+            return cpu_count()
+        return 0
+
     @property
     def pheno_settings(self):
         """Shortcut for obtaining a tuple of the three properties above."""
@@ -124,6 +143,10 @@ class App(tk.Frame):
         self.session = session = SessionData()
         # Initiate Population object
         self.population = Population(session)
+        # Streams of global properties to files, one per simulation
+        self.stats_streams = []
+        # The job of the running evolution, if any
+        self.evolution_job = None
         # Make GUI parts
         self.current_top_frame = None
         self._init_frames()
@@ -134,6 +157,14 @@ class App(tk.Frame):
         # Update session data
         for each in session.data_names:
             session.update(each)
+        # Show the simulations as they run in the background
+        self._poll()
+
+    def _poll(self):
+        """Pass updates from the simulations running in the background on to
+        the GUI (see model.scheduler), every POLL_INTERVAL milliseconds."""
+        self.after(POLL_INTERVAL, self._poll)
+        self.population.scheduler.poll()
 
     def _init_frames(self):
         session = self.session
@@ -187,20 +218,26 @@ class App(tk.Frame):
                 {"params": sim1.params,
                  "state": sim1.state,
                  "global_stats": sim1.global_stats,
+                 "global_stats_offset": sim1.stats.offset,
+                 "seed": sim1.seed,
                  "step": sim1.step},
 
                 {"params": sim2.params,
                  "state": sim2.state,
                  "global_stats": sim2.global_stats,
+                 "global_stats_offset": sim2.stats.offset,
+                 "seed": sim2.seed,
                  "step": sim2.step},
 
                 ...... x 9
             ]
 
+            saved to a session file (see common.io_utils).
             """
             # Open dialog and ask the user to input filename to save as
             output_file_name = tkFileDialog.asksaveasfilename(
-                filetypes=[("JSON", "json")],
+                filetypes=[("SOIE Session", SESSION_EXTENSION)],
+                defaultextension=SESSION_EXTENSION,
                 initialdir=os.path.join(os.path.dirname(__file__), 'sessions'),
                 initialfile=datetime.datetime.now()
                 .strftime("Session_%m-%d-%Y_at_%I.%M%p")  # Default name
@@ -210,19 +247,25 @@ class App(tk.Frame):
                 # Collect various settings from SessionData
                 session_data = {name: getattr(session, name)
                                 for name in session.data_names}
-                # Collect data related to currently running simulations
-                model_data = [
-                    {
-                        "params": each_sim.params,
-                        "state": [_.tolist() for _ in each_sim.state],
-                        "global_stats": each_sim.global_stats.tolist(),
-                        "step": each_sim.step
-                    }
-                    for each_sim in self.population.simulations
-                ]
-                session_data["model_data"] = model_data
-                # Export
-                save_session_data(output_file_name, session_data)
+                # Collect data related to currently running simulations, and
+                # export them before the simulations go on (and once the
+                # workers are done with their chunk, so that the states
+                # they update in place match the steps)
+                with self.population.pool.busy, \
+                        self.population.scheduler.lock:
+                    model_data = [
+                        {
+                            "params": each_sim.params,
+                            "state": each_sim.state,
+                            "global_stats": each_sim.global_stats,
+                            "global_stats_offset": each_sim.stats.offset,
+                            "seed": each_sim.seed,
+                            "step": each_sim.step
+                        }
+                        for each_sim in self.population.simulations
+                    ]
+                    session_data["model_data"] = model_data
+                    save_session_data(output_file_name, session_data)
                 # Show success message
                 tkMessageBox.showinfo("", "Current session has been saved!")
 
@@ -230,7 +273,7 @@ class App(tk.Frame):
             """Save global properties to a csv file."""
             sims = self.frames.sims
             if (sims.selected) and (sims.mode=="view"):
-                global_stats = sims.selected.sim.global_stats
+                stats = sims.selected.sim.stats
             else:
                 tkMessageBox.showwarning(
                     "",
@@ -246,14 +289,44 @@ class App(tk.Frame):
             )
             # If filename not empty (or when dialog is cancelled)
             if output_file_name != "":
-                np.savetxt(output_file_name, global_stats.transpose(),
-                           delimiter=",", comments="",
-                           header=",".join(GLOBAL_STATS_NAMES)+"\n")
+                with self.population.scheduler.lock:
+                    save_stats(output_file_name, stats)
                 tkMessageBox.showinfo(
                     "",
                     "Global properties for this model have been saved!"
                 )
 
+        def _export_all_global_stats():
+            """Save global properties of all models to csv files in a
+            directory (see common.stats_export)."""
+            directory = tkFileDialog.askdirectory(
+                initialdir=os.path.dirname(__file__), mustexist=True)
+            if directory:
+                with self.population.scheduler.lock:
+                    export_stats(self.population.simulations, directory)
+                tkMessageBox.showinfo(
+                    "",
+                    "Global properties for all models have been saved!"
+                )
+
+        def _start_streaming_global_stats():
+            """Keep appending global properties of all models to csv files in
+            a directory as they run (see common.stats_export)."""
+            directory = tkFileDialog.askdirectory(
+                initialdir=os.path.dirname(__file__), mustexist=True)
+            if directory:
+                _stop_streaming_global_stats()
+                with self.population.scheduler.lock:
+                    for sim in self.population.simulations:
+                        stream = StatsStream(sim, directory)
+                        stream.update()
+                        self.stats_streams.append(stream)
+
+        def _stop_streaming_global_stats():
+            for stream in self.stats_streams:
+                stream.close()
+            self.stats_streams = []
+
         """The following is a set of functions that link the shortcut buttons
         on the menu bar to the update of ``general_settings``.
         """
@@ -272,6 +345,17 @@ class App(tk.Frame):
                 self.update_general_settings(new_settings)
             return _func
 
+        def _set_movement(value):
+            def _func():
+                new_settings = self.session.general_settings
+                new_settings["show_movement"] = 1
+                new_settings["show_movement_adaptive"] = int(
+                    value == ADAPTIVE)
+                if value != ADAPTIVE:
+                    new_settings["show_movement_value"] = value
+                self.update_general_settings(new_settings)
+            return _func
+
         def _toggle_general(which):
             def _func():
                 new_settings = self.session.general_settings
@@ -338,15 +422,17 @@ class App(tk.Frame):
             "Save Current Session": _save_current_session,
             "Save All Genes to Library": self.frames.sims.save_all,
             "Save Global Properties": _save_global_stats,
+            "Save Global Properties of All Models":
+                _export_all_global_stats,
+            "Start Streaming Global Properties": _start_streaming_global_stats,
+            "Stop Streaming Global Properties": _stop_streaming_global_stats,
             "Clear Library": delete_all_genes,
             # Under "Control" menu
             "Show Velocity Trace": _toggle_general("show_tail"),
-            "Every 1 Step": _set_double("show_movement_value",
-                                        "show_movement", 1),
-            "Every 5 Step": _set_double("show_movement_value",
-                                        "show_movement", 5),
-            "Every 10 Step": _set_double("show_movement_value",
-                                         "show_movement", 10),
+            "Every 1 Step": _set_movement(1),
+            "Every 5 Step": _set_movement(5),
+            "Every 10 Step": _set_movement(10),
+            "Adaptive": _set_movement(ADAPTIVE),
             "Turn Off": _set_general("show_movement", 0),
             "Zoom 0.5x": _set_double("zoom_in_value", "zoom_in", 0.5),
             "Zoom 1.0x": _set_double("zoom_in_value", "zoom_in", 1.0),
@@ -444,12 +530,31 @@ class App(tk.Frame):
         which_prop = new_settings["which_prop"]
         num_gen = new_settings["num_gen"]
         equi_range = new_settings["equi_range"]
-        self.population.evolve_by_property(which_prop, num_gen, equi_range,
-                                           self.frames.evolving.display_text,
-                                           self.frames.sims.highlight)
-        # When done, show 'Back' button
-        self._change_title("Done!")
-        self.frames.evolving.done()
+        # Settings saved by older versions lack these
+        pop_size = new_settings.get(
+            "pop_size", EVOLVE_PROPERTY_SETTINGS["pop_size"])
+        selection = new_settings.get(
+            "selection", EVOLVE_PROPERTY_SETTINGS["selection"])
+        racing = new_settings.get(
+            "racing", EVOLVE_PROPERTY_SETTINGS["racing"])
+
+        def done():
+            # When done, show 'Back' button
+            self._change_title(
+                "Stopped" if self.evolution_job.cancelled else "Done!")
+            self.evolution_job = None
+            self.frames.evolving.done()
+
+        self.evolution_job = self.population.evolve_by_property(
+            which_prop, num_gen, equi_range,
+            self.frames.evolving.display_text, self.frames.sims.highlight,
+            pop_size, selection, racing, done)
+
+    def stop_evolution(self):
+        """Define actions to be taken when 'Stop' is clicked while evolving:
+        stop after the current generation."""
+        if self.evolution_job is not None:
+            self.evolution_job.cancel()
 
     def insert_lib(self, params):
         """Define actions to be taken when open-gene-from-library commmand
@@ -531,7 +636,8 @@ class App(tk.Frame):
 
 
 
-# Launch a Tkinter application
-ROOT = tk.Tk()
-APP = App(ROOT)
-ROOT.mainloop()
+if __name__ == "__main__":
+    # Launch a Tkinter application
+    ROOT = tk.Tk()
+    APP = App(ROOT)
+    ROOT.mainloop()
@@ -0,0 +1,96 @@
+"""Benchmark of the neighbor search strategies of the C++ simulation code.
+
+Runs the same initial state with ``neighbor_search="all_pairs"`` and
+``neighbor_search="cell_list"`` over a range of cell densities and reports
+the time per step of each, the speedup of the cell list, and the largest
+difference in global properties between the two (noise is switched off so
+that both runs are directly comparable).
+
+    python -m benchmarks.neighbor_search [--scale-factor 0.5] [--steps 5]
+"""
+import argparse
+import time
+from copy import deepcopy
+
+import numpy as np
+
+from model.DA import Model
+
+DENSITIES = [0.01, 0.02, 0.05, 0.1, 0.2, 0.4, 0.7, 1.0]
+
+PARAMS = {
+    "Alignment Range": 5.0,
+    "Pinned Cells": ["none", "none", "none"],
+    "Interaction Force": 0.005,
+    "Gradient Intensity": [0.0, 0.0, 0.0],
+    "Cell Ratio": [0.5, 0.5, 0.0],
+    "Alignment Force": 0.5,
+    "Noise Intensity": 0.0,
+    "Angular Inertia": 0.05,
+    "Adhesion": [[1.2, 1.4, 0.01], [1.4, 1.8, 0.01], [0.01, 0.01, 0.01]],
+    "Gradient Direction": [0.0, 0.0, 0.0],
+    "Cell Density": 0.1,
+    "Velocity": [0.05, 0.05, 0.05],
+    "Interaction Range": 5.0
+}
+
+
+def time_per_step(model, steps):
+    """Return the wall time per step of ticking a model."""
+    start_time = time.time()
+    model.tick(steps)
+    return (time.time() - start_time) / steps
+
+
+def compare(density, scale_factor, periodic_boundary, steps):
+    """Run both neighbor search strategies from the same initial state.
+
+    Returns:
+        (nop, all-pairs time per step, cell-list time per step, max absolute
+        difference in global properties)
+    """
+    params = deepcopy(PARAMS)
+    params["Cell Density"] = density
+    models = {}
+    for neighbor_search in ["all_pairs", "cell_list"]:
+        models[neighbor_search] = Model(
+            params, scale_factor=scale_factor,
+            periodic_boundary=periodic_boundary,
+            neighbor_search=neighbor_search)
+    models["all_pairs"].init_particles_state()
+    models["cell_list"].set(models["all_pairs"].state,
+                            models["all_pairs"].global_stats)
+    t_all = time_per_step(models["all_pairs"], steps)
+    t_cell = time_per_step(models["cell_list"], steps)
+    diff = np.abs(models["all_pairs"].global_stats -
+                  models["cell_list"].global_stats).max()
+    return models["all_pairs"].internal_params["nop"], t_all, t_cell, diff
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--scale-factor", type=float, default=0.5)
+    parser.add_argument("--steps", type=int, default=5)
+    parser.add_argument("--periodic", action="store_true")
+    args = parser.parse_args()
+
+    np.random.seed(0)
+    print("{:>8} {:>7} {:>12} {:>12} {:>8} {:>10}".format(
+        "density", "nop", "all_pairs/s", "cell_list/s", "speedup",
+        "max_diff"))
+    crossover = None
+    for density in DENSITIES:
+        nop, t_all, t_cell, diff = compare(
+            density, args.scale_factor, args.periodic, args.steps)
+        print("{:>8} {:>7} {:>12.6f} {:>12.6f} {:>8.2f} {:>10.2e}".format(
+            density, nop, t_all, t_cell, t_all / t_cell, diff))
+        if crossover is None and t_cell < t_all:
+            crossover = density
+    if crossover is not None:
+        print("Cell list is faster from density {} on.".format(crossover))
+    else:
+        print("All pairs is faster at every density tested.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Benchmark of the float32 precision mode of the C++ simulation code.
+
+Runs the same initial state with the sequential update scheme
+(``n_threads=0``) and with the simultaneous one (``n_threads`` of 1 or more)
+in ``precision="float64"`` and ``precision="float32"``, over a range of cell
+densities, and reports the steps per second of each. The drift of float32 is
+the largest difference in global properties from float64 over all steps
+(max_drift) and in their means over the run (mean_drift), the figures the
+fitness of evolve by property is computed from; both runs share a seed, so
+that they only differ by rounding.
+
+    python -m benchmarks.precision [--scale-factor 0.5] [--steps 20]
+        [--threads 1]
+"""
+import argparse
+import time
+from copy import deepcopy
+
+import numpy as np
+
+from benchmarks.neighbor_search import PARAMS
+from model.DA import Model
+
+DENSITIES = [0.05, 0.1, 0.2, 0.4, 0.7, 1.0]
+
+
+def steps_per_second(model, steps):
+    """Return the number of steps per second of ticking a model."""
+    start_time = time.time()
+    model.tick(steps)
+    return steps / (time.time() - start_time)
+
+
+def compare(density, scale_factor, periodic_boundary, steps, n_threads):
+    """Run the sequential scheme and both precisions of the simultaneous one
+    from the same initial state.
+
+    Returns:
+        (nop, sequential steps/s, float64 steps/s, float32 steps/s, max
+        absolute difference in global properties between float32 and
+        float64, max absolute difference in their means)
+    """
+    params = deepcopy(PARAMS)
+    params["Cell Density"] = density
+    models = []
+    for threads, precision in [(0, "float64"), (n_threads, "float64"),
+                               (n_threads, "float32")]:
+        models.append(Model(params, scale_factor=scale_factor,
+                            periodic_boundary=periodic_boundary, seed=0,
+                            n_threads=threads, precision=precision))
+    models[0].init_particles_state()
+    for model in models[1:]:
+        model.set(models[0].state, models[0].global_stats)
+    rates = [steps_per_second(model, steps) for model in models]
+    drift = np.abs(models[2].global_stats - models[1].global_stats)
+    mean_drift = np.abs(models[2].global_stats.mean(axis=1) -
+                        models[1].global_stats.mean(axis=1))
+    return ([models[0].internal_params["nop"]] + rates +
+            [drift.max(), mean_drift.max()])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--scale-factor", type=float, default=0.5)
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--periodic", action="store_true")
+    args = parser.parse_args()
+
+    print("{:>8} {:>7} {:>12} {:>12} {:>12} {:>8} {:>10} {:>10}".format(
+        "density", "nop", "sequential", "float64", "float32", "speedup",
+        "max_drift", "mean_drift"))
+    for density in DENSITIES:
+        nop, r_seq, r_64, r_32, drift, mean_drift = compare(
+            density, args.scale_factor, args.periodic, args.steps,
+            args.threads)
+        print("{:>8} {:>7} {:>12.1f} {:>12.1f} {:>12.1f} {:>8.2f} {:>10.2e} "
+              "{:>10.2e}".format(density, nop, r_seq, r_64, r_32,
+                                 r_32 / r_64, drift, mean_drift))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+"""Benchmark of the throughput of the simulations, for regression testing.
+
+Measures, as rates (higher is better):
+
+    tick: The steps per second of Model.tick, with fixed (fb) and periodic
+        (pb) boundaries, over a grid of cell densities and scale factors,
+        and over the interaction and alignment ranges. Densities and ranges
+        are spread over the ranges of PARAM_INFO.
+    population: The steps per second, summed over the 9 simulations, of
+        Population.add_steps_all (in the worker processes), with either
+        boundary.
+    evolve: The generations per second of Population.evolve_by_property.
+    session: The sessions per second of saving and of loading the session
+        of a population (save_session_data; load_session_data followed by
+        Population.load_prev_session).
+
+Every case is seeded, and is timed over the same work repeat times, keeping
+the best rate. Results are saved as JSON with --output, and compared with
+results saved earlier with --baseline: a case is reported slower (and the
+exit status is 1) if its rate is below the baseline's by more than the
+tolerance, a fraction. Baselines are only comparable on the same machine.
+
+    python -m benchmarks.throughput [--cases tick population] [--steps 50]
+        [--repeat 3] [--output results.json] [--baseline baseline.json]
+        [--tolerance 0.2]
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from argparse import Namespace
+from copy import deepcopy
+
+import numpy as np
+
+from app import SessionData
+from benchmarks.neighbor_search import PARAMS
+from common.io_utils import load_session_data, save_session_data
+from common.parameters import PARAM_INFO
+from model.cache import FitnessCache
+from model.DA import DEFAULT_BACKEND, Model
+from model.genetic import Population
+
+CASES = ["tick", "population", "evolve", "session"]
+BOUNDARIES = ["fb", "pb"]
+# Scale factors offered by the Zoom menu
+SCALE_FACTORS = [0.5, 1.0, 2.0]
+# Number of values of each parameter, spread over its range in PARAM_INFO
+N_VALUES = 3
+RANGE_PARAMS = ["Interaction Range", "Alignment Range"]
+# Evolution benchmarked: generations, and the steps fitness is averaged over
+EVOLVE_GENERATIONS = 2
+EVOLVE_EQUI_RANGE = (20, 40)
+
+
+def param_values(name):
+    """Return N_VALUES values of a parameter, evenly spread over its range in
+    PARAM_INFO."""
+    info = PARAM_INFO[name]
+    return [round(x, info["roundto"])
+            for x in np.linspace(info["range"][0], info["range"][1],
+                                 N_VALUES)]
+
+
+def best_rate(func, work, repeat):
+    """Call func() repeat times, and return the highest rate of work per
+    second."""
+    best = 0.
+    for _ in range(repeat):
+        start_time = time.time()
+        func()
+        best = max(best, work / (time.time() - start_time))
+    return best
+
+
+def bench_tick(steps, repeat):
+    """Return the results of the tick cases, by name."""
+    middle = {name: param_values(name)[N_VALUES // 2]
+              for name in ["Cell Density"] + RANGE_PARAMS}
+    cases = []
+    for density in param_values("Cell Density"):
+        for scale_factor in SCALE_FACTORS:
+            cases.append(("density={}/sf={}".format(density, scale_factor),
+                          dict(middle, **{"Cell Density": density}),
+                          scale_factor))
+    for name in RANGE_PARAMS:
+        for value in param_values(name):
+            cases.append(("{}={}".format(
+                name.lower().replace(" ", "_"), value),
+                dict(middle, **{name: value}), 1.0))
+    results = {}
+    for boundary in BOUNDARIES:
+        for label, changes, scale_factor in cases:
+            params = deepcopy(PARAMS)
+            params.update(changes)
+            model = Model(params, scale_factor=scale_factor,
+                          periodic_boundary=boundary == "pb", seed=0)
+            model.init_particles_state()
+            # Not timed: the first tick may load the compiled code
+            model.tick(1)
+            name = "tick/{}/{}".format(boundary, label)
+            results[name] = {
+                "rate": best_rate(lambda: model.tick(steps), steps, repeat),
+                "unit": "steps/s", "nop": model.internal_params["nop"]}
+            print_result(name, results)
+    return results
+
+
+def _finish(population):
+    """Wait until the jobs of a population have ended, and call what they
+    left for the GUI (raising their errors)."""
+    population.scheduler.wait()
+    population.scheduler.poll()
+
+
+def _model_data(population):
+    """Return the model data of a session, as saved by the GUI."""
+    return [{"params": sim.params, "state": sim.state,
+             "global_stats": sim.global_stats,
+             "global_stats_offset": sim.stats.offset, "seed": sim.seed,
+             "step": sim.step}
+            for sim in population.simulations]
+
+
+def bench_population(cases, steps, repeat):
+    """Return the results of the population, evolve and session cases, by
+    name."""
+    results = {}
+    directory = tempfile.mkdtemp(prefix="soie-benchmark-")
+    try:
+        for boundary in BOUNDARIES:
+            np.random.seed(0)
+            session = SessionData()
+            session.general_settings["periodic_boundary"] = int(
+                boundary == "pb")
+            population = Population(session)
+            try:
+                population.new_population()
+                _finish(population)
+                if "population" in cases:
+                    n_sims = len(population.simulations)
+
+                    def add_steps():
+                        population.add_steps_all(steps)
+                        _finish(population)
+                    name = "population/{}".format(boundary)
+                    results[name] = {
+                        "rate": best_rate(add_steps, steps * n_sims, repeat),
+                        "unit": "steps/s"}
+                    print_result(name, results)
+                if "session" in cases:
+                    results.update(_bench_session(
+                        population, session, boundary, directory, repeat))
+                if "evolve" in cases:
+                    results.update(_bench_evolve(population, boundary,
+                                                 repeat))
+            finally:
+                population.scheduler.cancel()
+                population.scheduler.wait()
+                population.pool.close()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+def _bench_session(population, session, boundary, directory, repeat):
+    """Return the results of the session cases, saving to directory."""
+    path = os.path.join(directory, "session_{}".format(boundary))
+    session_data = {name: getattr(session, name)
+                    for name in session.data_names}
+    session_data["model_data"] = _model_data(population)
+
+    def load():
+        population.load_prev_session(
+            load_session_data(path)["model_data"])
+    results = {}
+    for name, func in [
+            ("save", lambda: save_session_data(path, session_data)),
+            ("load", load)]:
+        name = "session/{}/{}".format(boundary, name)
+        results[name] = {"rate": best_rate(func, 1, repeat),
+                         "unit": "sessions/s"}
+        print_result(name, results)
+    return results
+
+
+def _bench_evolve(population, boundary, repeat):
+    """Return the result of the evolve case."""
+    label = Namespace(get=lambda: "", set=lambda text: None)
+
+    def evolve():
+        # A fresh cache, or the repeats would look the fitnesses up
+        population.fitness_cache = FitnessCache()
+        population.evolve_by_property(
+            "Group Angular Momentum", EVOLVE_GENERATIONS, EVOLVE_EQUI_RANGE,
+            label, lambda sim: None)
+        _finish(population)
+    name = "evolve/{}".format(boundary)
+    results = {name: {"rate": best_rate(evolve, EVOLVE_GENERATIONS, repeat),
+                      "unit": "generations/s"}}
+    print_result(name, results)
+    return results
+
+
+def print_result(name, results):
+    """Print the result of a case as soon as it is measured."""
+    result = results[name]
+    print("{:<44} {:>12.2f} {}".format(name, result["rate"], result["unit"]))
+    sys.stdout.flush()
+
+
+def compare(results, baseline, tolerance):
+    """Compare results with baseline results.
+
+    Returns:
+        A list of (name, rate, baseline rate, status), where status is
+        "slower" or "faster" if the rate differs from the baseline's by more
+        than the tolerance (a fraction of the baseline), "ok" if not, and
+        "new" if the case is not in the baseline.
+    """
+    comparison = []
+    for name in sorted(results):
+        rate = results[name]["rate"]
+        if name not in baseline:
+            comparison.append((name, rate, None, "new"))
+            continue
+        base_rate = baseline[name]["rate"]
+        if rate < base_rate * (1 - tolerance):
+            status = "slower"
+        elif rate > base_rate * (1 + tolerance):
+            status = "faster"
+        else:
+            status = "ok"
+        comparison.append((name, rate, base_rate, status))
+    return comparison
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--cases", nargs="+", choices=CASES, default=CASES)
+    parser.add_argument("--steps", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="save the results to this file")
+    parser.add_argument("--baseline", help="compare with the results saved "
+                        "in this file")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    results = {}
+    if "tick" in args.cases:
+        results.update(bench_tick(args.steps, args.repeat))
+    if set(args.cases) - {"tick"}:
+        results.update(bench_population(args.cases, args.steps,
+                                        args.repeat))
+    if args.output:
+        with open(args.output, "w") as outfile:
+            json.dump({"machine": platform.platform(),
+                       "python": platform.python_version(),
+                       "backend": DEFAULT_BACKEND, "steps": args.steps,
+                       "repeat": args.repeat, "time": time.time(),
+                       "results": results},
+                      outfile, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline, "r") as infile:
+            baseline = json.load(infile)["results"]
+        print("\n{:<44} {:>12} {:>12} {:>8}  {}".format(
+            "case", "rate", "baseline", "ratio", "status"))
+        comparison = compare(results, baseline, args.tolerance)
+        for name, rate, base_rate, status in comparison:
+            if base_rate is None:
+                print("{:<44} {:>12.2f} {:>12} {:>8}  {}".format(
+                    name, rate, "-", "-", status))
+            else:
+                print("{:<44} {:>12.2f} {:>12.2f} {:>8.2f}  {}".format(
+                    name, rate, base_rate, rate / base_rate, status))
+        if any(status == "slower" for _, _, _, status in comparison):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -15,11 +15,28 @@ Session data:
                 {"params": sim.params,
                  "state": sim.state,
                  "global_stats": sim.global_stats,
+                 "global_stats_offset": sim.stats.offset,
+                 "seed": sim.seed,
                  "step": sim.step}
+            where global_stats_offset is the step of the first saved global
+            properties (0 if absent, as in older sessions), and seed is the
+            seed of the random numbers of the simulation, so that it resumes
+            exactly as it would have run on (a new seed if absent).
 
     The functions ``save_session_data`` and ``load_session_data`` save and load
     session data respectively for a given file path.
 
+    Session files (SESSION_EXTENSION) are zip archives, readable with
+    numpy.load: a compressed JSON header, SESSION_HEADER, holds the settings
+    and model_data without its arrays, and each array is a .npy member,
+    "model_data/<i>/state.npy" (compressed) and
+    "model_data/<i>/global_stats.npy". The global properties, which make
+    up most of a long session, are stored uncompressed unless asked
+    otherwise, so that loading memory-maps them (copy on write) instead of
+    reading them: they are only read from disk as they are accessed (except
+    on Windows, see ``_read_array``).
+    Sessions saved by older versions as plain JSON files are still loaded.
+
 
 Gene library data:
     Under LIB_PATH, there is a json file storing the parameters of all saved
@@ -49,8 +66,13 @@ Gene library data:
     parameters and figure.
 
 """
+import io
 import json
 import os
+import struct
+import tempfile
+import time
+import zipfile
 from random import choice
 
 import numpy as np
@@ -60,6 +82,13 @@ from parameters import PARAM_INFO
 LIB_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'libdata')
 LIB_PARAMS_JSON_PATH = os.path.join(LIB_PATH, "params.json")
 
+SESSION_EXTENSION = ".soie"
+SESSION_HEADER = "header.json"
+# Version of the session file format, stored in the header
+SESSION_FORMAT = 1
+# Arrays of each entry of model_data stored as members of session files
+SESSION_ARRAYS = ["state", "global_stats"]
+
 def fit_into(x, a, b):
     return max(min(x, b), a)
 
@@ -112,16 +141,109 @@ def load_from_files(input_file_name):
     return gene2params(gene)
 
 
-def save_session_data(output_file_name, session_data):
-    """Save session data to a json file."""
-    with open(output_file_name, 'w') as outfile:
-        json.dump(session_data, outfile)
+def replace_file(source, target):
+    """Rename the file source to target, replacing target if it exists.
+    os.rename does so on POSIX (atomically), but not on Windows, where
+    target is removed first (Python 2 has no os.replace)."""
+    if os.name == "nt" and os.path.isfile(target):
+        os.remove(target)
+    os.rename(source, target)
+
+
+def _write_array(archive, name, array, compress):
+    """Write an array to a zip archive as a .npy member."""
+    buf = io.BytesIO()
+    np.lib.format.write_array(buf, np.ascontiguousarray(array))
+    info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+    info.compress_type = (zipfile.ZIP_DEFLATED if compress
+                          else zipfile.ZIP_STORED)
+    info.external_attr = 0o644 << 16
+    archive.writestr(info, buf.getvalue())
+
+
+def _read_array(archive, name, path):
+    """Read a .npy member of a zip archive, memory-mapped (copy on write) if
+    it is stored uncompressed, except on Windows: there, a file cannot be
+    replaced while it is mapped, and sessions are saved over the file they
+    were loaded from."""
+    info = archive.getinfo(name)
+    if info.compress_type != zipfile.ZIP_STORED or os.name == "nt":
+        return np.lib.format.read_array(io.BytesIO(archive.read(name)))
+    with open(path, "rb") as infile:
+        # The data follows the local file header, whose name and extra field
+        # may differ in length from those of the central directory
+        infile.seek(info.header_offset + 26)
+        name_length, extra_length = struct.unpack("<2H", infile.read(4))
+        infile.seek(name_length + extra_length, os.SEEK_CUR)
+        version = np.lib.format.read_magic(infile)
+        if version == (1, 0):
+            read_header = np.lib.format.read_array_header_1_0
+        else:
+            read_header = np.lib.format.read_array_header_2_0
+        shape, fortran_order, dtype = read_header(infile)
+        offset = infile.tell()
+    if np.prod(shape) == 0:
+        # Empty files cannot be mapped
+        return np.zeros(shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="c", offset=offset, shape=shape,
+                     order="F" if fortran_order else "C")
+
+
+def save_session_data(output_file_name, session_data, compress_stats=False):
+    """Save session data to a session file (see module docstring). The global
+    properties are compressed if compress_stats is True, and then loaded
+    whole rather than memory-mapped.
+
+    The session is written to a temporary file, which then replaces the
+    file: the arrays may be memory-mapped from the file being replaced (if
+    the session was loaded from it), and it must not change under them."""
+    header = dict(session_data, format=SESSION_FORMAT)
+    header["model_data"] = [
+        {key: value for key, value in data.items()
+         if key not in SESSION_ARRAYS}
+        for data in session_data["model_data"]]
+    directory = os.path.dirname(os.path.abspath(output_file_name))
+    handle, temp_name = tempfile.mkstemp(suffix=".tmp", dir=directory)
+    os.close(handle)
+    try:
+        with zipfile.ZipFile(temp_name, "w", zipfile.ZIP_DEFLATED,
+                             allowZip64=True) as archive:
+            archive.writestr(SESSION_HEADER, json.dumps(header))
+            for i, data in enumerate(session_data["model_data"]):
+                prefix = "model_data/{}/".format(i)
+                _write_array(archive, prefix + "state.npy",
+                             np.array(data["state"], dtype=float),
+                             compress=True)
+                _write_array(archive, prefix + "global_stats.npy",
+                             np.asarray(data["global_stats"], dtype=float),
+                             compress=compress_stats)
+        # mkstemp makes the file private to the user
+        os.chmod(temp_name, 0o644)
+        # Mappings of the replaced file stay valid
+        replace_file(temp_name, output_file_name)
+    except BaseException:
+        os.remove(temp_name)
+        raise
 
 
 def load_session_data(input_file_name):
-    """Load and return session data from a json file."""
-    with open(input_file_name, "r") as infile:
-        session_data = json.load(infile)
+    """Load and return session data from a session file, or from a json file
+    saved by an older version. The global properties of a session file are
+    memory-mapped unless compressed (see module docstring)."""
+    if not zipfile.is_zipfile(input_file_name):
+        with open(input_file_name, "r") as infile:
+            session_data = json.load(infile)
+        return session_data
+    with zipfile.ZipFile(input_file_name, "r") as archive:
+        session_data = json.loads(archive.read(SESSION_HEADER))
+        if session_data.pop("format", SESSION_FORMAT) > SESSION_FORMAT:
+            raise IOError("Failed to open session. It was saved by a newer "
+                          "version.")
+        for i, data in enumerate(session_data["model_data"]):
+            for name in SESSION_ARRAYS:
+                data[name] = _read_array(
+                    archive, "model_data/{}/{}.npy".format(i, name),
+                    input_file_name)
     return session_data
 
 
@@ -42,6 +42,11 @@ CORE_RADIUS = 0.1
 FIELD_SIZE = 10.0
 # Number of global properties (order parameters)
 N_GLOBAL_STATS = 6
+# Number of most recent steps shown in plots of global properties
+PLOT_STEPS = 200
+# Random seed of the initial state of every individual in evolve by property,
+# fixed so that fitnesses can be reused across runs (see model.cache)
+EVOLUTION_SEED = 0
 
 PARAM = {
     "main": [
@@ -176,9 +181,11 @@ GENERAL_SETTINGS = {
     "show_tail_value": [5.0, 0.5],
     "show_movement": 0,
     "show_movement_value": 5,
+    "show_movement_adaptive": 0,
     "zoom_in": 0,
     "zoom_in_value": 2.0,
     "periodic_boundary": 0,
+    "parallel_update": 0,
 }
 
 GLOBAL_STATS_DISPLAY = {
@@ -195,7 +202,10 @@ GLOBAL_STATS_NAMES_INV = {name: i for i, name in enumerate(GLOBAL_STATS_NAMES)}
 EVOLVE_PROPERTY_SETTINGS = {
     "which_prop": "Group Angular Momentum",
     "num_gen": 10,
-    "equi_range": (100, 200)
+    "equi_range": (100, 200),
+    "pop_size": 9,
+    "selection": "elitist",
+    "racing": 0
 }
 
 ADVANCED_MUTATE = {_: 1 for _ in PARAM_INFO}
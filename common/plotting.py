@@ -5,18 +5,69 @@ SimPlotWidget: plots the states of the agent-based simulation itself.
 
 PropertyPlotWidget: plots the global property statistics across time.
 
+SimPlotWidget keeps its artists (a trace collection and a scatter per
+species) from one plot to the next, updates their data in place from arrays,
+and redraws them over a saved blank background (blitting) rather than
+redrawing the whole figure. A plot of an unchanged state is skipped. Every
+plot is timed by FRAME_TIMER, whose report is shown by Control >> Render
+Times.
+
 """
+import time
+from collections import deque
 
+import numpy as np
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 from matplotlib.collections import LineCollection
 from matplotlib.figure import Figure
 from matplotlib.ticker import MaxNLocator
 
-from common.parameters import FIELD_SIZE
+from common.parameters import FIELD_SIZE, PLOT_STEPS
+from common.profiling import PROFILER
 from common.styles import CELL_ALPHA, CELL_COLORS
 from common.tools import counts2slices
 
 
+class FrameTimer(object):
+    """Counts and times the plots of simulations.
+
+    Methods:
+        add: Record the time taken by a plot.
+        skip: Count a plot skipped because nothing changed.
+        report: Return a summary of recent plot times.
+
+    Attributes:
+        times (deque): Seconds taken by the most recent plots.
+        n_drawn, n_skipped (int): Number of plots drawn and skipped.
+    """
+    def __init__(self, window=200):
+        """
+        Parameters:
+            window (int): Number of recent plots whose times are kept.
+        """
+        self.times = deque(maxlen=window)
+        self.n_drawn = self.n_skipped = 0
+
+    def add(self, seconds):
+        self.times.append(seconds)
+        self.n_drawn += 1
+
+    def skip(self):
+        self.n_skipped += 1
+
+    def report(self):
+        if not self.times:
+            return "No simulation plotted yet."
+        times = np.array(self.times) * 1000
+        return ("{} plots drawn, {} skipped (unchanged).\n"
+                "Last {}: mean {:.1f} ms, max {:.1f} ms per plot.".format(
+                    self.n_drawn, self.n_skipped, len(times), times.mean(),
+                    times.max()))
+
+
+FRAME_TIMER = FrameTimer()
+
+
 class SimPlotWidget(object):
     """A class for creating and updating simulation plots.
 
@@ -44,14 +95,30 @@ class SimPlotWidget(object):
         self.ax = figure.add_subplot(111)
         # Don't display axis frame
         self.ax.axis("off")
+        # Velocity traces and particles of each species, in drawing order
+        self.traces, self.scatters, self.artists = [], [], []
+        for color, alpha in zip(CELL_COLORS, CELL_ALPHA):
+            trace = LineCollection([], colors=color, linewidths=1)
+            self.ax.add_collection(trace)
+            scatter = self.ax.scatter([], [], color=color, linewidths=0,
+                                      alpha=alpha)
+            self.traces.append(trace)
+            self.scatters.append(scatter)
+            self.artists += [trace, scatter]
         # Integrate matplotlib Figure with Tkinter widget
         self.canvas = FigureCanvasTkAgg(figure, master=parent)
         self.canvas.show()
         self.widget = self.canvas.get_tk_widget()
         # Calculate the display size of particles
         self.part_size = (figsize[0]*100)**2  # MAYBETODO
+        # The plot without particles, and where it was taken
+        self.background = None
+        self._background_bounds = None
+        self._scale_factor = None
+        # What was plotted last, to skip plotting it again
+        self._plotted = None
 
-    def plot_sim(self, session, sim):
+    def plot_sim(self, session, sim, state=None):
         """Plot simulation given particle state.
 
         Parameters:
@@ -59,44 +126,72 @@ class SimPlotWidget(object):
                 data, parameters and settings.
             sim (Simulation): The Simulation object with state data to be
                 plotted.
+            state (tuple): Positions and directions to plot instead of the
+                current state of sim, e.g. a recorded frame.
 
         """
+        start_time = time.time()
         # High-level display parameters
         scale_factor = session.sf
         multiplier, alpha = session.vt
-        # Positions and directions of particles
-        x_pos, y_pos, x_dir, y_dir = sim.state
         # Velocity magnitudes for each species
         species_velocity = sim.params["Velocity"]
+        # Skip if the same state is plotted the same way
+        plotted = (sim.phenotype, state, (sim.step, scale_factor, multiplier,
+                                          alpha, tuple(species_velocity)))
+        last = self._plotted
+        if (last is not None and plotted[0] is last[0] and
+                plotted[1] is last[1] and plotted[2] == last[2]):
+            FRAME_TIMER.skip()
+            return
+        self._plotted = plotted
+        # Positions and directions of particles
+        x_pos, y_pos, x_dir, y_dir = sim.state if state is None else state
         # Display size of particles adjusted by scale factor
         adjusted_size = self.part_size/100. * 3.14 * (0.08 * scale_factor)**2
-        # Clear plot
-        self.ax.cla()
-        # For each species
-        for k, each_slice in enumerate(counts2slices(sim.n_per_species)):
-            # Plot velocity traces
+        slices = counts2slices(sim.n_per_species)
+        for k, (trace, scatter) in enumerate(zip(self.traces, self.scatters)):
+            each_slice = slices[k] if k < len(slices) else slice(0, 0)
+            positions = np.column_stack([x_pos[each_slice],
+                                         y_pos[each_slice]])
+            # Plot velocity traces, from each particle backwards
             if multiplier > 0:
-                segs = []
-                # Add each particle's trace to the line collection
-                for j in range(each_slice.start, each_slice.stop):
-                    segs.append(
-                        # Start coordinates
-                        ((x_pos[j], y_pos[j]),
-                         # End coordinates
-                         (x_pos[j] - x_dir[j]*multiplier*species_velocity[k],
-                          y_pos[j] - y_dir[j]*multiplier*species_velocity[k]))
-                    )
-                ln_coll = LineCollection(segs, colors=CELL_COLORS[k],
-                                         linewidths=1, alpha=alpha)
-                self.ax.add_collection(ln_coll)
+                ends = positions - np.column_stack(
+                    [x_dir[each_slice], y_dir[each_slice]]) * (
+                        multiplier * species_velocity[k])
+                trace.set_segments(np.stack([positions, ends], axis=1))
+                trace.set_alpha(alpha)
+            trace.set_visible(multiplier > 0)
             # Plot particles themselves
-            self.ax.scatter(
-                x_pos[each_slice], y_pos[each_slice], s=adjusted_size,
-                color=CELL_COLORS[k], linewidths=0, alpha=CELL_ALPHA[k]
-            )
-        self._update_axis_limits(scale_factor)
-        self.ax.axis('off')
-        self.canvas.draw()
+            scatter.set_offsets(positions)
+            scatter.set_sizes([adjusted_size])
+        if scale_factor != self._scale_factor:
+            self._scale_factor = scale_factor
+            self._update_axis_limits(scale_factor)
+            self.background = None
+        self._blit()
+        elapsed = time.time() - start_time
+        FRAME_TIMER.add(elapsed)
+        PROFILER.add("render sim", "gui", start_time, elapsed)
+
+    def _blit(self):
+        """Draw the particles over the background, taking the background
+        first if there is none or the figure has been resized."""
+        bounds = self.ax.bbox.bounds
+        if self.background is None or bounds != self._background_bounds:
+            visible = [artist.get_visible() for artist in self.artists]
+            for artist in self.artists:
+                artist.set_visible(False)
+            self.canvas.draw()
+            self.background = self.canvas.copy_from_bbox(self.ax.bbox)
+            self._background_bounds = bounds
+            for artist, each in zip(self.artists, visible):
+                artist.set_visible(each)
+        self.canvas.restore_region(self.background)
+        for artist in self.artists:
+            if artist.get_visible():
+                self.ax.draw_artist(artist)
+        self.canvas.blit(self.ax.bbox)
 
     def _update_axis_limits(self, scale_factor):
         """Adjust limits of the plot according to scale factor."""
@@ -177,7 +272,10 @@ class PropertyPlotWidget(object):
                 to be plotted.
 
         """
+        start_time = time.time()
         global_stats = sim.global_stats
+        # Absolute step of each column (only sampled steps are stored)
+        steps = sim.stats.steps
         display_setting = session.global_stats_display
         ax = self.ax
         # Clear plot
@@ -185,12 +283,12 @@ class PropertyPlotWidget(object):
 
         def process(values):
             """Process raw data and return x, y pairs for line plot. Truncate
-            data so that only 200 time steps are displayed.
+            data so that only PLOT_STEPS time steps are displayed.
             """
-            x_coords = range(len(values))
-            if len(values) > 200:
-                values = values[-200:]
-                x_coords = x_coords[-200:]
+            x_coords = steps[:len(values)]
+            if len(values) > PLOT_STEPS:
+                values = values[-PLOT_STEPS:]
+                x_coords = x_coords[-PLOT_STEPS:]
             return x_coords, values
         linewidth = 1
         # Colors and labels for different global properties
@@ -210,6 +308,8 @@ class PropertyPlotWidget(object):
         if global_stats[0, :].size == 0:
             ax.set_ylim([-1., 1])
         self.canvas.draw()
+        PROFILER.add("render stats", "gui", start_time,
+                     time.time() - start_time)
 
     def grid(self, *args, **kwargs):
         """Pass .grid() function call to the Tkinter widget to simplify code.
@@ -0,0 +1,184 @@
+"""This module times the stages of the simulation pipeline: ticks, stats
+appends, communication with worker processes, bindings and plots.
+
+Code times a stage with ``PROFILER.span(name, category)``, a context manager.
+While profiling is off, which is the default, a span does nothing. While it
+is on, the profiler adds up the time taken by each stage (see ``report``),
+and keeps the most recent MAX_EVENTS spans as a timeline, which can be saved
+as a Chrome trace (see ``export_trace``; open it in chrome://tracing or
+https://ui.perfetto.dev). Worker processes record the spans of their ticks
+and evaluations too, and send them back with their results (see
+model.workers).
+
+Profiling is turned on from the start if the environment variable
+SOIE_PROFILE is set (to anything but "" or "0"); if it is set to a path
+ending in ".json", the timeline is also saved there when the program exits.
+In the GUI, it is turned on and off, and the report and timeline are shown
+and saved, from Control >> Profiling.
+"""
+
+import atexit
+import json
+import os
+import threading
+import time
+from collections import deque
+
+PROFILE_ENV = "SOIE_PROFILE"
+# Number of spans kept for the timeline
+MAX_EVENTS = 200000
+
+
+class _Span(object):
+    """A span being timed; see Profiler.span."""
+    __slots__ = ["profiler", "name", "category", "args", "start"]
+
+    def __init__(self, profiler, name, category, args):
+        self.profiler = profiler
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.add(self.name, self.category, self.start,
+                          time.time() - self.start, self.args)
+        return False
+
+
+class _NoSpan(object):
+    """The span returned while profiling is off."""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+class Profiler(object):
+    """Times the stages of the simulation pipeline.
+
+    Methods:
+        span: Return a context manager timing a stage.
+        add: Record a span timed elsewhere.
+        drain, merge: Take the spans recorded so far, and add spans taken
+            from another profiler (typically in another process).
+        report: Return the time taken by each stage, as text.
+        export_trace: Save the timeline as a Chrome trace.
+        reset: Forget all spans.
+
+    Attributes:
+        enabled (bool): Whether spans are recorded.
+        totals (dict): [count, seconds, max seconds] of each stage, by name.
+        events (deque): The most recent spans, as tuples of (name,
+            category, start, duration, pid, tid, args).
+    """
+    def __init__(self, enabled=False, max_events=MAX_EVENTS):
+        self.enabled = enabled
+        self.totals = {}
+        self.events = deque(maxlen=max_events)
+        # Names of the threads that recorded spans, by (pid, tid)
+        self.thread_names = {}
+        self._lock = threading.Lock()
+
+    def span(self, name, category="", **args):
+        """Return a context manager that records the time taken by its body
+        as a span of the stage name (in a category, and with some arguments
+        shown in the timeline), if profiling is on."""
+        if not self.enabled:
+            return _NO_SPAN
+        return _Span(self, name, category, args)
+
+    def add(self, name, category, start, duration, args=None, pid=None,
+            tid=None):
+        """Record a span of the stage name from time start (in seconds since
+        the epoch), lasting duration seconds; by default, in the current
+        thread of this process. Nothing is recorded if profiling is off."""
+        if not self.enabled:
+            return
+        if pid is None:
+            pid = os.getpid()
+        if tid is None:
+            thread = threading.current_thread()
+            tid = thread.ident
+            if (pid, tid) not in self.thread_names:
+                self.thread_names[(pid, tid)] = thread.name
+        with self._lock:
+            total = self.totals.get(name)
+            if total is None:
+                total = self.totals[name] = [0, 0., 0.]
+            total[0] += 1
+            total[1] += duration
+            total[2] = max(total[2], duration)
+            self.events.append((name, category, start, duration, pid, tid,
+                                args or {}))
+
+    def drain(self):
+        """Return the spans recorded since the last drain, and forget
+        them."""
+        with self._lock:
+            events = list(self.events)
+            self.events.clear()
+            self.totals = {}
+        return events
+
+    def merge(self, events):
+        """Record spans returned by ``drain``."""
+        for name, category, start, duration, pid, tid, args in events:
+            self.add(name, category, start, duration, args, pid, tid)
+
+    def report(self):
+        """Return the number of spans, and the total, mean and maximum time
+        of each stage, from the longest in total."""
+        with self._lock:
+            totals = sorted(self.totals.items(), key=lambda x: -x[1][1])
+        if not totals:
+            return "Nothing timed yet."
+        lines = ["{:<28}{:>8}{:>12}{:>10}{:>10}".format(
+            "Stage", "Count", "Total (ms)", "Mean", "Max")]
+        for name, (count, seconds, longest) in totals:
+            lines.append("{:<28}{:>8}{:>12.1f}{:>10.2f}{:>10.2f}".format(
+                name, count, seconds * 1000, seconds * 1000 / count,
+                longest * 1000))
+        return "\n".join(lines)
+
+    def export_trace(self, path):
+        """Save the timeline as a Chrome trace (JSON) at path."""
+        with self._lock:
+            events = list(self.events)
+            thread_names = dict(self.thread_names)
+        trace = []
+        for pid in sorted(set(event[4] for event in events)):
+            trace.append({
+                "name": "process_name", "ph": "M", "pid": pid,
+                "args": {"name": "SOIE" if pid == os.getpid() else
+                         "Worker {}".format(pid)}})
+        for (pid, tid), name in thread_names.items():
+            trace.append({"name": "thread_name", "ph": "M", "pid": pid,
+                          "tid": tid, "args": {"name": name}})
+        for name, category, start, duration, pid, tid, args in events:
+            trace.append({"name": name, "cat": category, "ph": "X",
+                          "ts": start * 1e6, "dur": duration * 1e6,
+                          "pid": pid, "tid": tid, "args": args})
+        with open(path, "w") as outfile:
+            json.dump({"traceEvents": trace, "displayTimeUnit": "ms"},
+                      outfile)
+
+    def reset(self):
+        """Forget all spans."""
+        with self._lock:
+            self.totals = {}
+            self.events.clear()
+
+
+PROFILER = Profiler(
+    enabled=os.environ.get(PROFILE_ENV, "") not in ("", "0"))
+
+if os.environ.get(PROFILE_ENV, "").endswith(".json"):
+    atexit.register(PROFILER.export_trace, os.environ[PROFILE_ENV])
@@ -0,0 +1,139 @@
+"""This module streams the global properties of simulations to CSV files.
+
+A StatsStream follows one Simulation: it is bound to the simulation's
+"global_stats" and "new_stats" data (see Simulation.bind; the latter is
+posted after every chunk of a run), and each time they change, it appends
+the steps produced since its last update to the simulation's file,
+CHUNK_STEPS steps at a time. Long runs are thus exported as they go, without
+ever holding more than a chunk of rows in memory, and the files can be read
+while the simulations run on. Each row is a sampled step (see model.stats):
+the absolute step, then the values of GLOBAL_STATS_NAMES. If the simulation
+retains a bounded number of steps and discards some before they are
+written, a warning tells which.
+
+When the simulation gets a new phenotype (a new genotype, a restart, a loaded
+session...), its global properties start over, and so does the stream, in a
+new file: the files of simulation i are model_<i>.csv, model_<i>_1.csv, and so
+on, in order.
+
+``export_stats`` writes the global properties of several simulations at once,
+without streaming, and ``save_stats`` those of one to a given file.
+"""
+import os
+import warnings
+
+import numpy as np
+
+from common.parameters import GLOBAL_STATS_NAMES
+
+# Number of steps written to a file at a time
+CHUNK_STEPS = 10000
+CSV_HEADER = ",".join(["Step"] + GLOBAL_STATS_NAMES)
+CSV_FORMAT = ["%d"] + ["%.18e"] * len(GLOBAL_STATS_NAMES)
+
+
+def write_stats(outfile, stats, start_step=0):
+    """Write the rows of the global properties (GlobalStats) of the steps
+    from start_step on to an open file, a chunk at a time."""
+    first, last = np.searchsorted(stats.steps, [start_step, stats.n_steps])
+    for start in range(first, last, CHUNK_STEPS):
+        end = min(start + CHUNK_STEPS, last)
+        rows = np.column_stack([stats.steps[start:end],
+                                stats.view[:, start:end].T])
+        np.savetxt(outfile, rows, fmt=CSV_FORMAT, delimiter=",")
+
+
+def save_stats(path, stats):
+    """Write the global properties (GlobalStats) of a simulation to a CSV
+    file."""
+    with open(path, "w") as outfile:
+        outfile.write(CSV_HEADER + "\n")
+        write_stats(outfile, stats)
+
+
+class StatsStream(object):
+    """A stream of the global properties of a simulation to CSV files.
+
+    Methods:
+        update: Append the steps produced since the last update.
+        close: Stop following the simulation and close the file.
+
+    Attributes:
+        sim (Simulation): The simulation followed.
+        directory (str): Where the files are written.
+        paths (list): The files written so far, in order.
+    """
+    def __init__(self, sim, directory, follow=True):
+        """
+        Parameters:
+            follow (bool): Whether to update whenever the global properties
+                of the simulation change, rather than only when ``update`` is
+                called.
+            sim, directory: See ``Attributes``.
+        """
+        self.sim = sim
+        self.directory = directory
+        self.paths = []
+        self.follow = follow
+        self._stats = None
+        self._file = None
+        # The first absolute step not written yet
+        self._next = 0
+        if follow:
+            sim.bind("global_stats", self.update)
+            sim.bind("new_stats", self.update)
+
+    def _start_file(self):
+        """Close the current file, and start the next one."""
+        if self._file is not None:
+            self._file.close()
+        name = "model_{}".format(self.sim.id)
+        if self.paths:
+            name += "_{}".format(len(self.paths))
+        path = os.path.join(self.directory, name + ".csv")
+        self.paths.append(path)
+        self._file = open(path, "w")
+        self._file.write(CSV_HEADER + "\n")
+
+    def update(self):
+        """Append the global properties of the steps produced since the last
+        update, starting a new file if they have started over. Steps that the
+        simulation no longer retains are skipped, with a warning."""
+        stats = self.sim.stats
+        if stats is not self._stats or stats.n_steps < self._next:
+            self._start_file()
+            self._stats = stats
+            self._next = 0
+        if stats.origin > self._next:
+            warnings.warn(
+                "Steps {}-{} of simulation {} were discarded before they "
+                "could be written to {}.".format(
+                    self._next, stats.origin - 1, self.sim.id,
+                    self.paths[-1]))
+        write_stats(self._file, stats, self._next)
+        self._file.flush()
+        self._next = stats.n_steps
+
+    def close(self):
+        """Stop following the simulation and close the file."""
+        if self.follow:
+            self.sim.unbind("global_stats", self.update)
+            self.sim.unbind("new_stats", self.update)
+            self.follow = False
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def export_stats(sims, directory):
+    """Write the global properties of every simulation in sims to its file in
+    directory, and return the paths of the files."""
+    paths = []
+    for sim in sims:
+        stream = StatsStream(sim, directory, follow=False)
+        try:
+            stream.update()
+        finally:
+            stream.close()
+        paths += stream.paths
+    return paths
@@ -2,8 +2,6 @@
 UI components.
 """
 
-import Tkinter as tk
-
 from common.styles import BUTTON_X_MARGIN
 
 
@@ -36,6 +34,9 @@ def create_buttons(parent, button_dict):
         buttons (dict): A group of button widgets created. Format is
             {name: button_widget, ...}
     """
+    # Imported here so that the non-UI helpers work without Tkinter
+    import Tkinter as tk
+
     buttons = {}
     for name, attributes in button_dict.items():
         # Associate the button with a command function
@@ -12,6 +12,7 @@ from common.styles import (BODY_COLOR, BODY_FONT, BUTTON_X_MARGIN,
 from frame.edit_window_parts import (EWRatioEditor, EWQualitativeEditor,
                                      EWMainParamEditor, EWCellParamEditor,
                                      EWInteractionParamEditor)
+from frame.playback import PlaybackFrame
 from frame.top import AddStepsWidget
 
 
@@ -151,7 +152,10 @@ class EditFrame(tk.Frame):
 
 class EditWindow(tk.Frame):
     """A window for the user to view large size simulation and global property
-    plots and manually adjust the parameters of the simulation.
+    plots and manually adjust the parameters of the simulation. The
+    simulation can be recorded and played back (see frame/playback.py).
+    While the window is open, the simulation runs before others in the
+    background (see model.scheduler).
 
     Methods:
         update_graph: Update simulation graph.
@@ -168,7 +172,7 @@ class EditWindow(tk.Frame):
             sim (Simulation): The simulation associated with this window.
 
         """
-        tk.Frame.__init__(self, master, height=693, width=844)
+        tk.Frame.__init__(self, master, height=728, width=844)
         self.grid_propagate(False)
         self.grid()
         self.master = master
@@ -180,14 +184,18 @@ class EditWindow(tk.Frame):
         sim.bind("global_stats", self.update_global_stats, first=True)
         sim.bind("state", self.update_graph, first=True)
         self.sim = sim
+        sim.scheduler.set_focus(sim)
         # Set window title
         master.wm_title("Edit Simulation")
         # Set actions when closing the window
         master.protocol('WM_DELETE_WINDOW', self._close)
         # Make edit panel
         self.edit_frame = EditFrame(self, session, sim)
-        # Make simulation graph panel
+        # Make simulation graph panel, with playback controls
         self.graph_widget = SimPlotWidget(self, large_size=True)
+        # The recorded state shown, or None for the current one
+        self.shown_state = None
+        self.playback = PlaybackFrame(self, sim, self._show_state)
         self.update_graph()
         # Make global property plot panel
         property_label = tk.Label(self, text="Global Properties",
@@ -195,14 +203,21 @@ class EditWindow(tk.Frame):
         self.property_widget = PropertyPlotWidget(self, large_size=True)
         self.update_global_stats()
         # Set layout
-        self.edit_frame.grid(column=0, row=0, rowspan=3)
+        self.edit_frame.grid(column=0, row=0, rowspan=4)
         self.graph_widget.grid(column=1, row=0, padx=(0, 8), pady=(8, 0))
-        property_label.grid(column=1, row=1, sticky="w", padx=(5, 0), pady=0)
-        self.property_widget.grid(column=1, row=2)
+        self.playback.grid(column=1, row=1, sticky="w", pady=(2, 0))
+        property_label.grid(column=1, row=2, sticky="w", padx=(5, 0), pady=0)
+        self.property_widget.grid(column=1, row=3)
 
     def update_graph(self):
         """Update simulation graph."""
-        self.graph_widget.plot_sim(self.session, self.sim)
+        self.playback.update_recording()
+        self.graph_widget.plot_sim(self.session, self.sim, self.shown_state)
+
+    def _show_state(self, state):
+        """Show a recorded state, or the current one if state is None."""
+        self.shown_state = state
+        self.graph_widget.plot_sim(self.session, self.sim, state)
 
     def update_global_stats(self):
         """Update global property plots."""
@@ -214,5 +229,8 @@ class EditWindow(tk.Frame):
         self.sim.unbind("state", self.update_graph)
         self.sim.unbind("global_stats", self.update_global_stats)
         self.edit_frame.unbind_()
+        self.playback.close()
+        if self.sim.scheduler.focus is self.sim:
+            self.sim.scheduler.set_focus(None)
         self.master.destroy()
         self.parent.unfreeze()
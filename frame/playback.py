@@ -0,0 +1,199 @@
+"""This module contains PlaybackFrame, the controls of EditWindow for recording
+the trajectory of its simulation and playing it back.
+
+While "Record" is on, the model of the simulation records its state at every
+step to a temporary trajectory (see model/trajectory.py), which starts over
+whenever the simulation gets a new phenotype. Any recorded step can then be
+shown, with the slider or by playing the recording at one of SPEEDS, without
+running the simulation again: frames are read from disk as they are needed,
+and decoded ahead of playback on a background thread (see FramePrefetcher).
+The recording is deleted when "Record" is turned off or the window closes.
+"""
+
+import shutil
+import tempfile
+import Tkinter as tk
+
+from common.styles import BODY_COLOR, BODY_FONT, BUTTON_X_MARGIN
+from model.trajectory import FramePrefetcher
+
+# Frames played per FRAME_INTERVAL, by label
+SPEEDS = [("0.25x", 0.25), ("0.5x", 0.5), ("1x", 1.), ("2x", 2.),
+          ("4x", 4.), ("8x", 8.)]
+# Milliseconds between two frames shown
+FRAME_INTERVAL = 40
+# Steps from one recorded frame to the next
+RECORD_EVERY = 1
+PLAY, PAUSE = u"\u25b6", u"\u275a\u275a"
+
+
+class PlaybackFrame(tk.Frame):
+    """Controls for recording the trajectory of a simulation and playing it
+    back.
+
+    Methods:
+        update_recording: Keep up with a change in the state of the
+            simulation.
+        close: Stop playing and recording.
+
+    Attributes:
+        sim (Simulation): The simulation recorded.
+        frame (int): The recorded frame shown, or None if the current state
+            of the simulation is shown.
+    """
+    def __init__(self, parent, sim, show_func):
+        """
+        Parameters:
+            parent (tk.Frame): The Tkinter parent of this widget.
+            show_func (function): Called as show_func(state) to show a
+                recorded state, and show_func(None) to show the current one.
+            sim: See ``Attributes``.
+        """
+        tk.Frame.__init__(self, parent)
+        self.sim = sim
+        self.show_func = show_func
+        self.frame = None
+        self.model = None
+        self.path = None
+        self.prefetcher = None
+        self.playing = False
+        # Pending call of _play, if playing
+        self._after_id = None
+        # Position of playback, in frames (fractional at slow speeds)
+        self.position = 0.
+        self.recording = tk.IntVar(value=0)
+        self.speed = tk.StringVar(value="1x")
+        self.step_strvar = tk.StringVar(value="Live")
+
+        self.record_button = tk.Checkbutton(
+            self, text="Record", variable=self.recording,
+            command=self._toggle_recording, font=BODY_FONT, fg=BODY_COLOR)
+        self.play_button = tk.Button(
+            self, text=PLAY, width=2, command=self._toggle_play,
+            state=tk.DISABLED)
+        self.slider = tk.Scale(
+            self, orient=tk.HORIZONTAL, showvalue=0, from_=0, to=0,
+            length=180, command=self._seek, state=tk.DISABLED)
+        self.step_label = tk.Label(
+            self, textvariable=self.step_strvar, width=11, anchor="w",
+            font=BODY_FONT, fg=BODY_COLOR)
+        self.speed_menu = tk.OptionMenu(
+            self, self.speed, *[label for label, _ in SPEEDS])
+        self.speed_menu.config(font=BODY_FONT, width=4)
+        self.live_button = tk.Button(
+            self, text="Live", command=self.show_live,
+            padx=BUTTON_X_MARGIN, state=tk.DISABLED)
+        for i, each in enumerate([self.record_button, self.play_button,
+                                  self.slider, self.step_label,
+                                  self.speed_menu, self.live_button]):
+            each.grid(row=0, column=i, padx=2)
+
+    def update_recording(self):
+        """Keep up with a change in the state of the simulation: start a new
+        recording if it has a new phenotype, and extend the slider to the
+        frames recorded since."""
+        if self.prefetcher is None:
+            return
+        if self.sim.phenotype.model is not self.model:
+            self._stop_recording()
+            self._start_recording()
+            return
+        self.prefetcher.refresh()
+        self.slider.config(to=max(len(self.prefetcher) - 1, 0))
+
+    def _toggle_recording(self):
+        if self.recording.get():
+            self._start_recording()
+        else:
+            self._stop_recording()
+
+    def _start_recording(self):
+        self.model = self.sim.phenotype.model
+        self.path = tempfile.mkdtemp(prefix="soie-trajectory-")
+        self.model.record_trajectory(self.path, every=RECORD_EVERY)
+        self.prefetcher = FramePrefetcher(self.path)
+        self.slider.config(state=tk.NORMAL, from_=0, to=0)
+        self.play_button.config(state=tk.NORMAL)
+        self.live_button.config(state=tk.NORMAL)
+        self.show_live()
+
+    def _stop_recording(self):
+        self.show_live()
+        if self.prefetcher is not None:
+            self.prefetcher.close()
+            self.prefetcher = None
+        if self.model is not None:
+            self.model.recorder = None
+            self.model = None
+        if self.path is not None:
+            # Also stops copies of the recorder in worker processes
+            shutil.rmtree(self.path, ignore_errors=True)
+            self.path = None
+        self.slider.config(from_=0, to=0, state=tk.DISABLED)
+        self.play_button.config(state=tk.DISABLED)
+        self.live_button.config(state=tk.DISABLED)
+
+    def _show(self, i):
+        """Show recorded frame i."""
+        self.frame = i
+        self.step_strvar.set("Step = {}".format(
+            self.prefetcher.trajectory.steps[i]))
+        self.show_func(self.prefetcher.get(i))
+
+    def _pause(self):
+        self.playing = False
+        self.play_button.config(text=PLAY)
+        if self._after_id is not None:
+            self.after_cancel(self._after_id)
+            self._after_id = None
+
+    def show_live(self):
+        """Stop playing, and show the current state of the simulation."""
+        self._pause()
+        if self.frame is not None:
+            self.frame = None
+            self.show_func(None)
+        self.step_strvar.set("Live")
+
+    def _seek(self, value):
+        """Show the frame chosen with the slider."""
+        i = int(value)
+        if self.prefetcher is None or i == self.frame or i >= len(
+                self.prefetcher):
+            return
+        self.position = i
+        self._show(i)
+
+    def _toggle_play(self):
+        if self.playing:
+            self._pause()
+            return
+        self.update_recording()
+        if len(self.prefetcher) == 0:
+            return
+        if self.frame is None or self.frame == len(self.prefetcher) - 1:
+            # Play from the start
+            self.position = 0.
+        self.playing = True
+        self.play_button.config(text=PAUSE)
+        self._play()
+
+    def _play(self):
+        """Show the next frame at the chosen speed, and schedule the one
+        after, until the end of the recording."""
+        self._after_id = None
+        if not self.playing or self.prefetcher is None:
+            return
+        i = min(int(self.position), len(self.prefetcher) - 1)
+        self._show(i)
+        # After _show, so that the slider does not seek the same frame
+        self.slider.set(i)
+        if i == len(self.prefetcher) - 1:
+            self._pause()
+            return
+        self.position += dict(SPEEDS)[self.speed.get()]
+        self._after_id = self.after(FRAME_INTERVAL, self._play)
+
+    def close(self):
+        """Stop playing and recording."""
+        self._stop_recording()
@@ -49,7 +49,6 @@ class GraphFrame(tk.Frame):
 
     def update_graph(self):
         self.widget.plot_sim(self.session, self.sim)
-        self.update()
 
     def bind_(self):
         self.widget.bind("<Button-2>", self.popup)
@@ -92,7 +91,9 @@ class GraphFrame(tk.Frame):
         if self.state == "DISABLED": return
         self.freeze()
         t = tk.Toplevel(self)
-        self.edit_window = EditWindow(self, t, self.session, self.sim)
+        # Plots the simulation, which may be running in the background
+        with self.sim.scheduler.lock:
+            self.edit_window = EditWindow(self, t, self.session, self.sim)
 
     def copy(self):
         self.parent.copied = self.sim.genotype.copy_param()
@@ -286,22 +286,29 @@ class EvolvingFrame(tk.Frame):
 
         self.buttons = create_buttons(self, {
             "cancel": ["<Back", 0, 0], # \u21a9
+            "stop": ["Stop", 0, 2],
         })
 
         #self.buttons["ok"].grid_remove()
         self.buttons["cancel"].grid(sticky="w")
         self.buttons["cancel"].grid_remove()
+        self.buttons["stop"].grid(sticky="e")
 
         for i, weight in enumerate([1,1,1]):
             self.columnconfigure(i, weight=weight, minsize=50)
 
     def grid_(self):
         self.buttons["cancel"].grid_remove()
+        self.buttons["stop"].grid()
         self.display_text.set("")
         self.grid()
 
     def done(self):
+        self.buttons["stop"].grid_remove()
         self.buttons["cancel"].grid()
 
+    def stop(self):
+        self.parent.stop_evolution()
+
     def cancel(self):
         self.parent.back_to_home_topframe()
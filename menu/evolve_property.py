@@ -2,9 +2,10 @@ import Tkinter as tk
 import tkMessageBox
 from copy import deepcopy
 
-from common.parameters import GLOBAL_STATS_NAMES
+from common.parameters import EVOLVE_PROPERTY_SETTINGS, GLOBAL_STATS_NAMES
 from common.styles import BODY_COLOR, BODY_FONT
 from common.tools import is_within
+from model.evolution import SELECTIONS
 
 
 class EvolvePropertyWindow(tk.Frame):
@@ -57,12 +58,34 @@ class EvolvePropertyWindow(tk.Frame):
         self.equi_range_entry1 = tk.Entry(self, width=3, validate="all", validatecommand=is_int_vcmd, font=BODY_FONT, fg=BODY_COLOR)
         self.equi_range_entry1.grid(row=2, column=3, sticky="w", pady=spacing)
 
+        # Number of individuals in each generation
+        self.pop_size_label = tk.Label(self, text="Population size:", font=BODY_FONT, fg=BODY_COLOR)
+        self.pop_size_label.grid(row=3, column=0, pady=spacing)
+
+        self.pop_size_entry = tk.Entry(self, width=3, validate="all", validatecommand=is_int_vcmd, font=BODY_FONT, fg=BODY_COLOR)
+        self.pop_size_entry.grid(row=3, column=1, columnspan=3, pady=spacing)
+
+        # How parents are selected
+        self.selection_label = tk.Label(self, text="Selection:", font=BODY_FONT, fg=BODY_COLOR)
+        self.selection_label.grid(row=4, column=0, pady=spacing)
+
+        self.selection = tk.StringVar()
+        self.selection_menu = tk.OptionMenu(self, self.selection, *SELECTIONS)
+        self.selection_menu.config(width=20, font=BODY_FONT)
+        self.selection_menu.grid(row=4, column=1, columnspan=3, pady=spacing)
+
+        # Number of rungs of a race (0: no racing)
+        self.racing_label = tk.Label(self, text="Racing rungs:", font=BODY_FONT, fg=BODY_COLOR)
+        self.racing_label.grid(row=5, column=0, pady=spacing)
+
+        self.racing_entry = tk.Entry(self, width=3, validate="all", validatecommand=is_int_vcmd, font=BODY_FONT, fg=BODY_COLOR)
+        self.racing_entry.grid(row=5, column=1, columnspan=3, pady=spacing)
 
         # Buttons
         self.default_button = tk.Button(self, text="Default", width=7, command=self.default)
         self.evolve_button = tk.Button(self, text="Evolve!", width=7, command=self.evolve)
-        self.default_button.grid(row=3, column=1, sticky="e", padx=3, pady=(10,0))
-        self.evolve_button.grid(row=3, column=3, sticky="w", padx=3, pady=(10,0))
+        self.default_button.grid(row=6, column=1, sticky="e", padx=3, pady=(10,0))
+        self.evolve_button.grid(row=6, column=3, sticky="w", padx=3, pady=(10,0))
 
         self.columnconfigure(0, weight=5)
         self.columnconfigure(1, weight=2)
@@ -83,30 +106,47 @@ class EvolvePropertyWindow(tk.Frame):
         self.equi_range_entry0.insert(0,settings["equi_range"][0])
         self.equi_range_entry1.delete(0,tk.END)
         self.equi_range_entry1.insert(0,settings["equi_range"][1])
+        self.pop_size_entry.delete(0,tk.END)
+        self.pop_size_entry.insert(0,settings.get("pop_size", EVOLVE_PROPERTY_SETTINGS["pop_size"]))
+        self.selection.set(settings.get("selection", EVOLVE_PROPERTY_SETTINGS["selection"]))
+        self.racing_entry.delete(0,tk.END)
+        self.racing_entry.insert(0,settings.get("racing", EVOLVE_PROPERTY_SETTINGS["racing"]))
 
     def evolve(self):
         num_gen = self.num_gen_entry.get()
         equi_range0 = self.equi_range_entry0.get()
         equi_range1 = self.equi_range_entry1.get()
-        if (num_gen=="") or (equi_range0=="") or (equi_range1==""):
+        pop_size = self.pop_size_entry.get()
+        racing = self.racing_entry.get()
+        if (num_gen=="") or (equi_range0=="") or (equi_range1=="") or (pop_size=="") or (racing==""):
             return
 
         num_gen = int(num_gen)
         equi_range0 = int(equi_range0)
         equi_range1 = int(equi_range1)
+        pop_size = int(pop_size)
+        racing = int(racing)
 
         if (equi_range0 >= equi_range1):
             tkMessageBox.showerror("Invalid Input", "Please enter a valid step range!")
             return
+        if (pop_size < 2):
+            tkMessageBox.showerror("Invalid Input", "Please enter a population size of at least 2!")
+            return
+        if (racing == 1) or (racing > equi_range1 - equi_range0):
+            tkMessageBox.showerror("Invalid Input", "Please enter 0 (no racing) or at least 2 racing rungs, and no more than the steps in the range!")
+            return
 
         new_settings = {
             "which_prop" : self.which_prop.get(),
             "num_gen" : num_gen,
-            "equi_range": (equi_range0, equi_range1)
+            "equi_range": (equi_range0, equi_range1),
+            "pop_size": pop_size,
+            "selection": self.selection.get(),
+            "racing": racing
         }
         self.func(new_settings)
 
     def default(self):
-        from common.parameters import EVOLVE_PROPERTY_SETTINGS
         new_settings= deepcopy(EVOLVE_PROPERTY_SETTINGS)
         self.set_values(new_settings)
@@ -212,6 +212,11 @@ class ShowMovementEditor(tk.Frame):
         self.label2 = tk.Label(self, text="time step(s)", font=GENERAL_SETTINGS_SM_FONT, fg=BODY_COLOR)
         self.label2.grid(row=0, column=2)
 
+        # As often as the display keeps up, instead of every few steps
+        self.adaptive_intvar = tk.IntVar()
+        self.adaptive_check = tk.Checkbutton(self, text="or adapt to frame rate", variable=self.adaptive_intvar, command=self.adaptive_click, font=GENERAL_SETTINGS_SM_FONT, fg=BODY_COLOR)
+        self.adaptive_check.grid(row=1, column=0, columnspan=3, sticky="w")
+
         self.entry.bind('<Return>', self.update_value)
         self.entry.bind('<FocusOut>', self.update_value)
 
@@ -234,6 +239,21 @@ class ShowMovementEditor(tk.Frame):
     def get(self):
         return self.value
 
+    def set_adaptive(self, adaptive):
+        self.adaptive_intvar.set(adaptive)
+        self.adaptive_click()
+
+    def get_adaptive(self):
+        return self.adaptive_intvar.get()
+
+    def adaptive_click(self):
+        state = "disabled" if self.adaptive_intvar.get() else "normal"
+        if self.adaptive_check["state"] == "disabled":
+            return
+        self.entry["state"] = state
+        self.label1["state"] = state
+        self.label2["state"] = state
+
     def update_value(self, event=None):
         temp = self.entry.get()
         try:
@@ -255,11 +275,14 @@ class ShowMovementEditor(tk.Frame):
         self.entry["state"] = "disabled"
         self.label1["state"] = "disabled"
         self.label2["state"] = "disabled"
+        self.adaptive_check["state"] = "disabled"
 
     def activate(self):
+        self.adaptive_check["state"] = "normal"
         self.entry["state"] = "normal"
         self.label1["state"] = "normal"
         self.label2["state"] = "normal"
+        self.adaptive_click()
 
 class GeneralSettingsWindow(tk.Frame):
     def __init__(self, master, general_settings, func):
@@ -332,6 +355,15 @@ class GeneralSettingsWindow(tk.Frame):
             font=GENERAL_SETTINGS_LG_FONT, fg=BODY_COLOR
         )
         self.periodic_boundary_check.grid(sticky="w", pady=subframe_spacing)
+        # Parallel Update
+        self.parallel_update_intvar = tk.IntVar()
+        self.parallel_update_check = tk.Checkbutton(
+            self,
+            text = "Update Particles in Parallel",
+            variable=self.parallel_update_intvar,
+            font=GENERAL_SETTINGS_LG_FONT, fg=BODY_COLOR
+        )
+        self.parallel_update_check.grid(sticky="w", pady=subframe_spacing)
 
         # Buttons
         temp = tk.Frame(self)
@@ -369,9 +401,12 @@ class GeneralSettingsWindow(tk.Frame):
         self.show_tail_editor.set(settings["show_tail_value"])
         self.show_movement_intvar.set(settings["show_movement"])
         self.show_movement_editor.set(settings["show_movement_value"])
+        self.show_movement_editor.set_adaptive(
+            settings.get("show_movement_adaptive", 0))
         self.zoom_in_intvar.set(settings["zoom_in"])
         self.zoom_in_editor.set(settings["zoom_in_value"])
         self.periodic_boundary_intvar.set(settings["periodic_boundary"])
+        self.parallel_update_intvar.set(settings.get("parallel_update", 0))
         # Deactivate editor if checks are off
         self.show_tail_click()
         self.show_movement_click()
@@ -390,9 +425,11 @@ class GeneralSettingsWindow(tk.Frame):
            "show_tail_value" : [5.0, 0.3],
            "show_movement" : 0,
            "show_movement_value" : 5,
+           "show_movement_adaptive" : 0,
            "zoom_in" : 0,
            "zoom_in_value" : 2.0,
-           "periodic_boundary" : 0
+           "periodic_boundary" : 0,
+           "parallel_update" : 0
         }
         """
         self.last_update()
@@ -401,9 +438,11 @@ class GeneralSettingsWindow(tk.Frame):
             "show_tail_value" : self.show_tail_editor.get(),
             "show_movement" : self.show_movement_intvar.get(),
             "show_movement_value" : self.show_movement_editor.get(),
+            "show_movement_adaptive" : self.show_movement_editor.get_adaptive(),
             "zoom_in" : self.zoom_in_intvar.get(),
             "zoom_in_value" : self.zoom_in_editor.get(),
-            "periodic_boundary" : self.periodic_boundary_intvar.get()
+            "periodic_boundary" : self.periodic_boundary_intvar.get(),
+            "parallel_update" : self.parallel_update_intvar.get()
         }
         self.func(new_settings)
 
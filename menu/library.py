@@ -1,6 +1,8 @@
 import json
 import os
+import threading
 import Tkinter as tk
+from collections import OrderedDict
 
 from PIL import Image, ImageTk
 
@@ -11,9 +13,99 @@ NCOL = 5
 IMAGE_WIDTH = 108
 HALF_WIDTH = IMAGE_WIDTH/2
 SPACE = 10
+ROW_HEIGHT = SPACE+IMAGE_WIDTH
+# Number of decoded thumbnails kept
+CACHE_SIZE = 200
+# Number of rows decoded ahead of those in view, in the direction of scrolling
+PREFETCH_ROWS = 6
+
+
+class ThumbnailLoader(object):
+    """Decodes the thumbnails of saved genes, decoding those about to come
+    into view on a background thread. Decoded images are kept in a bounded
+    cache, least recently used first out.
+
+    Methods:
+        get: Return the decoded thumbnail of a gene.
+        prefetch: Have the thumbnails of some genes decoded in the
+            background.
+        close: Stop the background thread.
+
+    Attributes:
+        folder (str): Where the thumbnails are, as <gene_id>.png.
+        capacity (int): Number of decoded thumbnails kept.
+    """
+    def __init__(self, folder, capacity=CACHE_SIZE):
+        self.folder = folder
+        self.capacity = capacity
+        self._cache = OrderedDict()
+        self._condition = threading.Condition()
+        # Genes whose thumbnails are to be decoded in the background
+        self._pending = []
+        self._stopped = False
+        self._thread = threading.Thread(target=self._prefetch)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _decode(self, gene_id):
+        image = Image.open(os.path.join(self.folder, "{}.png".format(gene_id)))
+        # Decode now rather than when first drawn
+        image.load()
+        return image
+
+    def get(self, gene_id):
+        """Return the decoded thumbnail (PIL.Image) of a gene."""
+        with self._condition:
+            image = self._cache.pop(gene_id, None)
+            if image is not None:
+                self._cache[gene_id] = image
+        if image is None:
+            image = self._decode(gene_id)
+            self._store(gene_id, image)
+        return image
+
+    def _store(self, gene_id, image):
+        with self._condition:
+            self._cache.pop(gene_id, None)
+            self._cache[gene_id] = image
+            while len(self._cache) > self.capacity:
+                self._cache.popitem(last=False)
+
+    def prefetch(self, gene_ids):
+        """Have the thumbnails of some genes decoded in the background, in
+        order, instead of those asked for before and not decoded yet."""
+        with self._condition:
+            self._pending = list(gene_ids)[:self.capacity]
+            self._condition.notify()
+
+    def _prefetch(self):
+        """Main loop of the background thread."""
+        while True:
+            with self._condition:
+                while not self._pending and not self._stopped:
+                    self._condition.wait()
+                if self._stopped:
+                    return
+                gene_id = self._pending.pop(0)
+                if gene_id in self._cache:
+                    continue
+            try:
+                image = self._decode(gene_id)
+            except IOError:
+                # Deleted in the meantime
+                continue
+            self._store(gene_id, image)
+
+    def close(self):
+        """Stop the background thread."""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        self._thread.join()
+
 
 class SavedGene(object):
-    def __init__(self, parent, gene_id, data, image, x, y):
+    def __init__(self, parent, gene_id, data, x, y):
 
         self.parent = parent
         self.data = data
@@ -30,8 +122,9 @@ class SavedGene(object):
         self.click_border = self.canvas.create_rectangle(
             *coords,
             width=0, outline=ON_SELECT_COLOR)
-        self.image = self.canvas.create_image(x, y, image=image)
-        self.img = image
+        # Without a picture until shown (see CanvasGrid.show_rows)
+        self.image = self.canvas.create_image(x, y)
+        self.img = None
 
         self.canvas.tag_bind(self.image, "<Enter>", self.on_hover)
         self.canvas.tag_bind(self.image, "<Leave>", self.off_hover)
@@ -61,6 +154,14 @@ class SavedGene(object):
             #self.clicked = True
             self.parent.select_new(self)
 
+    def show_image(self, image):
+        self.img = image
+        self.canvas.itemconfigure(self.image, image=image)
+
+    def hide_image(self):
+        self.canvas.itemconfigure(self.image, image="")
+        self.img = None
+
     def unclick(self):
         self.hide_border(self.click_border)
 
@@ -75,36 +176,64 @@ class SavedGene(object):
         self.canvas.coords(self.click_border, *coords)
 
 class CanvasGrid(object):
-    def __init__(self, parent, images):
+    def __init__(self, parent, genes):
         self.parent = parent
         self.coords = []
         self.saved_genes = []
         self.height = 0
-        for each in images: self.add(each)
+        # Genes whose thumbnails are shown, and the rows they are in
+        self.shown = set()
+        self.rows = (0, -1)
+        for each in genes: self.add(each)
+
+    def show_rows(self, first, last):
+        """Show the thumbnails of the genes in rows first to last, and only
+        those, and have those of the next rows decoded in the background."""
+        prev_first = self.rows[0]
+        self.rows = (first, last)
+        visible = self.saved_genes[first*NCOL:(last+1)*NCOL]
+        for each in self.shown.difference(visible):
+            each.hide_image()
+        thumbnails = self.parent.thumbnails
+        for each in visible:
+            if each.img is None:
+                each.show_image(
+                    ImageTk.PhotoImage(thumbnails.get(each.gene_id)))
+        self.shown = set(visible)
+        if first < prev_first:
+            ahead = self.saved_genes[
+                max(first-PREFETCH_ROWS, 0)*NCOL:first*NCOL][::-1]
+        else:
+            ahead = self.saved_genes[
+                (last+1)*NCOL:(last+1+PREFETCH_ROWS)*NCOL]
+        thumbnails.prefetch([each.gene_id for each in ahead])
 
     def move_up(self, gene):
         starting = self.saved_genes.index(gene)
         self.saved_genes.remove(gene)
+        self.shown.discard(gene)
         for i, each in enumerate(self.saved_genes[starting:]):
             each.move(*self.coords[starting+i])
 
         if len(self.saved_genes) <= len(self.coords) - NCOL:
             self.coords = self.coords[:-NCOL]
-            self.height -= SPACE+IMAGE_WIDTH
+            self.height -= ROW_HEIGHT
             self.parent.set_scroll_length(self.height)
+        # Genes moved into view
+        self.show_rows(*self.rows)
 
-    def add(self, id_image):
-        gene_id, data, image = id_image
+    def add(self, id_data):
+        gene_id, data = id_data
         i = len(self.saved_genes)
         if i >= len(self.coords):
             self.expand()
         coords = self.coords[i]
-        self.saved_genes.append(SavedGene(self.parent, gene_id, data, image, *coords))
+        self.saved_genes.append(SavedGene(self.parent, gene_id, data, *coords))
 
     def expand(self):
         new_row = []
         new_y = self.height + (SPACE+IMAGE_WIDTH)/2.
-        self.height += SPACE+IMAGE_WIDTH
+        self.height += ROW_HEIGHT
         new_row = [[(c+0.5)*(SPACE+IMAGE_WIDTH),new_y] for c in range(NCOL)]
         self.coords += new_row
         self.parent.set_scroll_length(self.height)
@@ -136,7 +265,8 @@ class LibraryWindow(tk.Frame):
         self.scroll = tk.Scrollbar(self, orient=tk.VERTICAL, command=self.canvas.yview)
         self.scroll.grid(row=1, column=1, sticky="ns")
 
-        self.canvas.config(yscrollcommand=self.scroll.set)
+        # Thumbnails are only decoded and shown once in view
+        self.canvas.config(yscrollcommand=self.on_view_change)
 
         def on_vertical(event):
             self.canvas.yview_scroll(-1 * event.delta, 'units')
@@ -146,8 +276,20 @@ class LibraryWindow(tk.Frame):
         self.open_button = tk.Button(self, text="Open", width=7, command=self.open, state=tk.DISABLED)
         self.open_button.grid(columnspan=total_columns, sticky="e", padx=15, pady=(10,0))
 
+        self.canvas_grid = None
         self.load()
 
+    def on_view_change(self, first, last):
+        """Called by the canvas whenever the part in view changes (given as
+        fractions of the scroll region): update the scrollbar, and show the
+        thumbnails of the rows in view."""
+        self.scroll.set(first, last)
+        if self.canvas_grid is None:
+            return
+        height = max(CANVAS_HEIGHT, self.canvas_grid.height)
+        self.canvas_grid.show_rows(int(float(first)*height // ROW_HEIGHT),
+                                   int(float(last)*height // ROW_HEIGHT))
+
     def set_scroll_length(self, value):
         value = max(CANVAS_HEIGHT, value)
         self.canvas.config(scrollregion=(0, 0, CANVAS_WIDTH, value))
@@ -173,19 +315,23 @@ class LibraryWindow(tk.Frame):
         target_dir = os.path.join(curr_dir, "{}/params.json".format(folder_name))
 
         data = load_params(target_dir)
-        images = []
+        genes = []
         for i in range(len(data["items"])):#data
             gene_id = data["loc"][str(i)]
-            images.append((gene_id, data["items"][gene_id], ImageTk.PhotoImage(Image.open("{}/{}.png".format(folder_name,gene_id)))))
+            genes.append((gene_id, data["items"][gene_id]))
 
-        self.canvas_grid = CanvasGrid(self, images)
+        self.thumbnails = ThumbnailLoader(folder_name)
+        self.canvas_grid = CanvasGrid(self, genes)
+        # Rows in view at first, before the canvas reports its view
+        self.canvas_grid.show_rows(0, CANVAS_HEIGHT // ROW_HEIGHT)
 
     def _close(self):
+        self.thumbnails.close()
         self.master.destroy()
 
     def open(self):
         self.func(self.selected.data)
-        self.master.destroy()
+        self._close()
 
     def delete(self):
         if self.selected is not None:
@@ -1,10 +1,13 @@
 import os
 import tkFileDialog
+import tkMessageBox
 import Tkinter as tk
 from copy import deepcopy
 
-from common.io_utils import load_from_files
+from common.io_utils import SESSION_EXTENSION, load_from_files
 from common.parameters import GLOBAL_STATS_NAMES
+from common.plotting import FRAME_TIMER
+from common.profiling import PROFILER
 from menu.evolve_property import EvolvePropertyWindow
 from menu.general import GeneralSettingsWindow
 from menu.library import LibraryWindow
@@ -23,12 +26,16 @@ class MenuBar(tk.Menu):
             "Save Current Session",
             "Save All Genes to Library",
             "Save Global Properties",
+            "Save Global Properties of All Models",
+            "Start Streaming Global Properties",
+            "Stop Streaming Global Properties",
             "Clear Library",
             ##########
             "Show Velocity Trace",
             "Every 1 Step",
             "Every 5 Step",
             "Every 10 Step",
+            "Adaptive",
             "Turn Off",
             "Zoom 0.5x",
             "Zoom 1.0x",
@@ -53,7 +60,7 @@ class MenuBar(tk.Menu):
         menu.add_command(label="Open Gene from Library...", command=self.open_library)
         menu.add_command(label="Open Gene from Files...", command=self.open_from_files)
         menu.add_separator()
-        for i in range(3):
+        for i in range(6):
             menu.add_command(label=options.pop(), command=menu_bar_commands[options.pop()])
         menu.add_separator()
         menu.add_command(label=options.pop(), command=menu_bar_commands[options.pop()])
@@ -71,8 +78,9 @@ class MenuBar(tk.Menu):
         # Show movement
         submenu = tk.Menu(menu, tearoff=0)
         menu.add_cascade(label="Show Movement", menu=submenu)
-        steps=[1,5,10]
-        for i in xrange(3):
+        # Adaptive is -1, since 0 is off
+        steps=[1,5,10,-1]
+        for i in xrange(4):
             submenu.add_radiobutton(
                 label=options.pop(),
                 variable=ints["show_movement_value"],
@@ -97,6 +105,21 @@ class MenuBar(tk.Menu):
         menu.add_checkbutton(label=options.pop(), variable=ints["periodic_boundary"], command=menu_bar_commands[options.pop()])
         menu.add_separator()
         menu.add_command(label="Advanced...", command=self.open_general_settings)
+        menu.add_command(label="Render Times...", command=self.show_render_times)
+        menu.add_separator()
+        # Simulations running in the background
+        self.paused_intvar = tk.IntVar()
+        menu.add_checkbutton(label="Pause Simulations", variable=self.paused_intvar, command=self.pause_simulations)
+        menu.add_command(label="Stop Simulations", command=self.stop_simulations)
+        menu.add_separator()
+        # Timing of the stages of the simulations (see common/profiling.py)
+        self.profiling_intvar = tk.IntVar(value=int(PROFILER.enabled))
+        submenu = tk.Menu(menu, tearoff=0)
+        menu.add_cascade(label="Profiling", menu=submenu)
+        submenu.add_checkbutton(label="Enabled", variable=self.profiling_intvar, command=self.toggle_profiling)
+        submenu.add_command(label="Report...", command=self.show_profile_report)
+        submenu.add_command(label="Export Timeline...", command=self.export_profile_timeline)
+        submenu.add_command(label="Reset", command=PROFILER.reset)
 
         ############### Range Settings ################
         ints = self.range_intvars = {name:tk.IntVar() for name in
@@ -157,7 +180,7 @@ class MenuBar(tk.Menu):
 
     def open_session(self):
         input_file_name = tkFileDialog.askopenfilename(
-            filetypes=[("JSON", "json")],
+            filetypes=[("SOIE Session", SESSION_EXTENSION), ("JSON", "json")],
             initialdir=os.path.join(os.path.dirname(os.path.dirname(__file__)),'sessions')
             )
         if input_file_name != "":
@@ -168,13 +191,42 @@ class MenuBar(tk.Menu):
         self.general_settings_window = GeneralSettingsWindow(t, deepcopy(self.session.general_settings), self.parent.update_general_settings)
         self.general_settings_window.grid(padx=(40,10), pady=(20,5))
 
+    def show_render_times(self):
+        tkMessageBox.showinfo("Render Times", FRAME_TIMER.report())
+
+    def toggle_profiling(self):
+        PROFILER.enabled = bool(self.profiling_intvar.get())
+
+    def show_profile_report(self):
+        tkMessageBox.showinfo("Profiling", PROFILER.report())
+
+    def export_profile_timeline(self):
+        output_file_name = tkFileDialog.asksaveasfilename(
+            defaultextension=".json",
+            filetypes=[("Chrome Trace", "json")]
+            )
+        if output_file_name != "":
+            PROFILER.export_trace(output_file_name)
+
+    def pause_simulations(self):
+        scheduler = self.parent.population.scheduler
+        if self.paused_intvar.get():
+            scheduler.pause()
+        else:
+            scheduler.resume()
+
+    def stop_simulations(self):
+        self.parent.population.scheduler.cancel()
+
     def update_general_options(self):
         new = self.session.general_settings
         for each in ["show_tail", "periodic_boundary"]:
             if self.general_intvars[each].get() != new[each]:
                 self.general_intvars[each].set(new[each])
 
-        if new["show_movement"]== 1:
+        if new["show_movement"]== 1 and new.get("show_movement_adaptive", 0):
+            self.general_intvars["show_movement_value"].set(-1)
+        elif new["show_movement"]== 1:
             self.general_intvars["show_movement_value"].set(int(new["show_movement_value"]))
         else:
             self.general_intvars["show_movement_value"].set(0)
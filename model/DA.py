@@ -1,19 +1,53 @@
 """This module contains a class, Model, that represents the agent-based models.
 It interfaces the C++ simulation code with the rest of the software application
-which is in Python. """
+which is in Python. ModelBatch advances several Models with a single call.
+
+The simulation itself is run by a backend: a module providing ``fb_tick`` and
+``pb_tick`` functions with the arguments of the C++ code (and their batch
+versions ``fb_tick_batch`` and ``pb_tick_batch``). BACKENDS maps backend names
+to such modules:
+
+    * "weave": the compiled C++ code (available if it can be built, see
+      model/build.py).
+    * "numpy": a pure-NumPy implementation, see model/numpy_backend.py.
+
+DEFAULT_BACKEND is "weave" when the C++ code is available, "numpy" otherwise.
+
+Each step, the C++ code computes the global properties enabled in a mask
+(by default all of them) for one step out of a stride (by default every
+step), skipping the others inside the kernel; properties that are not
+computed are NaN, and steps that are not sampled are not stored (see
+model.stats). The mask and stride of a Model can be overridden for a single
+call of ``tick``.
+
+All randomness of a Model comes from its seed: the initial state is drawn
+from a generator seeded with it, and the noise of each step is a function of
+the seed, the absolute step and the particle (see model/_c_code/rng.cpp). A
+run is thus replayed exactly from the seed, in any process, batch or backend,
+and resumes identically from a saved state and step.
+
+A Model can also record its trajectory, its state every few steps, to disk
+(see ``record_trajectory`` and model/trajectory.py).
+"""
 
 from collections import OrderedDict
 
 import numpy as np
 
 from common.parameters import CORE_RADIUS, FIELD_SIZE, N_GLOBAL_STATS
+from common.profiling import PROFILER
 from common.tools import counts2slices
-try:
-    import c_code as c_model
-except ImportError:
-    from model.weave_compile import weave_compile
-    weave_compile()
-    import c_code as c_model
+from model import build, numpy_backend
+from model.stats import GlobalStats, sampled_steps
+from model.trajectory import TrajectoryRecorder
+
+# The C++ code built ahead of time (see model/build.py), or None
+c_model = build.load()
+
+BACKENDS = {"numpy": numpy_backend}
+if c_model is not None:
+    BACKENDS["weave"] = c_model
+DEFAULT_BACKEND = "weave" if c_model is not None else "numpy"
 
 class Model(object):
     """A model for a system of self-propelled particles.
@@ -22,20 +56,57 @@ class Model(object):
         gen_internal_params: Convert user-input parameters to internal format
             convenient for the C++ program.
         init_particles_state: Initialize the state of a system.
-        tick: Run the simulation for a given number of steps.
+        tick: Run the simulation for a given number of steps, computing the
+            global properties in stats_mask every stats_stride steps unless
+            given others.
         set: Set the model to a given state, used when loading saved genes or
             sessions.
+        extend: Advance the model to a state computed elsewhere, appending
+            the global properties of the steps in between.
+        attach_state_buffer: Move the state into a memory-mapped file that
+            other processes can map too.
+        record_trajectory: Start recording the state every few steps.
 
     Attributes:
         state (tuple): Positions and directions of all particles.
         global_stats (numpy.ndarray): Global properties (group angular
-            momentum, segregation, etc.) of the system over time.
+            momentum, segregation, etc.) of the system over time, indexed
+            [stat, step]; only the retained steps in bounded mode.
+        stats (GlobalStats): The store behind ``global_stats``.
         user_params (dict): The parameters of the system as seen and written
             by users.
         internal_params (OrderedDict): The parameters of the system in an
             internal format.
+        neighbor_search (str): How the C++ program finds interacting pairs,
+            either "cell_list" or "all_pairs".
+        cell_size (float): Side length of the neighbor search cells, or 0 when
+            all pairs are evaluated.
+        backend (str): Name of the backend running the simulation, a key of
+            BACKENDS.
+        seed (int): Seed of all random numbers of the model, in [0, 2**31).
+        n_threads (int): Number of threads of the C++ code, or 0 to update
+            the directions of particles one after the other, later particles
+            seeing the new directions of earlier ones. With one thread or
+            more, all particles are updated from the directions of the
+            previous step (like the NumPy backend, which ignores n_threads),
+            and the results do not depend on the number of threads.
+        precision (str): Precision of the pairwise terms of the C++ code,
+            "float64" or "float32", the latter only with n_threads of 1 or
+            more. The state and global properties are always double
+            precision; see benchmarks/precision.py for the speed and drift
+            of "float32".
+        stats_mask (list): Whether to compute each global property, in the
+            order of GLOBAL_STATS_NAMES; those not computed are NaN.
+        stats_stride (int): Global properties are computed for one step out
+            of stats_stride, the steps that are multiples of it.
+        state_buffer (numpy.memmap): The memory-mapped file holding the state
+            arrays, or None if they are private to this process.
+        recorder (TrajectoryRecorder): Records the trajectory, or None.
     """
-    def __init__(self, params, scale_factor=1., periodic_boundary=False):
+    def __init__(self, params, scale_factor=1., periodic_boundary=False,
+                 neighbor_search="cell_list", backend=None,
+                 stats_max_steps=None, seed=None, n_threads=0,
+                 precision="float64", stats_mask=None, stats_stride=1):
         """
         Parameters:
             params (dict): The parameters of the model as seen by the users.
@@ -44,9 +115,23 @@ class Model(object):
                 the arena size is effectively 20x20.
             periodic_boundary (bool): Whether to use periodic boundary
                 conditions.
+            neighbor_search (str): "cell_list" bins particles into a uniform
+                grid so that each step costs O(N); "all_pairs" evaluates every
+                pair of particles, O(N^2), and is kept for comparison.
+            backend (str): Name of the backend to use. Defaults to
+                DEFAULT_BACKEND.
+            stats_max_steps (int): If given, only the global properties of
+                the last stats_max_steps steps are retained.
+            seed (int): See ``Attributes``. Drawn from numpy.random if not
+                given.
+            n_threads (int): See ``Attributes``.
+            precision (str): See ``Attributes``.
+            stats_mask (list): See ``Attributes`` (all properties by
+                default).
+            stats_stride (int): See ``Attributes``.
         """
-        # Initialize empty array to store global properties
-        self.global_stats = np.zeros([N_GLOBAL_STATS, 0])
+        # Initialize empty store of global properties
+        self.stats = GlobalStats(max_steps=stats_max_steps)
         self.user_params = params
         # Periodic boundary settings
         if periodic_boundary is False:
@@ -56,6 +141,46 @@ class Model(object):
         # Generate internal parameters from user input
         self.internal_params = self.gen_internal_params(scale_factor)
         self.periodic_boundary = periodic_boundary
+        self.neighbor_search = neighbor_search
+        self.backend = DEFAULT_BACKEND if backend is None else backend
+        if self.backend not in BACKENDS:
+            raise ValueError(
+                "Simulation backend '{}' is not available.".format(backend))
+        if seed is None:
+            seed = np.random.randint(2**31)
+        self.seed = int(seed)
+        self.n_threads = n_threads
+        if precision not in ("float64", "float32"):
+            raise ValueError("Unknown precision '{}'.".format(precision))
+        if precision == "float32" and n_threads == 0:
+            raise ValueError("The float32 precision needs n_threads >= 1.")
+        self.precision = precision
+        self.stats_mask = ([1] * N_GLOBAL_STATS if stats_mask is None
+                           else list(stats_mask))
+        self.stats_stride = stats_stride
+        self.state_buffer = None
+        self.recorder = None
+
+    def __getstate__(self):
+        """Pickle without the memory mapping; the state arrays are pickled as
+        ordinary arrays."""
+        state = self.__dict__.copy()
+        state["state_buffer"] = None
+        return state
+
+    @property
+    def cell_size(self):
+        """Return the side length of the cells used for neighbor search. Cells
+        are at least as wide as the larger of the two interaction radii, so
+        that all neighbors of a particle lie in its own or adjacent cells."""
+        if self.neighbor_search == "all_pairs":
+            return 0.
+        iprm = self.internal_params
+        return max(iprm['r1'], iprm['ra'])
+
+    @property
+    def global_stats(self):
+        return self.stats.view
 
     @property
     def state(self):
@@ -120,17 +245,19 @@ class Model(object):
         return internal_params
 
     def init_particles_state(self):
-        """Initialize a system of particles given params."""
+        """Initialize a system of particles given params, drawing random
+        numbers from a generator seeded with the model's seed."""
         iprm, uprm = self.internal_params, self.user_params
+        rng = np.random.RandomState(self.seed)
         nop, xlim, ylim = iprm['nop'], iprm['xlim'], iprm['ylim']
         n_per_species = iprm['n_per_species']
 
         # Randomize position
-        pos_x = np.random.random(nop) * xlim
-        pos_y = np.random.random(nop) * ylim
+        pos_x = rng.random_sample(nop) * xlim
+        pos_y = rng.random_sample(nop) * ylim
 
         # Randomize velocity
-        theta = np.random.random(nop) * 2 * np.pi
+        theta = rng.random_sample(nop) * 2 * np.pi
         dir_x = np.cos(theta)
         dir_y = np.sin(theta)
 
@@ -144,23 +271,23 @@ class Model(object):
                 dir_y[type_] = 0.
                 if pinned_shape == "ring":
                     # Radius = 30%-40% of field size
-                    radius = xlim * (0.3+np.random.random(n)*0.1)
-                    theta = 2 * np.random.random(n) * np.pi
+                    radius = xlim * (0.3+rng.random_sample(n)*0.1)
+                    theta = 2 * rng.random_sample(n) * np.pi
                     pos_x[type_] = xlim/2. + np.cos(theta)*radius
                     pos_y[type_] = ylim/2. + np.sin(theta)*radius
 
                 elif pinned_shape == "circle":
                     # 0-20% of field size
-                    radius = xlim * 0.2 * np.random.power(2, n)
-                    theta = 2 * np.random.random(n) * np.pi
+                    radius = xlim * 0.2 * rng.power(2, n)
+                    theta = 2 * rng.random_sample(n) * np.pi
                     pos_x[type_] = xlim/2. + np.cos(theta)*radius
                     pos_y[type_] = ylim/2. + np.sin(theta)*radius
 
                 elif pinned_shape == "square":
                     # radius ~ 40-50% of field size
-                    side = np.random.randint(0, 4, n)
-                    coord = np.random.random(n) * 0.9 * xlim
-                    depth = np.random.random(n) * 0.1 * xlim
+                    side = rng.randint(0, 4, n)
+                    coord = rng.random_sample(n) * 0.9 * xlim
+                    depth = rng.random_sample(n) * 0.1 * xlim
                     temp_x, temp_y = np.empty(n), np.empty(n)
                     is_0 = side == 0
                     temp_x[is_0], temp_y[is_0] = depth[is_0], coord[is_0]
@@ -178,36 +305,231 @@ class Model(object):
 
         self.pos_x, self.pos_y, self.dir_x, self.dir_y = (
             pos_x, pos_y, dir_x, dir_y)
+        self.state_buffer = None
 
-    def fb_tick(self, steps):
+    def fb_tick(self, steps, stats_mask=None, stats_stride=None):
         """Run the simulation for a given number of steps under fixed
-        boundary conditions."""
-        global_stats_slice = np.zeros(N_GLOBAL_STATS * steps)
-        c_model.fb_tick(
-            *self.internal_params.values()
-            + [self.pos_x, self.pos_y, self.dir_x, self.dir_y,
-               global_stats_slice, steps])
-        self.global_stats = np.hstack(
-            [self.global_stats,
-             global_stats_slice.reshape(N_GLOBAL_STATS, steps)])
-
-    def pb_tick(self, steps):
+        boundary conditions, and return the global properties of the sampled
+        steps. stats_mask and stats_stride default to those of the Model."""
+        return self._run(BACKENDS[self.backend].fb_tick, steps, stats_mask,
+                         stats_stride)
+
+    def pb_tick(self, steps, stats_mask=None, stats_stride=None):
         """Run the simulation for a given number of steps under periodic
-        boundary conditions."""
+        boundary conditions, and return the global properties of the sampled
+        steps. stats_mask and stats_stride default to those of the Model."""
+        return self._run(BACKENDS[self.backend].pb_tick, steps, stats_mask,
+                         stats_stride)
+
+    def _run(self, tick_func, steps, stats_mask, stats_stride):
+        """Run a tick function of the backend, and store and return the
+        global properties of the sampled steps. When recording, the steps
+        are run in pieces ending at the recorded steps."""
+        stats_mask, stats_stride = _stats_settings(
+            [self], stats_mask, stats_stride)
+        if self.recorder is None:
+            return self._run_steps(tick_func, steps, stats_mask, stats_stride)
+        slices = []
+        for n_steps in self.recorder.intervals(self.stats.n_steps, steps):
+            slices.append(self._run_steps(tick_func, n_steps, stats_mask,
+                                          stats_stride))
+            with PROFILER.span("record", "model"):
+                self.recorder.record(self.stats.n_steps, self.state)
+        with PROFILER.span("stats append", "model"):
+            return np.hstack([np.zeros([N_GLOBAL_STATS, 0])] + slices)
+
+    def _run_steps(self, tick_func, steps, stats_mask, stats_stride):
+        """Run a tick function of the backend for a number of steps."""
         global_stats_slice = np.zeros(N_GLOBAL_STATS * steps)
-        c_model.pb_tick(
-            *self.internal_params.values()
-            + [self.pos_x, self.pos_y, self.dir_x, self.dir_y,
-               global_stats_slice, steps])
-        self.global_stats = np.hstack(
-            [self.global_stats,
-             global_stats_slice.reshape(N_GLOBAL_STATS, steps)])
-
-    def set(self, state, global_stats):
-        """Load given global properties and state into the Model."""
-        self.global_stats = np.array(global_stats)
+        with PROFILER.span("tick", "model", steps=steps):
+            tick_func(*self.internal_params.values()
+                      + [self.pos_x, self.pos_y, self.dir_x, self.dir_y,
+                         global_stats_slice, steps, self.cell_size,
+                         self.seed, self.stats.n_steps, self.n_threads,
+                         int(self.precision == "float32"), stats_mask,
+                         stats_stride])
+        with PROFILER.span("stats append", "model"):
+            global_stats_slice = _sampled_columns(
+                global_stats_slice, stats_mask, self.stats.n_steps, steps,
+                stats_stride)
+            self.stats.append(global_stats_slice, steps, stats_stride)
+        return global_stats_slice
+
+    def set(self, state, global_stats, stats_offset=0):
+        """Load given global properties and state into the Model. The global
+        properties start at step stats_offset."""
+        self.stats = GlobalStats(global_stats, offset=stats_offset,
+                                 max_steps=self.stats.max_steps)
         self.pos_x, self.pos_y, self.dir_x, self.dir_y = [
             np.array(_) for _ in state]
+        self.state_buffer = None
+
+    def extend(self, state, global_stats_slice, n_steps=None):
+        """Replace the state with one reached after running the model in
+        another process, and append the global properties of the new steps,
+        n_steps steps sampled with the stride of the model (all of them, one
+        per column, by default). A state of None means that the other process
+        has already updated the shared state buffer in place.
+        """
+        if state is not None:
+            self.pos_x, self.pos_y, self.dir_x, self.dir_y = state
+            self.state_buffer = None
+        if n_steps is None:
+            self.stats.append(global_stats_slice)
+        else:
+            self.stats.append(global_stats_slice, n_steps, self.stats_stride)
+
+    def record_trajectory(self, path, every=1):
+        """Start recording the state every few steps to a new trajectory at
+        path (see model/trajectory.py), from the current state if the
+        current step is a recorded one, and return the recorder.
+
+        Parameters:
+            path (str): Directory of the trajectory, replaced if it exists.
+            every (int): Frames are recorded at the steps that are multiples
+                of every.
+        """
+        iprm = self.internal_params
+        self.recorder = TrajectoryRecorder(path, iprm["nop"], iprm["xlim"],
+                                           iprm["ylim"], every)
+        self.recorder.record(self.stats.n_steps, self.state)
+        return self.recorder
+
+    def attach_state_buffer(self, path, create=False):
+        """Keep the state arrays in a memory-mapped file, so that processes
+        mapping the same file read and update the same arrays without copying.
+
+        Parameters:
+            path (str): Location of the file.
+            create (bool): If True, create the file and copy the current state
+                into it; otherwise, map an existing file and adopt the state
+                stored there.
+
+        Returns:
+            bool: False if there are no particles to share (empty files cannot
+                be mapped), True otherwise.
+        """
+        nop = self.internal_params["nop"]
+        if nop == 0:
+            return False
+        buf = np.memmap(path, dtype=np.float64, mode="w+" if create else "r+",
+                        shape=(4, nop))
+        if create:
+            buf[:] = self.state
+        self.pos_x, self.pos_y, self.dir_x, self.dir_y = buf
+        self.state_buffer = buf
+        return True
+
+def _stats_settings(models, stats_mask, stats_stride):
+    """Return the mask (as the C++ code takes it) and stride of the global
+    properties of a tick, those of the models unless given."""
+    if stats_mask is None:
+        stats_mask = models[0].stats_mask
+    if stats_stride is None:
+        stats_stride = models[0].stats_stride
+    if len(stats_mask) != N_GLOBAL_STATS or stats_stride < 1:
+        raise ValueError("Invalid global property mask or stride.")
+    return np.array(stats_mask, dtype=np.int32), int(stats_stride)
+
+
+def _sampled_columns(global_stats_slice, stats_mask, first_step, steps,
+                     stats_stride):
+    """Return the global properties written by the code for the sampled steps
+    as a [stat, step] array, NaN for the properties not computed. The code
+    writes the sampled steps in the first columns of a [stat, steps] array."""
+    n_sampled = len(sampled_steps(first_step, steps, stats_stride))
+    values = global_stats_slice.reshape(N_GLOBAL_STATS, steps)[:, :n_sampled]
+    values[stats_mask == 0] = np.nan
+    return values
+
+
+class ModelBatch(object):
+    """A batch of Models (replicas) advanced together by one backend call per
+    tick, which saves the per-call overhead of ticking them one by one.
+
+    Replicas may differ in parameters and number of particles, but must share
+    the boundary conditions, the backend and the number of threads. For the
+    call, their parameters are packed into arrays with one entry per replica
+    (three per replica for per-species parameters, nine for per-pair ones),
+    and their states are concatenated, replica after replica, with
+    ``offsets`` giving where each one starts. Each replica keeps its own seed
+    and step, so that it runs exactly as it would alone. New states are
+    copied back into the Models' own arrays.
+
+    Methods:
+        tick: Run all replicas for a given number of steps.
+
+    Attributes:
+        models (list): The Models in the batch.
+        offsets (numpy.ndarray): Index of the first particle of each replica
+            in the concatenated state arrays.
+    """
+    def __init__(self, models):
+        """
+        Parameters:
+            models (list): Models with initialized states.
+        """
+        if any(m.recorder is not None for m in models):
+            raise ValueError("Models recording their trajectory cannot be "
+                             "batched.")
+        if len(set((m.periodic_boundary, m.backend, m.n_threads,
+                    m.precision, tuple(m.stats_mask), m.stats_stride)
+                   for m in models)) > 1:
+            raise ValueError("Models in a batch must share the boundary "
+                             "conditions, the backend, the number of "
+                             "threads, the precision and the global "
+                             "properties computed.")
+        self.models = models
+        nops = [m.internal_params["nop"] for m in models]
+        self.offsets = np.cumsum([0] + nops[:-1]).astype(np.int32)
+        # Packed parameters, in the order of the arguments of the C++ code
+        self.packed_params = []
+        for name in models[0].internal_params:
+            values = [np.ravel(m.internal_params[name]) for m in models]
+            dtype = np.int32 if values[0].dtype.kind == "i" else np.float64
+            self.packed_params.append(np.concatenate(values).astype(dtype))
+        self.cell_sizes = np.array([m.cell_size for m in models])
+        self.seeds = np.array([m.seed for m in models], dtype=np.int32)
+
+    def tick(self, steps, stats_mask=None, stats_stride=None):
+        """Run all replicas for a given number of steps, and return their
+        global properties for the sampled steps, a [stat, step] array per
+        replica. stats_mask and stats_stride default to those of the
+        Models."""
+        models = self.models
+        stats_mask, stats_stride = _stats_settings(models, stats_mask,
+                                                   stats_stride)
+        state = [np.concatenate([m.state[i] for m in models])
+                 for i in range(4)]
+        global_stats = np.zeros(len(models) * N_GLOBAL_STATS * steps)
+        backend = BACKENDS[models[0].backend]
+        if models[0].periodic_boundary:
+            tick_batch = backend.pb_tick_batch
+        else:
+            tick_batch = backend.fb_tick_batch
+        first_steps = np.array([m.stats.n_steps for m in models],
+                               dtype=np.int32)
+        with PROFILER.span("batch tick", "model", steps=steps,
+                           replicas=len(models)):
+            tick_batch(*self.packed_params + state + [
+                global_stats, steps, self.cell_sizes, self.seeds,
+                first_steps, models[0].n_threads,
+                int(models[0].precision == "float32"), stats_mask,
+                stats_stride, self.offsets, len(models)])
+        global_stats = global_stats.reshape(len(models), -1)
+        slices = []
+        for model, offset, global_stats_slice in zip(
+                models, self.offsets, global_stats):
+            nop = model.internal_params["nop"]
+            for array, new_values in zip(model.state, state):
+                array[:] = new_values[offset:offset + nop]
+            global_stats_slice = _sampled_columns(
+                global_stats_slice, stats_mask, model.stats.n_steps, steps,
+                stats_stride)
+            model.stats.append(global_stats_slice, steps, stats_stride)
+            slices.append(global_stats_slice)
+        return slices
+
 
 def main():
     # TEST: python -m model.DA
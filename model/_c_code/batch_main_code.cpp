@@ -0,0 +1,34 @@
+// Run the main code once for each replica of a batch, on the replica's own
+// slice of the packed arrays. Inside the block, the usual variable names of
+// the main code refer to the current replica.
+for (int replica = 0; replica < n_replicas; replica++) {
+  int n = b_n[replica];
+  double eff_nop = b_eff_nop[replica];
+  double size_x = b_size_x[replica];
+  double size_y = b_size_y[replica];
+  double r0_x_2 = b_r0_x_2[replica];
+  double r1 = b_r1[replica];
+  double rv = b_rv[replica];
+  double iner_coef = b_iner_coef[replica];
+  double f0 = b_f0[replica];
+  double fa = b_fa[replica];
+  double noise_coef = b_noise_coef[replica];
+  double *v0 = b_v0 + 3*replica;
+  int *pinned = b_pinned + 3*replica;
+  int *n_per_species = b_n_per_species + 3*replica;
+  double *beta = b_beta + 9*replica;
+  double *grad_x = b_grad_x + 3*replica;
+  double *grad_y = b_grad_y + 3*replica;
+  double *pos_x = b_pos_x + offsets[replica];
+  double *pos_y = b_pos_y + offsets[replica];
+  double *dir_x = b_dir_x + offsets[replica];
+  double *dir_y = b_dir_y + offsets[replica];
+  // 6 global properties per step
+  double *global_stats = b_global_stats + 6*steps*replica;
+  double cell_size = b_cell_size[replica];
+  int seed = b_seed[replica];
+  int first_step = b_first_step[replica];
+  {
+// MAIN CODE
+  }
+}
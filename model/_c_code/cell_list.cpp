@@ -0,0 +1,84 @@
+int cl_n_cells(double size, double cell_size) {
+  // Number of cells along one side of the arena. Each cell is at least
+  // cell_size wide; a non-positive cell_size means a single cell (all pairs).
+  int n_cells = 1;
+  if (cell_size > 0) {
+    n_cells = (int) (size / cell_size);
+  }
+  if (n_cells < 1) {
+    n_cells = 1;
+  }
+  return n_cells;
+}
+int cl_cell_coord(double v, double size, int n_cells) {
+  int c = (int) (v * n_cells / size);
+  if (c >= n_cells) {
+    return n_cells - 1;
+  } else if (c < 0) {
+    return 0;
+  }
+  return c;
+}
+void cl_build(int n, double* pos_x, double* pos_y, double size_x,
+              double size_y, int ncx, int ncy, int* cell_of, int* cell_start,
+              int* cell_members) {
+  // Counting sort of particles by cell. Members of cell c are
+  // cell_members[cell_start[c]:cell_start[c+1]], in increasing index order.
+  int i, c, n_cells = ncx * ncy;
+  for (c = 0; c <= n_cells; c++) {
+    cell_start[c] = 0;
+  }
+  for (i = 0; i < n; i++) {
+    c = cl_cell_coord(pos_y[i], size_y, ncy) * ncx +
+        cl_cell_coord(pos_x[i], size_x, ncx);
+    cell_of[i] = c;
+    cell_start[c + 1] += 1;
+  }
+  for (c = 0; c < n_cells; c++) {
+    cell_start[c + 1] += cell_start[c];
+  }
+  for (i = 0; i < n; i++) {
+    c = cell_of[i];
+    cell_members[cell_start[c]] = i;
+    cell_start[c] += 1;
+  }
+  for (c = n_cells; c > 0; c--) {
+    cell_start[c] = cell_start[c - 1];
+  }
+  cell_start[0] = 0;
+}
+int cl_neighbor_cells(int cell, int ncx, int ncy, int periodic, int* out) {
+  // Write the distinct cells adjacent to (and including) the given cell into
+  // out, in increasing order, and return how many there are. With fewer than
+  // three cells along a side, wrapping would otherwise visit a cell twice.
+  int cx = cell % ncx, cy = cell / ncx;
+  int dx, dy, nx, ny, c, m, count = 0;
+  for (dy = -1; dy <= 1; dy++) {
+    ny = cy + dy;
+    if (periodic) {
+      ny = (ny + ncy) % ncy;
+    } else if (ny < 0 || ny >= ncy) {
+      continue;
+    }
+    for (dx = -1; dx <= 1; dx++) {
+      nx = cx + dx;
+      if (periodic) {
+        nx = (nx + ncx) % ncx;
+      } else if (nx < 0 || nx >= ncx) {
+        continue;
+      }
+      c = ny * ncx + nx;
+      for (m = 0; m < count && out[m] != c; m++) {}
+      if (m < count) {
+        continue;
+      }
+      // Insert in increasing order
+      for (m = count; m > 0 && out[m - 1] > c; m--) {
+        out[m] = out[m - 1];
+      }
+      out[m] = c;
+      count += 1;
+    }
+  }
+  return count;
+}
@@ -1,4 +1,8 @@
+double fb_dist2(double x1, double y1, double x2, double y2) {
+  // Squared distance, to compare with squared ranges before taking the root
+  return pow((x1-x2),2) + pow((y1-y2),2);
+}
 double fb_dist(double x1, double y1, double x2, double y2) {
-  double r = sqrt(pow((x1-x2),2) + pow((y1-y2),2));
+  double r = sqrt(fb_dist2(x1, y1, x2, y2));
   return r;
 }
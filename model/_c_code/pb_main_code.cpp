@@ -1,12 +1,91 @@
-int i, j, k, k2, start_index, end_index, start_index2, end_index2, ith_step;
-double grad_i_x, grad_i_y, align_i_x, align_i_y, f_i_x, f_i_y;
-double beta_ij, ar_slope, ar_interc, r, temp, noise, c, s, v0_i, dis_x, dis_y;
-double stat_align_x, stat_align_y, cm_x, cm_y, rel_pos_x, rel_pos_y;
+int i, k, k2, start_index, end_index, ith_step;
+// Whether the current step is sampled, which global properties are computed
+// for it, and its column in global_stats
+int sample, do_angular, do_align, do_clu, i_sample;
+double beta_ij, v0_i;
+double stat_align_x, stat_align_y, cm_x, cm_y;
 double sum_c_theta_x, sum_s_theta_x, sum_c_theta_y, sum_s_theta_y;
 double stat_angular, stat_seg, stat_clu, stat_angular_norm, temp1, temp2;
-int ingroup_nb, total_nb;
+int ncx, ncy, n_team;
+int *species, *cell_of, *cell_start, *cell_members;
+unsigned long long step_key;
+double ar_slopes[9], ar_intercs[9];
+float ar_slopes32[9], ar_intercs32[9];
+// Squared range beyond which pairs interact neither way, slightly enlarged so
+// that no pair within rv or r1 is skipped because of rounding
+double cutoff2;
+// Particles in cell order for the vectorized neighbor sums (n_threads > 0),
+// in single precision if asked for (see soa.cpp)
+SoaParticles<double> soa64;
+SoaParticles<float> soa32;
+// Per-particle results of the parallel loops, summed afterwards in index
+// order so that global properties do not depend on the number of threads
+double *seg_ratio, *n_nb, *torque, *dist_cm;
+double *c_theta_x, *s_theta_x, *c_theta_y, *s_theta_y;
+// New directions: written in place when n_threads == 0 (particles see the
+// new directions of earlier ones), into new arrays otherwise (all particles
+// are updated from the directions of the previous step)
+double *new_dir_x, *new_dir_y;
+
+// SPECIES AND ATTRACTION-REPULSION COEFFICIENTS (constant across steps)
+species = new int[n];
+start_index = 0;
+for (k = 0; k < 3; k++) {
+  end_index = start_index + n_per_species[k];
+  for (i = start_index; i < end_index; i++) {
+    species[i] = k;
+  }
+  start_index = end_index;
+  for (k2 = 0; k2 < 3; k2++) {
+    beta_ij = beta[k*3 + k2];
+    ar_slopes[k*3 + k2] = (1 + beta_ij) * f0 / (r1 - r0_x_2);
+    ar_intercs[k*3 + k2] = - r0_x_2 * (1 + beta_ij) * f0 / (r1 - r0_x_2) - f0;
+    ar_slopes32[k*3 + k2] = ar_slopes[k*3 + k2];
+    ar_intercs32[k*3 + k2] = ar_intercs[k*3 + k2];
+  }
+}
+cutoff2 = pow(r1 > rv ? r1 : rv, 2) * (1 + 1e-9);
+
+// NEIGHBOR SEARCH GRID (a single cell when cell_size <= 0, i.e. all pairs)
+ncx = cl_n_cells(size_x, cell_size);
+ncy = cl_n_cells(size_y, cell_size);
+cell_of = new int[n];
+cell_start = new int[ncx*ncy + 1];
+cell_members = new int[n];
+
+seg_ratio = new double[n];
+n_nb = new double[n];
+torque = new double[n];
+dist_cm = new double[n];
+c_theta_x = new double[n];
+s_theta_x = new double[n];
+c_theta_y = new double[n];
+s_theta_y = new double[n];
+// Number of threads of the parallel loops
+n_team = n_threads > 1 ? n_threads : 1;
+if (n_threads > 0) {
+  new_dir_x = new double[n];
+  new_dir_y = new double[n];
+  if (single_precision) {
+    soa32.allocate(n);
+  } else {
+    soa64.allocate(n);
+  }
+} else {
+  new_dir_x = dir_x;
+  new_dir_y = dir_y;
+}
 
+i_sample = 0;
 for (ith_step = 0; ith_step < steps; ith_step++) {
+  // Random numbers of this step (see rng.cpp)
+  step_key = rng_step_key(seed, first_step + ith_step);
+  // Global properties are computed for one step out of stats_stride, and
+  // only those enabled in stats_mask
+  sample = (first_step + ith_step) % stats_stride == 0;
+  do_angular = sample && stats_mask[0];
+  do_align = sample && stats_mask[1];
+  do_clu = sample && stats_mask[5];
   stat_align_x = 0;
   stat_align_y = 0;
   sum_c_theta_x = 0;
@@ -15,197 +94,203 @@ for (ith_step = 0; ith_step < steps; ith_step++) {
   sum_s_theta_y = 0;
   stat_clu = 0;
 
-  // UPDATE DIRECTION
-  start_index = 0;
-  for (k = 0; k < 3; k++) {
-    end_index = start_index + n_per_species[k];
-    stat_seg = 0;
-
-    if (pinned[k] == 0) {
-      // Only if i is not pinned
-
-      // GRADIENT (constant across same species)
-      grad_i_x = grad_x[k];
-      grad_i_y = grad_y[k];
-
-      for (i = start_index; i < end_index; i++) {
-        // INITIALIZATION
-        // Alignment term
-        align_i_x = 0;
-        align_i_y = 0;
-        // A-R term
-        f_i_x = 0;
-        f_i_y = 0;
-        // STAT_SEG
-        ingroup_nb = 0;
-        total_nb = 0;
-
-        start_index2 = 0;
-        for (k2 = 0; k2 < 3; k2++) {
-          end_index2 = start_index2 + n_per_species[k2];
-
-          beta_ij = beta[k*3 + k2];
-          ar_slope = (1 + beta_ij) * f0 / (r1 - r0_x_2);
-          ar_interc = - r0_x_2 * (1 + beta_ij) * f0 / (r1 - r0_x_2) - f0;
-
-          for (j = start_index2; j < end_index2; j++) {
-            if (i != j) {
-              dis_x = pb_dist(pos_x[i], pos_x[j], size_x);
-              dis_y = pb_dist(pos_y[i], pos_y[j], size_y);
-              r = sqrt(pow(dis_x,2)+pow(dis_y,2));
-
-              // ALIGNMENT
-              if (pinned[k2] == 0) {
-                // Only if j is not pinned
-                if (r <= rv) {
-                  align_i_x += dir_x[j];
-                  align_i_y += dir_y[j];
-                }
-              }
-              // ATTRACTION-REPULSION
-              if (r <= r1) {
-                // STAT_SEG
-                if (k == k2) {
-                  ingroup_nb += 1;
-                }
-                total_nb += 1;
-
-                if (r < r0_x_2) {
-                  // Infinite repulsion
-                  f_i_x += -10000 * dis_x;
-                  f_i_y += -10000 * dis_y;
-                } else {
-                  // Equilibrium attraction and repulsion
-                  temp = r * ar_slope + ar_interc;
-                  f_i_x += temp * dis_x / r;
-                  f_i_y += temp * dis_y / r;
-                }
-              }
-            }
-          }
-          start_index2 = end_index2;
-        }
-
-        // INERTIA
-        dir_x[i] *= iner_coef;
-        dir_y[i] *= iner_coef;
-
-        // ADD OTHER TERMS
-        dir_x[i] += grad_i_x + align_i_x*fa + f_i_x;
-        dir_y[i] += grad_i_y + align_i_y*fa + f_i_y;
-
-        // NORMALIZE (ARG)
-        temp = sqrt(pow(dir_x[i], 2) + pow(dir_y[i], 2));
-        if (temp > 0) {
-          //Avoid dividing by zero
-          dir_x[i] /= temp;
-          dir_y[i] /= temp;
-        }
-
-        // NOISE
-        noise = noise_coef*M_PI*((static_cast <float> (rand()) /
-        static_cast <float> (RAND_MAX))*2-1);
-        c = cos(noise);
-        s = sin(noise);
-        temp = dir_x[i];
-        dir_x[i] = dir_x[i]*c - dir_y[i]*s;
-        dir_y[i] = temp*s + dir_y[i]*c;
-
-        //STAT_ALIGN
-        stat_align_x += dir_x[i];
-        stat_align_y += dir_y[i];
-
-        // STAT_SEG
-        if (total_nb > 0) {
-          stat_seg += ingroup_nb / (double) total_nb;
-        }
+  // BIN PARTICLES INTO CELLS
+  cl_build(n, pos_x, pos_y, size_x, size_y, ncx, ncy, cell_of, cell_start,
+           cell_members);
+  if (n_threads > 0 && single_precision) {
+    soa32.fill(n, cell_members, pos_x, pos_y, dir_x, dir_y, species, pinned);
+  } else if (n_threads > 0) {
+    soa64.fill(n, cell_members, pos_x, pos_y, dir_x, dir_y, species, pinned);
+  }
 
-        // STAT_CLU
-        stat_clu += total_nb;
+  // UPDATE DIRECTION
+  #pragma omp parallel for num_threads(n_team) schedule(static) if (n_team > 1)
+  for (i = 0; i < n; i++) {
+    int j, k, k2, nb, m, m_end, n_nb_cells, nb_cells[9];
+    int ingroup_nb = 0, total_nb = 0;
+    bool movable;
+    double r, r2, temp, noise, c, s, d_x, d_y, dis_x, dis_y;
+    // Alignment term
+    double align_i_x = 0, align_i_y = 0;
+    // A-R term
+    double f_i_x = 0, f_i_y = 0;
+
+    k = species[i];
+    // Pinned particles only count their neighbors, which is only needed
+    // for the segregation of their species and for clustering
+    movable = pinned[k] == 0;
+    if (!movable && !do_clu && !(sample && stats_mask[2+k])) {
+      seg_ratio[i] = 0;
+      n_nb[i] = 0;
+      continue;
+    }
+    n_nb_cells = cl_neighbor_cells(cell_of[i], ncx, ncy, 1, nb_cells);
+    if (n_threads > 0) {
+      // All pairs at once, on the copy in cell order
+      double sums[4];
+      int counts[2];
+      if (single_precision) {
+        soa_neighbor_sums(soa32, i, k, pos_x[i], pos_y[i], n_nb_cells,
+                          nb_cells, cell_start, 1, size_x, size_y, rv, r1,
+                          r0_x_2, ar_slopes32 + k*3, ar_intercs32 + k*3, sums,
+                          counts);
+      } else {
+        soa_neighbor_sums(soa64, i, k, pos_x[i], pos_y[i], n_nb_cells,
+                          nb_cells, cell_start, 1, size_x, size_y, rv, r1,
+                          r0_x_2, ar_slopes + k*3, ar_intercs + k*3, sums,
+                          counts);
       }
+      if (movable) {
+        align_i_x = sums[0];
+        align_i_y = sums[1];
+        f_i_x = sums[2];
+        f_i_y = sums[3];
+      }
+      ingroup_nb = counts[0];
+      total_nb = counts[1];
     } else {
-      // If cell is pinned, calculate statistics but not forces # TODO
-      for (i = start_index; i < end_index; i++) {
-        // STAT_SEG
-        ingroup_nb = 0;
-        total_nb = 0;
-
-        start_index2 = 0;
-        for (k2 = 0; k2 < 3; k2++) {
-          end_index2 = start_index2 + n_per_species[k2];
-
-          for (j = start_index2; j < end_index2; j++) {
-            if (i != j) {
-              dis_x = pb_dist(pos_x[i], pos_x[j], size_x);
-              dis_y = pb_dist(pos_y[i], pos_y[j], size_y);
-              r = sqrt(pow(dis_x,2)+pow(dis_y,2));
-
-              // ATTRACTION-REPULSION
-              if (r <= r1) {
-                // STAT_SEG
-                if (k == k2) {
-                  ingroup_nb += 1;
-                }
-                total_nb += 1;
+      for (nb = 0; nb < n_nb_cells; nb++) {
+        m_end = cell_start[nb_cells[nb] + 1];
+        for (m = cell_start[nb_cells[nb]]; m < m_end; m++) {
+          j = cell_members[m];
+          if (i != j) {
+            dis_x = pb_dist(pos_x[i], pos_x[j], size_x);
+            dis_y = pb_dist(pos_y[i], pos_y[j], size_y);
+            r2 = pow(dis_x,2)+pow(dis_y,2);
+            if (r2 > cutoff2) {
+              // Out of range: skip the root
+              continue;
+            }
+            r = sqrt(r2);
+            k2 = species[j];
+
+            // ALIGNMENT
+            if (movable && pinned[k2] == 0) {
+              // Only if j is not pinned
+              if (r <= rv) {
+                align_i_x += dir_x[j];
+                align_i_y += dir_y[j];
+              }
+            }
+            // ATTRACTION-REPULSION
+            if (r <= r1) {
+              // STAT_SEG
+              if (k == k2) {
+                ingroup_nb += 1;
+              }
+              total_nb += 1;
+
+              if (!movable) {
+                // No forces on pinned particles
+              } else if (r < r0_x_2) {
+                // Infinite repulsion
+                f_i_x += -10000 * dis_x;
+                f_i_y += -10000 * dis_y;
+              } else {
+                // Equilibrium attraction and repulsion
+                temp = r * ar_slopes[k*3 + k2] + ar_intercs[k*3 + k2];
+                f_i_x += temp * dis_x / r;
+                f_i_y += temp * dis_y / r;
               }
             }
           }
-          start_index2 = end_index2;
-        }
-
-        // STAT_SEG
-        if (total_nb > 0) {
-          stat_seg += ingroup_nb / (double) total_nb;
         }
-
-        // STAT_CLU
-        stat_clu += total_nb;
       }
     }
 
-    // SEGREGATION PARAMETER (2,3,4*steps+ith_step)
-    if (n_per_species[k] > 0) {
-      stat_seg /= (double) n_per_species[k] * (double) n_per_species[k];
-    }
-    global_stats[(2+k) * steps + ith_step] = stat_seg * n;
+    // STAT_SEG, STAT_CLU
+    seg_ratio[i] = total_nb > 0 ? ingroup_nb / (double) total_nb : 0;
+    n_nb[i] = total_nb;
+
+    if (movable) {
+      // INERTIA, GRADIENT (constant across same species) AND OTHER TERMS
+      d_x = dir_x[i] * iner_coef + (grad_x[k] + align_i_x*fa + f_i_x);
+      d_y = dir_y[i] * iner_coef + (grad_y[k] + align_i_y*fa + f_i_y);
+
+      // NORMALIZE (ARG)
+      temp = sqrt(pow(d_x, 2) + pow(d_y, 2));
+      if (temp > 0) {
+        //Avoid dividing by zero
+        d_x /= temp;
+        d_y /= temp;
+      }
 
-    start_index = end_index;
+      // NOISE
+      noise = noise_coef*M_PI*(rng_uniform(step_key, i)*2-1);
+      c = cos(noise);
+      s = sin(noise);
+      new_dir_x[i] = d_x*c - d_y*s;
+      new_dir_y[i] = d_x*s + d_y*c;
+    }
   }
 
-  // UPDATE POSITION
   start_index = 0;
   for (k = 0; k < 3; k++) {
     end_index = start_index + n_per_species[k];
+    stat_seg = 0;
+    for (i = start_index; i < end_index; i++) {
+      if (pinned[k] == 0) {
+        dir_x[i] = new_dir_x[i];
+        dir_y[i] = new_dir_y[i];
+        // STAT_ALIGN
+        if (do_align) {
+          stat_align_x += dir_x[i];
+          stat_align_y += dir_y[i];
+        }
+      }
+      // STAT_SEG
+      stat_seg += seg_ratio[i];
+      // STAT_CLU
+      stat_clu += n_nb[i];
+    }
 
-    if (pinned[k] == 0) {
-      // Only if the cell type is not pinned
-
-      // SPEED (constant across same species)
-      v0_i = v0[k];
-
-      for (i = start_index; i < end_index; i++) {
-        pos_x[i] += v0_i * dir_x[i];
-        pos_x[i] = pb_fitInto(pos_x[i], size_x);
-        pos_y[i] += v0_i * dir_y[i];
-        pos_y[i] = pb_fitInto(pos_y[i], size_y);
-
-        //STAT_ANGULAR
-        temp = 2 * M_PI * pos_x[i] / size_x;
-        sum_c_theta_x += cos(temp);
-        sum_s_theta_x += sin(temp);
-
-        temp = 2 * M_PI * pos_y[i] / size_y;
-        sum_c_theta_y += cos(temp);
-        sum_s_theta_y += sin(temp);
+    // SEGREGATION PARAMETER (2,3,4*steps+i_sample)
+    if (sample && stats_mask[2+k]) {
+      if (n_per_species[k] > 0) {
+        stat_seg /= (double) n_per_species[k] * (double) n_per_species[k];
       }
+      global_stats[(2+k) * steps + i_sample] = stat_seg * n;
     }
 
     start_index = end_index;
   }
 
+  // UPDATE POSITION
+  #pragma omp parallel for num_threads(n_team) schedule(static) if (n_team > 1)
+  for (i = 0; i < n; i++) {
+    // Only if the cell type is not pinned
+    if (pinned[species[i]] == 0) {
+      double theta;
+      pos_x[i] += v0[species[i]] * dir_x[i];
+      pos_x[i] = pb_fitInto(pos_x[i], size_x);
+      pos_y[i] += v0[species[i]] * dir_y[i];
+      pos_y[i] = pb_fitInto(pos_y[i], size_y);
+
+      //STAT_ANGULAR
+      if (!do_angular) {
+        continue;
+      }
+      theta = 2 * M_PI * pos_x[i] / size_x;
+      c_theta_x[i] = cos(theta);
+      s_theta_x[i] = sin(theta);
+
+      theta = 2 * M_PI * pos_y[i] / size_y;
+      c_theta_y[i] = cos(theta);
+      s_theta_y[i] = sin(theta);
+    }
+  }
+
   // Update global stats
-  if (eff_nop > 0) {
-    // GROUP ANGULAR MOMENTUM (0*steps+ith_step)
+  if (do_angular && eff_nop > 0) {
+    // GROUP ANGULAR MOMENTUM (0*steps+i_sample)
+    for (i = 0; i < n; i++) {
+      if (pinned[species[i]] == 0) {
+        sum_c_theta_x += c_theta_x[i];
+        sum_s_theta_x += s_theta_x[i];
+        sum_c_theta_y += c_theta_y[i];
+        sum_s_theta_y += s_theta_y[i];
+      }
+    }
     sum_c_theta_x /= eff_nop;
     sum_s_theta_x /= eff_nop;
     sum_c_theta_y /= eff_nop;
@@ -216,6 +301,14 @@ for (ith_step = 0; ith_step < steps; ith_step++) {
     cm_y = size_y * (atan2(-sum_s_theta_y, -sum_c_theta_y) + M_PI) /
     (2 * M_PI);
 
+    #pragma omp parallel for num_threads(n_team) schedule(static) if (n_team > 1)
+    for (i = 0; i < n; i++) {
+      double rel_pos_x = pb_dist(cm_x, pos_x[i], size_x);
+      double rel_pos_y = pb_dist(cm_y, pos_y[i], size_y);
+      torque[i] = rel_pos_x * dir_y[i] - rel_pos_y * dir_x[i];
+      dist_cm[i] = sqrt(pow(rel_pos_x,2) + pow((rel_pos_y),2));
+    }
+
     stat_angular = 0;
     stat_angular_norm = 0;
 
@@ -228,10 +321,8 @@ for (ith_step = 0; ith_step < steps; ith_step++) {
         // Only if the cell type is not pinned
         v0_i = v0[k];
         for (i = start_index; i < end_index; i++) {
-          rel_pos_x = pb_dist(cm_x, pos_x[i], size_x);
-          rel_pos_y = pb_dist(cm_y, pos_y[i], size_y);
-          temp1 += rel_pos_x * dir_y[i] - rel_pos_y * dir_x[i];
-          temp2 += sqrt(pow(rel_pos_x,2) + pow((rel_pos_y),2));
+          temp1 += torque[i];
+          temp2 += dist_cm[i];
         }
         stat_angular += temp1 * v0_i;
         stat_angular_norm += temp2 * v0_i;
@@ -240,16 +331,42 @@ for (ith_step = 0; ith_step < steps; ith_step++) {
     }
 
     if (stat_angular_norm > 0) {
-      global_stats[ith_step] = abs(stat_angular) / stat_angular_norm;
+      global_stats[i_sample] = abs(stat_angular) / stat_angular_norm;
     }
-
-    // ORDER PARAMETER (1*steps+ith_step)
-    global_stats[steps + ith_step] = sqrt(pow(stat_align_x, 2) +
+  }
+  if (do_align && eff_nop > 0) {
+    // ORDER PARAMETER (1*steps+i_sample)
+    global_stats[steps + i_sample] = sqrt(pow(stat_align_x, 2) +
     pow(stat_align_y, 2)) / eff_nop;
   }
-  if (n > 0) {
-    // CLUSTERING PARAMETER (5*steps+ith_step)
-    global_stats[5*steps + ith_step] = (stat_clu/(n*M_PI*r1*r1/
+  if (do_clu && n > 0) {
+    // CLUSTERING PARAMETER (5*steps+i_sample)
+    global_stats[5*steps + i_sample] = (stat_clu/(n*M_PI*r1*r1/
       (size_x*size_y)))/n;
     }
+  if (sample) {
+    i_sample += 1;
+  }
+  }
+
+delete[] species;
+delete[] cell_of;
+delete[] cell_start;
+delete[] cell_members;
+delete[] seg_ratio;
+delete[] n_nb;
+delete[] torque;
+delete[] dist_cm;
+delete[] c_theta_x;
+delete[] s_theta_x;
+delete[] c_theta_y;
+delete[] s_theta_y;
+if (n_threads > 0) {
+  delete[] new_dir_x;
+  delete[] new_dir_y;
+  if (single_precision) {
+    soa32.release();
+  } else {
+    soa64.release();
   }
+}
@@ -0,0 +1,18 @@
+unsigned long long rng_mix(unsigned long long x) {
+  // splitmix64: scramble a 64-bit counter into a 64-bit random number
+  x += 0x9E3779B97F4A7C15ULL;
+  x = (x ^ (x >> 30)) * 0xBF58476D1CE4E5B9ULL;
+  x = (x ^ (x >> 27)) * 0x94D049BB133111EBULL;
+  return x ^ (x >> 31);
+}
+unsigned long long rng_step_key(int seed, int step) {
+  // Key of the random numbers of one step of a model with a given seed
+  return rng_mix(((unsigned long long) (unsigned int) seed << 32) |
+                 (unsigned int) step);
+}
+double rng_uniform(unsigned long long step_key, int i) {
+  // Random number in [0, 1) of particle i, a pure function of (seed, step, i)
+  // so that runs can be replayed exactly in any process and in any batch
+  return (rng_mix(step_key + (unsigned long long) i) >> 11) *
+    (1.0 / 9007199254740992.0);
+}
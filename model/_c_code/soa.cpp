@@ -0,0 +1,110 @@
+template <typename real>
+struct SoaParticles {
+  // Copy of the particles sorted by cell (in the order of cell_members), in
+  // the precision of the pairwise terms, so that the particles of a cell are
+  // contiguous and the loop over them vectorizes. movable is 1 for particles
+  // of unpinned species and 0 otherwise.
+  real *x, *y, *dir_x, *dir_y, *movable;
+  int *index, *species;
+
+  void allocate(int n) {
+    x = new real[n];
+    y = new real[n];
+    dir_x = new real[n];
+    dir_y = new real[n];
+    movable = new real[n];
+    index = new int[n];
+    species = new int[n];
+  }
+
+  void release() {
+    delete[] x;
+    delete[] y;
+    delete[] dir_x;
+    delete[] dir_y;
+    delete[] movable;
+    delete[] index;
+    delete[] species;
+  }
+
+  void fill(int n, int* cell_members, double* pos_x, double* pos_y,
+            double* dir_x_, double* dir_y_, int* species_, int* pinned) {
+    int m, j;
+    for (m = 0; m < n; m++) {
+      j = cell_members[m];
+      x[m] = pos_x[j];
+      y[m] = pos_y[j];
+      dir_x[m] = dir_x_[j];
+      dir_y[m] = dir_y_[j];
+      index[m] = j;
+      species[m] = species_[j];
+      movable[m] = pinned[species_[j]] == 0 ? 1 : 0;
+    }
+  }
+};
+
+template <typename real>
+void soa_neighbor_sums(const SoaParticles<real>& p, int i, int k, double xi,
+                       double yi, int n_nb_cells, int* nb_cells,
+                       int* cell_start, int periodic, double size_x,
+                       double size_y, double rv, double r1, double r0_x_2,
+                       const real* slopes, const real* intercs, double* sums,
+                       int* counts) {
+  // Sum the pairwise terms of particle i (of species k) over its neighbors,
+  // as the loop over neighbors in the main code does: sums receives the
+  // alignment and attraction-repulsion terms (align_x, align_y, f_x, f_y),
+  // counts the number of same-species and all neighbors within r1. Pairs are
+  // compared on squared distances, and the distance itself is only computed
+  // for those within r1; the inner loop has no branches (only masked
+  // lanes), so that it vectorizes. slopes and intercs are those of species
+  // k.
+  real x_i = xi, y_i = yi, sx = size_x, sy = size_y;
+  real half_x = size_x / 2., half_y = size_y / 2.;
+  real rv2 = rv * rv, r12 = r1 * r1, core = r0_x_2;
+  // Neighbors are counted in real as well, so that all lanes have the same
+  // width (exact up to 2**24 neighbors in float)
+  real align_x = 0, align_y = 0, f_x = 0, f_y = 0, ingroup_nb = 0,
+    total_nb = 0;
+  int nb, m, m_end;
+  for (nb = 0; nb < n_nb_cells; nb++) {
+    m_end = cell_start[nb_cells[nb] + 1];
+    #pragma omp simd reduction(+:align_x,align_y,f_x,f_y,ingroup_nb,total_nb)
+    for (m = cell_start[nb_cells[nb]]; m < m_end; m++) {
+      real dis_x = p.x[m] - x_i;
+      real dis_y = p.y[m] - y_i;
+      if (periodic) {
+        // Nearest image
+        dis_x += (dis_x < -half_x ? sx : 0) - (dis_x > half_x ? sx : 0);
+        dis_y += (dis_y < -half_y ? sy : 0) - (dis_y > half_y ? sy : 0);
+      }
+      real r2 = dis_x * dis_x + dis_y * dis_y;
+      int other = p.index[m] != i;
+      int near_v = other & (r2 <= rv2);
+      int near_1 = other & (r2 <= r12);
+      int k2 = p.species[m];
+      real w_v = near_v ? p.movable[m] : 0;
+      real w_1 = 0;
+      if (near_1) {
+        // Only pairs within r1 take the root; the block is masked rather
+        // than branched on, so that the loop still vectorizes
+        real r = sqrt(r2);
+        real temp = r * slopes[k2] + intercs[k2];
+        // Infinite repulsion inside the core, equilibrium attraction and
+        // repulsion outside
+        w_1 = r < core ? (real) -10000 : (r > 0 ? temp / r : 0);
+      }
+      align_x += w_v * p.dir_x[m];
+      align_y += w_v * p.dir_y[m];
+      f_x += w_1 * dis_x;
+      f_y += w_1 * dis_y;
+      ingroup_nb += near_1 && k2 == k ? 1 : 0;
+      total_nb += near_1 ? 1 : 0;
+    }
+  }
+  sums[0] = align_x;
+  sums[1] = align_y;
+  sums[2] = f_x;
+  sums[3] = f_y;
+  counts[0] = (int) ingroup_nb;
+  counts[1] = (int) total_nb;
+}
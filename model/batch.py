@@ -0,0 +1,212 @@
+"""This module runs parameter sweeps of Model headlessly (without Tkinter),
+spread over a pool of processes.
+
+    python -m model.batch SPEC OUTPUT_DIR [--processes N]
+
+SPEC is a JSON file (or YAML, if PyYAML is installed) of the form
+
+    {
+        "base": {<value of every parameter in PARAM_INFO>},
+        "sweep": {
+            "Cell Density": [0.1, 0.2, 0.4],
+            "Noise Intensity": {"start": 0.0, "stop": 0.5, "num": 11}
+        },
+        "steps": 500,
+        "scale_factor": 1.0,
+        "periodic_boundary": false,
+        "repeats": 1,
+        "seed": 0,
+        "batch_size": 8,
+        "stats_mask": [1, 1, 1, 1, 1, 1],
+        "stats_stride": 1
+    }
+
+Each swept parameter takes either an explicit list of values or evenly spaced
+numbers from "start" to "stop" (inclusive). The sweep points are all
+combinations of the swept values, each run "repeats" times with a different
+random seed: point i uses "seed" + i, so that any point can be replayed
+exactly. Points are run "batch_size" at a time in one call to the simulation
+code (see ModelBatch). Only the global properties enabled in "stats_mask"
+(in the order of GLOBAL_STATS_NAMES) are computed, for one step out of
+"stats_stride" (see Model). Only "base" and "sweep" are required.
+
+The final state and global properties of point i (with the step of each
+column of global properties, "stats_steps") are written to
+OUTPUT_DIR/point_<i>.npz as soon as it finishes, and OUTPUT_DIR/manifest.json
+lists the parameters of every point. Points whose file already exists are
+skipped, so an interrupted sweep is resumed by running the same command again.
+"""
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+import numpy as np
+
+from common.parameters import PARAM_INFO
+from model.DA import Model, ModelBatch
+
+SPEC_DEFAULTS = {
+    "steps": 500,
+    "scale_factor": 1.0,
+    "periodic_boundary": False,
+    "repeats": 1,
+    "seed": 0,
+    "batch_size": 8
+}
+
+
+def load_spec(path):
+    """Load a sweep specification from a JSON or YAML file, filling in
+    defaults and checking parameter names."""
+    with open(path) as spec_file:
+        if os.path.splitext(path)[1].lower() in [".yaml", ".yml"]:
+            try:
+                import yaml
+            except ImportError:
+                raise ValueError("PyYAML is needed to read {}.".format(path))
+            spec = yaml.safe_load(spec_file)
+        else:
+            spec = json.load(spec_file)
+    for key, value in SPEC_DEFAULTS.items():
+        spec.setdefault(key, value)
+    unknown = [name for name in list(spec["base"]) + list(spec["sweep"])
+               if name not in PARAM_INFO]
+    if unknown:
+        raise ValueError("Unknown parameters: {}.".format(", ".join(unknown)))
+    missing = [name for name in PARAM_INFO if name not in spec["base"]]
+    if missing:
+        raise ValueError("Missing base parameters: {}.".format(
+            ", ".join(missing)))
+    return spec
+
+
+def sweep_values(values):
+    """Expand the values of a swept parameter into a list."""
+    if isinstance(values, dict):
+        return np.linspace(values["start"], values["stop"],
+                           values["num"]).tolist()
+    return list(values)
+
+
+def sweep_points(spec):
+    """Return the parameters of every sweep point, in a fixed order."""
+    names = sorted(spec["sweep"])
+    points = []
+    for combination in itertools.product(
+            *[sweep_values(spec["sweep"][name]) for name in names]):
+        for repeat in range(spec["repeats"]):
+            params = dict(spec["base"])
+            params.update(zip(names, combination))
+            points.append({"params": params, "repeat": repeat})
+    return points
+
+
+def point_path(output_dir, index):
+    return os.path.join(output_dir, "point_{:06d}.npz".format(index))
+
+
+def run_points(args):
+    """Run a group of sweep points together and save the results of each.
+    Returns their indices."""
+    indices, params, spec, output_dir = args
+    models = []
+    for index, each_params in zip(indices, params):
+        model = Model(each_params, scale_factor=spec["scale_factor"],
+                      periodic_boundary=spec["periodic_boundary"],
+                      seed=spec["seed"] + index,
+                      stats_mask=spec.get("stats_mask"),
+                      stats_stride=spec.get("stats_stride", 1))
+        model.init_particles_state()
+        models.append(model)
+    ModelBatch(models).tick(spec["steps"])
+    for index, model in zip(indices, models):
+        pos_x, pos_y, dir_x, dir_y = model.state
+        # Write to a temporary file first so that a crash never leaves a
+        # partial file that would count as done
+        path = point_path(output_dir, index)
+        temp_path = path + ".tmp"
+        with open(temp_path, "wb") as out_file:
+            np.savez_compressed(
+                out_file, pos_x=pos_x, pos_y=pos_y, dir_x=dir_x, dir_y=dir_y,
+                global_stats=model.global_stats,
+                stats_steps=model.stats.steps,
+                n_per_species=model.internal_params["n_per_species"],
+                seed=model.seed)
+        os.rename(temp_path, path)
+    return indices
+
+
+def write_manifest(spec, points, output_dir):
+    """Write the manifest of a sweep, or check that an existing one describes
+    the same sweep."""
+    manifest = {"spec": spec,
+                "points": [dict(point, file=os.path.basename(
+                    point_path(output_dir, i))) for i, point in
+                           enumerate(points)]}
+    manifest_path = os.path.join(output_dir, "manifest.json")
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as manifest_file:
+            previous = json.load(manifest_file)
+        # Round trip through JSON so that both sides compare alike
+        if previous != json.loads(json.dumps(manifest)):
+            raise ValueError(
+                "{} holds a different sweep; use another output "
+                "directory.".format(output_dir))
+    else:
+        with open(manifest_path, "w") as manifest_file:
+            json.dump(manifest, manifest_file, indent=2)
+
+
+def run_sweep(spec, output_dir, processes=None):
+    """Run all sweep points that are not done yet, printing progress."""
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    points = sweep_points(spec)
+    write_manifest(spec, points, output_dir)
+    todo = [i for i in range(len(points))
+            if not os.path.exists(point_path(output_dir, i))]
+    print("{} points, {} done, {} to run.".format(
+        len(points), len(points) - len(todo), len(todo)))
+    if not todo:
+        return
+    size = spec["batch_size"]
+    groups = []
+    for i in range(0, len(todo), size):
+        indices = todo[i:i + size]
+        groups.append((indices, [points[j]["params"] for j in indices], spec,
+                       output_dir))
+    start_time = time.time()
+    pool = multiprocessing.Pool(processes)
+    try:
+        n_done = 0
+        for indices in pool.imap_unordered(run_points, groups):
+            n_done += len(indices)
+            elapsed = time.time() - start_time
+            print("[{}/{}] {:.0f}s elapsed, {:.0f}s left".format(
+                n_done, len(todo), elapsed,
+                elapsed / n_done * (len(todo) - n_done)))
+            sys.stdout.flush()
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("spec", help="sweep specification (JSON or YAML)")
+    parser.add_argument("output_dir")
+    parser.add_argument("--processes", type=int, default=None,
+                        help="number of worker processes (default: all CPUs)")
+    args = parser.parse_args()
+    run_sweep(load_spec(args.spec), args.output_dir, args.processes)
+
+
+if __name__ == "__main__":
+    main()
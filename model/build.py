@@ -0,0 +1,188 @@
+"""This module builds the C++ simulation code (see weave_compile.py) ahead of
+time and loads the built extension.
+
+    python -m model.build [--force] [--clean]
+
+Builds are cached under BUILD_DIR (model/_build, or $SOIE_BUILD_DIR), one
+directory per build key: a hash of the C++ sources, weave_compile.py, the
+compiler and its flags, and the Python version and platform. Editing any of
+them thus leads to a new build instead of loading a stale one, and a
+directory is only created once its build has succeeded, so that a failed or
+interrupted build never counts as done. A file lock serializes concurrent
+builders (for example, several processes started at once): the first one
+builds, and the others wait and then load its result.
+
+Running the command above once after installing (or after updating the
+sources) makes every later start of the application a plain import. If
+nothing is built yet, ``load`` builds on first use; if the build fails or
+weave is not installed, it warns and returns None, and Model falls back to
+the NumPy backend.
+
+The code is built with OpenMP (OPENMP_ARGS) so that Model can run on several
+threads. If the compiler does not support OpenMP, it is built without, and
+runs on one thread whatever the number asked for.
+"""
+import argparse
+import hashlib
+import imp
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import warnings
+try:
+    import fcntl
+except ImportError:  # Windows: no locking
+    fcntl = None
+
+from common.io_utils import replace_file
+
+MODEL_PATH = os.path.dirname(os.path.abspath(__file__))
+CODE_PATH = os.path.join(MODEL_PATH, "_c_code")
+BUILD_DIR = os.environ.get("SOIE_BUILD_DIR",
+                           os.path.join(MODEL_PATH, "_build"))
+MODULE_NAME = "c_code"
+COMPILER = "gcc"
+# Vectorize loops, and the ones marked "omp simd" even without OpenMP
+EXTRA_COMPILE_ARGS = ["-ftree-vectorize", "-fopenmp-simd"]
+OPENMP_ARGS = ["-fopenmp"]
+
+
+def build_key():
+    """Return the key of the build of the current sources and settings."""
+    sha = hashlib.sha1()
+    sources = [os.path.join(CODE_PATH, name)
+               for name in sorted(os.listdir(CODE_PATH))
+               if name.endswith(".cpp")]
+    sources.append(os.path.join(MODEL_PATH, "weave_compile.py"))
+    for path in sources:
+        with open(path, "rb") as infile:
+            sha.update(os.path.basename(path).encode("utf-8"))
+            sha.update(infile.read())
+    sha.update(repr([COMPILER, EXTRA_COMPILE_ARGS, OPENMP_ARGS, sys.version,
+                     platform.platform()]).encode("utf-8"))
+    return sha.hexdigest()[:16]
+
+
+def build_path(key=None):
+    """Return the directory of a build (of the current sources by default)."""
+    return os.path.join(BUILD_DIR, key or build_key())
+
+
+class _BuildLock(object):
+    """An exclusive lock on a build key, held across processes."""
+    def __init__(self, key):
+        self.path = os.path.join(BUILD_DIR, key + ".lock")
+        self.lock_file = None
+
+    def __enter__(self):
+        self.lock_file = open(self.path, "w")
+        if fcntl is not None:
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        if fcntl is not None:
+            fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+        self.lock_file.close()
+
+
+def build(force=False):
+    """Build the C++ code unless a build of the current sources exists, and
+    return the directory of the build. Raises whatever the compilation
+    raises (ImportError if weave is not installed)."""
+    key = build_key()
+    path = build_path(key)
+    if not os.path.isdir(BUILD_DIR):
+        try:
+            os.makedirs(BUILD_DIR)
+        except OSError:  # Created by another builder in the meantime
+            if not os.path.isdir(BUILD_DIR):
+                raise
+    with _BuildLock(key):
+        if os.path.isdir(path):
+            if not force:
+                # Built while waiting for the lock, or earlier
+                return path
+            shutil.rmtree(path)
+        from model.weave_compile import weave_compile
+        # Build in a temporary directory, renamed once complete
+        temp_path = tempfile.mkdtemp(prefix=key + ".", dir=BUILD_DIR)
+        try:
+            try:
+                weave_compile(location=temp_path, compiler=COMPILER,
+                              extra_compile_args=EXTRA_COMPILE_ARGS +
+                              OPENMP_ARGS, extra_link_args=OPENMP_ARGS)
+            except ImportError:
+                raise
+            except Exception:
+                warnings.warn("Building with OpenMP failed; building for a "
+                              "single thread instead.")
+                weave_compile(location=temp_path, compiler=COMPILER,
+                              extra_compile_args=EXTRA_COMPILE_ARGS)
+            try:
+                replace_file(temp_path, path)
+            except OSError:
+                # Without fcntl there is no lock: another process may have
+                # built it in the meantime, and may be using it
+                if not os.path.isdir(path):
+                    raise
+                shutil.rmtree(temp_path, ignore_errors=True)
+        except BaseException:
+            shutil.rmtree(temp_path, ignore_errors=True)
+            raise
+    return path
+
+
+def load(build_missing=True):
+    """Return the built C++ code as a module, building it first if needed
+    and build_missing is True. Warn and return None if it is unavailable."""
+    path = build_path()
+    try:
+        if not os.path.isdir(path):
+            if not build_missing:
+                return None
+            path = build()
+        module_info = imp.find_module(MODULE_NAME, [path])
+        try:
+            return imp.load_module(MODULE_NAME, *module_info)
+        finally:
+            if module_info[0] is not None:
+                module_info[0].close()
+    except Exception as error:
+        warnings.warn("C++ simulation code unavailable ({}: {}); using the "
+                      "NumPy backend instead.".format(type(error).__name__,
+                                                      error), stacklevel=2)
+        return None
+
+
+def clean(keep=None):
+    """Remove all builds but the one with key keep."""
+    if not os.path.isdir(BUILD_DIR):
+        return
+    for name in os.listdir(BUILD_DIR):
+        if keep is not None and name.startswith(keep):
+            continue
+        path = os.path.join(BUILD_DIR, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            os.remove(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--force", action="store_true",
+                        help="rebuild even if a build of the sources exists")
+    parser.add_argument("--clean", action="store_true",
+                        help="remove builds of other sources or settings")
+    args = parser.parse_args()
+    path = build(force=args.force)
+    if args.clean:
+        clean(keep=os.path.basename(path))
+    print("Built {}".format(path))
+
+
+if __name__ == "__main__":
+    main()
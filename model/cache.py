@@ -0,0 +1,175 @@
+"""This module contains FitnessCache, a cache of the global properties of
+simulations, used to avoid simulating the same genotype twice.
+
+An entry is keyed by a hash of everything that determines a simulation: the
+parameters of the genotype, the scale factor, the boundary conditions, the
+range of steps summarized, the random seed of the simulation, and how it is
+run (the backend and the version of its code, the update scheme, the
+precision and the neighbor search), and by which global properties were
+computed if not all of them. Its value is a summary of the global properties
+over that range of steps:
+
+    {"mean": [...], "abs_mean": [...], "min": [...], "max": [...]}
+
+with one number per global property (NaN for those not computed).
+
+Entries are kept in memory up to ``max_entries``, evicting the least recently
+used ones first. If a directory is given, entries are also stored there, one
+small JSON file each, so that they survive eviction and application restarts;
+CACHE_PATH, under sessions/, is the default location. The directory holds at
+most ``max_files`` entries: beyond that, the least recently used ones (by
+modification time, which lookups refresh) are deleted.
+"""
+import hashlib
+import json
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+from common.io_utils import replace_file
+from model import build, numpy_backend
+from model.DA import DEFAULT_BACKEND
+
+CACHE_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                          "sessions", "fitness_cache")
+# Versions of the code of each backend, see code_version
+_CODE_VERSIONS = {}
+
+
+def code_version(backend):
+    """Return a hash of the code run by a simulation backend (see
+    model.DA.BACKENDS): the build key of the C++ code, or a hash of the
+    NumPy backend."""
+    if backend not in _CODE_VERSIONS:
+        if backend == "numpy":
+            path = os.path.splitext(numpy_backend.__file__)[0] + ".py"
+            with open(path, "rb") as infile:
+                version = hashlib.sha1(infile.read()).hexdigest()[:16]
+        else:
+            version = build.build_key()
+        _CODE_VERSIONS[backend] = version
+    return _CODE_VERSIONS[backend]
+
+
+def summarize(global_stats):
+    """Summarize a [stat, step] array of global properties."""
+    # Properties that were not computed (NaN) summarize to NaN
+    with np.errstate(invalid="ignore"):
+        return {"mean": global_stats.mean(axis=1).tolist(),
+                "abs_mean": abs(global_stats).mean(axis=1).tolist(),
+                "min": global_stats.min(axis=1).tolist(),
+                "max": global_stats.max(axis=1).tolist()}
+
+
+class FitnessCache(object):
+    """A least-recently-used cache of summaries of global properties, with an
+    optional on-disk tier.
+
+    Methods:
+        key: Return the key of a simulation.
+        get: Return the summary stored for a key, or None.
+        put: Store the summary for a key.
+
+    Attributes:
+        max_entries (int): Number of entries kept in memory.
+        path (str): Directory of the on-disk tier, or None.
+        max_files (int): Number of entries kept in the directory.
+        hits, misses (int): Number of lookups that found (or did not find)
+            an entry.
+    """
+    def __init__(self, max_entries=4096, path=None, max_files=100000):
+        self.max_entries = max_entries
+        self.path = path
+        self.max_files = max_files
+        self.entries = OrderedDict()
+        self.hits = self.misses = 0
+        # Entries written since the directory was last pruned
+        self._written = 0
+        if path is not None:
+            if not os.path.isdir(path):
+                os.makedirs(path)
+            self._prune()
+
+    @staticmethod
+    def key(parameters, scale_factor, periodic_boundary, equi_range, seed,
+            stats_mask=None, backend=DEFAULT_BACKEND, n_threads=0,
+            precision="float64", neighbor_search="cell_list"):
+        """Return the key of a simulation, a hash of what determines it.
+        stats_mask tells which global properties are computed, all of them
+        if None; the other arguments are those of model.DA.Model, with the
+        same defaults (only the update scheme of n_threads matters, not the
+        number of threads)."""
+        content = [parameters, float(scale_factor), bool(periodic_boundary),
+                   list(equi_range), seed, backend, code_version(backend),
+                   min(n_threads, 1), precision, neighbor_search]
+        if stats_mask is not None:
+            content.append([int(each) for each in stats_mask])
+        content = json.dumps(content, sort_keys=True)
+        return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+    def _file(self, key):
+        return os.path.join(self.path, key + ".json")
+
+    def get(self, key):
+        """Return the summary stored for a key, or None."""
+        if key in self.entries:
+            summary = self.entries.pop(key)
+        elif self.path is not None and os.path.exists(self._file(key)):
+            with open(self._file(key)) as infile:
+                summary = json.load(infile)
+            try:
+                # Recently used, see _prune
+                os.utime(self._file(key), None)
+            except OSError:
+                pass
+        else:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._remember(key, summary)
+        return summary
+
+    def put(self, key, summary):
+        """Store the summary for a key."""
+        self._remember(key, summary)
+        if self.path is not None:
+            # Write to a temporary file first so that readers never see a
+            # partial entry
+            temp_file = self._file(key) + ".{}.tmp".format(os.getpid())
+            with open(temp_file, "w") as outfile:
+                json.dump(summary, outfile)
+            replace_file(temp_file, self._file(key))
+            self._written += 1
+            if self._written >= max(self.max_files // 10, 1):
+                self._prune()
+
+    def _prune(self):
+        """Delete the least recently used entries of the directory beyond
+        max_files."""
+        self._written = 0
+        names = [name for name in os.listdir(self.path)
+                 if name.endswith(".json")]
+        if len(names) <= self.max_files:
+            return
+        times = []
+        for name in names:
+            try:
+                times.append((os.path.getmtime(os.path.join(self.path, name)),
+                              name))
+            except OSError:
+                # Deleted by another process
+                pass
+        times.sort()
+        for _, name in times[:len(times) - self.max_files]:
+            try:
+                os.remove(os.path.join(self.path, name))
+            except OSError:
+                pass
+
+    def _remember(self, key, summary):
+        """Keep an entry in memory as the most recently used one."""
+        self.entries.pop(key, None)
+        self.entries[key] = summary
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
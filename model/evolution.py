@@ -0,0 +1,416 @@
+"""This module contains Evolution, a headless genetic algorithm that evolves a
+population of genotypes towards high values of a global property.
+
+The population can be of any size. Each generation, the individuals that have
+not been evaluated yet are simulated for ``equi_range[1]`` steps, and no
+more, in batches (see ModelBatch) spread over the worker processes of a
+SimulationPool (see model.workers); their fitness is the mean absolute value
+of the chosen global property over the steps in ``equi_range``. That is the
+only global property computed; the others are NaN (see Model.stats_mask),
+and only the last steps are kept, so ``rebuild`` simulates phenotypes again
+to show them. Individuals carried over from the previous generation keep
+their fitness. New individuals are bred from the evaluated ones with
+``GenoGenerator.mutate`` and ``GenoGenerator.crossover``.
+
+Every individual is simulated with the same random seed (common random
+numbers: the same draws for the initial state and the noise), so that
+differences in fitness come from the genotypes rather than from the luck of
+the draw, and with the update scheme of ``n_threads`` (see Model.n_threads),
+that of the simulations on display. An optional FitnessCache
+(see model.cache) then spares simulating a genotype that has been evaluated
+before under the same settings, which is frequent as mutation and crossover
+keep producing copies of their parents. Individuals whose fitness comes from
+the cache have no phenotype until ``phenotypes`` is called.
+
+With ``racing`` set to a number of rungs, new individuals are evaluated in a
+race (successive halving): they are simulated rung by rung, the rungs
+splitting equi_range evenly, and at each rung those in the less fit half
+whose running fitness is more than race_margin below the bar (the fitness of
+the n_elite-th fittest individual known so far) drop out. Their fitness is
+their running fitness, which is not cached, and their phenotype stops where
+they dropped out until ``phenotypes`` is called. The steps saved can be
+spent on more generations (see ``run``); ``report`` sums them up.
+
+Selection is either:
+
+    * "elitist": the n_elite fittest individuals survive, and children are
+      bred from them.
+    * "tournament": the n_elite fittest individuals survive, and each parent
+      of a child is the fittest of tournament_size individuals drawn at random.
+"""
+import multiprocessing
+
+import numpy as np
+
+from common.parameters import (GLOBAL_STATS_NAMES_INV, N_GLOBAL_STATS,
+                               PLOT_STEPS)
+from common.profiling import PROFILER
+from model.cache import FitnessCache, summarize
+from model.DA import ModelBatch
+from model.genetic import Phenotype
+from model.workers import SimulationPool
+
+SELECTIONS = ["elitist", "tournament"]
+# Fraction of the individuals in a race that are sure to go on to the next
+# rung (successive halving)
+RACE_KEEP = 0.5
+
+
+def evaluate(args):
+    """Simulate a batch of individuals up to target_step and return the
+    summaries of their global properties over equi_range up to target_step
+    (see model.cache) and their phenotypes. Individuals are either genotypes,
+    simulated from the start, or phenotypes of a previous call, simulated on
+    from where they are; all of them must be at the same step. Only the
+    global properties in stats_mask are computed. New phenotypes run on
+    n_threads, 0 or 1, which selects the update scheme (see
+    Model.n_threads)."""
+    (individuals, target_step, scale_factor, periodic_boundary, equi_range,
+     seed, stats_mask, n_threads) = args
+    start_step, end_step = equi_range
+    # Global properties are only needed from start_step on (and for plotting)
+    stats_max_steps = max(end_step - start_step, PLOT_STEPS)
+    phenotypes = [each if isinstance(each, Phenotype) else
+                  Phenotype(each, scale_factor, periodic_boundary,
+                            stats_max_steps=stats_max_steps, seed=seed,
+                            n_threads=n_threads)
+                  for each in individuals]
+    ModelBatch([each.model for each in phenotypes]).tick(
+        target_step - phenotypes[0].step, stats_mask=stats_mask)
+    summaries = []
+    for each in phenotypes:
+        each.step = target_step
+        summaries.append(summarize(each.model.stats.window(start_step,
+                                                           target_step)))
+    return summaries, phenotypes
+
+
+def rebuild(args):
+    """Simulate a genotype from the start up to target_step, computing and
+    keeping all global properties, and return its phenotype, set to run on
+    n_threads."""
+    (genotype, target_step, scale_factor, periodic_boundary, seed,
+     n_threads) = args
+    # Worker processes run side by side, one thread each; the results do not
+    # depend on the number of threads (see Model.n_threads)
+    phenotype = Phenotype(genotype, scale_factor, periodic_boundary,
+                          seed=seed, n_threads=min(n_threads, 1))
+    phenotype.add_steps(target_step)
+    phenotype.model.n_threads = n_threads
+    return phenotype
+
+
+class Evolution(object):
+    """A genetic algorithm using a global property as the fitness function.
+
+    Methods:
+        run: Evolve a population for a number of generations.
+        phenotypes: Return the phenotypes of the fittest individuals,
+            simulating those whose fitness comes from the cache or a race
+            they dropped out of.
+        rebuild: Simulate phenotypes again with all global properties.
+        report: Return a summary of the steps simulated and saved.
+
+    Attributes:
+        ranked (list): (fitness, genotype, phenotype) of the current
+            population, from the fittest. The phenotype is None if the
+            fitness comes from the cache.
+        seed (int): Random seed of the simulation of every individual, and
+            of the selection of parents.
+        random (numpy.random.RandomState): Draws the parents and whether
+            they are crossed over, from seed.
+        stats_mask (list): The global properties computed, only the one
+            maximized.
+        n_threads (int): Number of threads of the phenotypes that
+            ``rebuild`` returns. Every individual is simulated with the
+            update scheme it selects (see Model.n_threads), on one thread.
+        pool (SimulationPool): Worker processes simulations run in, or None
+            for a new pool in each ``run``.
+        cache (FitnessCache): Cache of fitnesses, or None.
+        racing (int): Number of rungs of a race, 0 (no racing) or at least
+            2, see module docstring.
+        race_margin (float): How far below the bar an individual has to be
+            to drop out of a race.
+        steps_simulated (int): Steps simulated by the last ``run``, over all
+            individuals.
+        steps_saved (int): Steps not simulated by the last ``run`` thanks to
+            racing.
+        steps_cached (int): Steps not simulated by the last ``run`` thanks to
+            the cache.
+    """
+    def __init__(self, geno_generator, which_prop, equi_range,
+                 scale_factor=1., periodic_boundary=False, pop_size=9,
+                 selection="elitist", n_elite=1, tournament_size=3,
+                 crossover_rate=0., pool=None, processes=None, batch_size=8,
+                 seed=None, cache=None, racing=0, race_margin=0.1,
+                 n_threads=0):
+        """
+        Parameters:
+            geno_generator (GenoGenerator): Breeds new genotypes.
+            which_prop (str): Name of the global property to maximize.
+            equi_range (tuple): Range of steps over which fitness is averaged.
+            scale_factor, periodic_boundary: Settings of the simulations.
+            pop_size (int): Number of individuals in each generation.
+            selection (str): "elitist" or "tournament", see module docstring.
+            n_elite (int): Number of fittest individuals that survive.
+            tournament_size (int): Number of individuals in a tournament.
+            crossover_rate (float): Probability that a child is bred by
+                crossover of two parents rather than by mutation of one.
+            pool (SimulationPool): Worker processes to simulate in (default:
+                a new one, stopped at the end of each ``run``).
+            processes (int): Number of worker processes of the default pool
+                (default: all CPUs).
+            batch_size (int): Number of individuals simulated together.
+            seed (int): See ``Attributes`` (default: drawn at random).
+            cache (FitnessCache): See ``Attributes``.
+            racing, race_margin: See ``Attributes``.
+            n_threads (int): See ``Attributes``.
+        """
+        if selection not in SELECTIONS:
+            raise ValueError("Unknown selection '{}'.".format(selection))
+        if racing == 1 or racing < 0:
+            raise ValueError("A race has 0 (no racing) or at least 2 rungs.")
+        self.geno_generator = geno_generator
+        self.prop_index = GLOBAL_STATS_NAMES_INV[which_prop]
+        self.stats_mask = [int(i == self.prop_index)
+                           for i in range(N_GLOBAL_STATS)]
+        self.equi_range = tuple(equi_range)
+        self.scale_factor = scale_factor
+        self.periodic_boundary = periodic_boundary
+        self.pop_size = pop_size
+        self.selection = selection
+        self.n_elite = max(1, min(n_elite, pop_size))
+        self.tournament_size = tournament_size
+        self.crossover_rate = crossover_rate
+        self.pool = pool
+        self.processes = processes
+        self.batch_size = batch_size
+        if seed is None:
+            seed = geno_generator.random.randint(2**31)
+        self.seed = seed
+        self.random = np.random.RandomState(seed)
+        self.cache = cache
+        self.racing = racing
+        self.race_margin = race_margin
+        self.n_threads = n_threads
+        self.ranked = []
+        self.steps_simulated = self.steps_saved = self.steps_cached = 0
+        self._pool = None
+
+    def _key(self, genotype):
+        return FitnessCache.key(genotype.parameters, self.scale_factor,
+                                self.periodic_boundary, self.equi_range,
+                                self.seed, self.stats_mask,
+                                n_threads=self.n_threads)
+
+    def _simulate(self, individuals, target_step=None):
+        """Return the summaries and phenotypes of individuals (genotypes or
+        phenotypes), simulated in parallel up to target_step (default: the
+        end of equi_range)."""
+        if target_step is None:
+            target_step = self.equi_range[1]
+        # Individuals at different steps go to different batches
+        groups = {}
+        for i, each in enumerate(individuals):
+            step = each.step if isinstance(each, Phenotype) else 0
+            groups.setdefault(step, []).append(i)
+        order, tasks = [], []
+        for step, indices in sorted(groups.items()):
+            for i in range(0, len(indices), self.batch_size):
+                batch = indices[i:i + self.batch_size]
+                order += batch
+                tasks.append(([individuals[j] for j in batch], target_step,
+                              self.scale_factor, self.periodic_boundary,
+                              self.equi_range, self.seed, self.stats_mask,
+                              min(self.n_threads, 1)))
+        summaries, phenotypes = [], []
+        with PROFILER.span("evaluate", "evolution", batches=len(tasks),
+                           target_step=target_step):
+            for each_summaries, each_phenotypes in self._pool.imap(
+                    evaluate, tasks):
+                summaries += each_summaries
+                phenotypes += each_phenotypes
+        results = [None] * len(individuals)
+        for i, summary, phenotype in zip(order, summaries, phenotypes):
+            results[i] = (summary, phenotype)
+        return ([each[0] for each in results], [each[1] for each in results])
+
+    def _race(self, genotypes, known):
+        """Return the summaries and phenotypes of genotypes simulated in a
+        race, and whether each of them got to the end of equi_range. known
+        are the fitnesses of the individuals already evaluated."""
+        start_step, end_step = self.equi_range
+        rungs = [start_step + (end_step - start_step) * k // self.racing
+                 for k in range(1, self.racing)] + [end_step]
+        summaries = [None] * len(genotypes)
+        individuals = list(genotypes)
+        racers = range(len(genotypes))
+        step = 0
+        for rung in rungs:
+            self.steps_simulated += (rung - step) * len(racers)
+            step = rung
+            each_summaries, each_phenotypes = self._simulate(
+                [individuals[i] for i in racers], rung)
+            for i, summary, phenotype in zip(racers, each_summaries,
+                                             each_phenotypes):
+                summaries[i] = summary
+                individuals[i] = phenotype
+            if rung == end_step or len(racers) < 2:
+                break
+            fitness = dict((i, summaries[i]["abs_mean"][self.prop_index])
+                           for i in racers)
+            # The fitness to beat to be among the n_elite fittest, so far
+            bar = sorted(known + fitness.values(),
+                         reverse=True)[self.n_elite - 1]
+            ranked = sorted(racers, key=lambda i: -fitness[i])
+            n_keep = int(np.ceil(len(racers) * RACE_KEEP))
+            dropped = [i for i in ranked[n_keep:]
+                       if fitness[i] < bar * (1 - self.race_margin)]
+            self.steps_saved += (end_step - rung) * len(dropped)
+            racers = [i for i in racers if i not in dropped]
+        complete = [each.step == end_step for each in individuals]
+        return summaries, individuals, complete
+
+    def _evaluate(self, genotypes, known=()):
+        """Return (fitness, genotype, phenotype) of each genotype, from the
+        cache or simulated in parallel (in a race if racing). known are the
+        fitnesses of the individuals already evaluated."""
+        results = [None] * len(genotypes)
+        known = list(known)
+        missing = []
+        for i, genotype in enumerate(genotypes):
+            summary = None
+            if self.cache is not None:
+                summary = self.cache.get(self._key(genotype))
+            if summary is None:
+                missing.append(i)
+            else:
+                self.steps_cached += self.equi_range[1]
+                results[i] = (summary["abs_mean"][self.prop_index], genotype,
+                              None)
+                known.append(results[i][0])
+        if self.racing:
+            summaries, phenotypes, complete = self._race(
+                [genotypes[i] for i in missing], known)
+        else:
+            summaries, phenotypes = self._simulate([genotypes[i]
+                                                    for i in missing])
+            complete = [True] * len(missing)
+            self.steps_simulated += self.equi_range[1] * len(missing)
+        for i, summary, phenotype, done in zip(missing, summaries,
+                                               phenotypes, complete):
+            # Only the fitness over all of equi_range is cached
+            if self.cache is not None and done:
+                self.cache.put(self._key(genotypes[i]), summary)
+            results[i] = (summary["abs_mean"][self.prop_index], genotypes[i],
+                          phenotype)
+        return results
+
+    def phenotypes(self, num):
+        """Return the phenotypes of the num fittest individuals, simulating
+        those whose fitness comes from the cache or a race they dropped out
+        of. Only available while ``run`` is running, e.g. from its
+        callback."""
+        end_step = self.equi_range[1]
+        missing = [i for i, each in enumerate(self.ranked[:num])
+                   if each[2] is None or each[2].step < end_step]
+        _, phenotypes = self._simulate([self.ranked[i][2] or self.ranked[i][1]
+                                        for i in missing])
+        for i, phenotype in zip(missing, phenotypes):
+            self.ranked[i] = self.ranked[i][:2] + (phenotype,)
+        return [each[2] for each in self.ranked[:num]]
+
+    def rebuild(self, phenotypes):
+        """Return new phenotypes of the same genotypes and at the same steps
+        as phenotypes, simulated from the start in parallel with all global
+        properties computed and kept, as the GUI simulates them, on
+        n_threads. They follow the same dynamics as the individuals
+        evaluated. Only available while ``run`` is running."""
+        tasks = [(each.genotype, each.step, self.scale_factor,
+                  self.periodic_boundary, self.seed, self.n_threads)
+                 for each in phenotypes]
+        return list(self._pool.imap(rebuild, tasks))
+
+    def report(self):
+        """Return a summary of the steps simulated and saved by the last
+        ``run``."""
+        total = self.steps_simulated + self.steps_saved + self.steps_cached
+        return ("Steps simulated: {}, saved by racing: {} ({:.0%}), by the "
+                "cache: {} ({:.0%})".format(
+                    self.steps_simulated, self.steps_saved,
+                    self.steps_saved / float(max(total, 1)),
+                    self.steps_cached,
+                    self.steps_cached / float(max(total, 1))))
+
+    def _pick_parent(self):
+        """Choose a parent from the current population."""
+        if self.selection == "elitist":
+            return self.ranked[self.random.randint(self.n_elite)][1]
+        # Tournament: the fittest (lowest rank) of a random draw wins
+        draw = self.random.randint(len(self.ranked),
+                                   size=self.tournament_size)
+        return self.ranked[draw.min()][1]
+
+    def _breed(self, num):
+        """Return num new genotypes bred from the current population."""
+        children = []
+        for _ in range(num):
+            if self.random.random_sample() < self.crossover_rate:
+                parents = [self._pick_parent(), self._pick_parent()]
+                children += self.geno_generator.crossover(parents, num=1)
+            else:
+                children += self.geno_generator.mutate(self._pick_parent(),
+                                                       num=1)
+        return children
+
+    def run(self, num_gen, initial=None, callback=None, step_budget=None):
+        """Evolve the population for num_gen generations, and then for as
+        many more as step_budget allows.
+
+        Parameters:
+            num_gen (int): Number of generations.
+            initial (list): Genotypes to start from, completed with random
+                ones (or truncated) to pop_size.
+            callback (function): Called as callback(generation, ranked) once
+                the initial population and each generation are evaluated.
+            step_budget (int): Number of steps, simulated or taken from the
+                cache, over all individuals: once num_gen generations are
+                done, generations go on until it is spent (typically the
+                steps saved by racing).
+
+        Returns:
+            list: (fitness, genotype, phenotype) of the final population,
+                from the fittest.
+        """
+        initial = list(initial or [])[:self.pop_size]
+        initial += self.geno_generator.new_population(
+            self.pop_size - len(initial))
+        self.steps_simulated = self.steps_saved = self.steps_cached = 0
+        # Cost of a generation without racing or the cache
+        gen_steps = (self.pop_size - self.n_elite) * self.equi_range[1]
+        self._pool = self.pool
+        if self.pool is None:
+            self._pool = SimulationPool(self.processes or
+                                        multiprocessing.cpu_count())
+        try:
+            evaluated = self._evaluate(initial)
+            generation = 0
+            while True:
+                self.ranked = sorted(evaluated, key=lambda x: -x[0])
+                if callback is not None:
+                    callback(generation, self.ranked)
+                spent = self.steps_simulated + self.steps_cached
+                if generation >= num_gen and (
+                        step_budget is None or
+                        spent + gen_steps > step_budget):
+                    break
+                elite = self.ranked[:self.n_elite]
+                children = self._breed(self.pop_size - len(elite))
+                evaluated = elite + self._evaluate(
+                    children, [each[0] for each in elite])
+                generation += 1
+        finally:
+            if self.pool is None:
+                self._pool.close()
+            self._pool = None
+        return self.ranked
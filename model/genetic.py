@@ -1,15 +1,24 @@
 """This module contains the logic of the genetic algorithm.
+
+Simulations are run in the background by the Scheduler of their Population
+(see model.scheduler): methods that run them submit a job and return it
+without waiting for the steps to be run.
 """
 
-import concurrent.futures
 import copy_reg
+import time
 import types
 from copy import deepcopy
 
 import numpy as np
 
-from common.parameters import GLOBAL_STATS_NAMES_INV, DEFAULT_STEPS
+from common.parameters import DEFAULT_STEPS, EVOLUTION_SEED
+from common.profiling import PROFILER
+from model.cache import CACHE_PATH, FitnessCache
 from model.DA import Model
+from model.scheduler import ADAPTIVE, CHUNK_STEPS, FRAME_BUDGET, Scheduler
+from model.stats import GlobalStats
+from model.workers import SimulationPool
 
 
 def _pickle_method(method):
@@ -37,12 +46,31 @@ def _unpickle_method(func_name, obj, cls):
 copy_reg.pickle(types.MethodType, _pickle_method, _unpickle_method)
 
 
-def ticks(group):
-    """Wrapper function for .add_steps method.
+def _chunks(job, n_steps, movement):
+    """Split n_steps into the chunks run by a job, and checkpoint the job
+    after each. Yield the number of steps of each chunk, and whether the
+    state is shown after it: every movement steps, at the end only if
+    movement is False, or after every chunk if movement is ADAPTIVE.
+
+    Adaptive chunks start with one step, and are then sized to take
+    FRAME_BUDGET, from the time taken by the previous chunk (at most twice
+    as many steps), so that the state is shown at about the same rate
+    whether the simulation is slow or fast.
     """
-    pheno, steps, sim_id = group
-    pheno.add_steps(steps)
-    return pheno, sim_id
+    every = n_steps if movement in (False, ADAPTIVE) else movement
+    done, n = 0, 1
+    while done < n_steps:
+        if movement != ADAPTIVE:
+            n = min(CHUNK_STEPS, every - done % every)
+        n = min(n, n_steps - done)
+        done += n
+        start = time.time()
+        yield n, (movement == ADAPTIVE or done % every == 0 or
+                  done == n_steps)
+        elapsed = time.time() - start
+        if movement == ADAPTIVE:
+            n = max(1, min(2 * n, int(n * FRAME_BUDGET / max(elapsed, 1e-6))))
+        job.checkpoint()
 
 
 class Genotype(object):
@@ -59,6 +87,8 @@ class Phenotype(object):
 
     Methods:
         add_steps: Evolve the phenotype for a given number of steps.
+        fork: Return a copy of this phenotype to be evolved elsewhere.
+        sync: Catch up with a copy of this phenotype evolved elsewhere.
 
     Attributes:
         genotype (Genotype): The genotype associated with this phenotype.
@@ -67,13 +97,20 @@ class Phenotype(object):
             boundary conditions.
         model (Model): The DA.Model object associated with this phenotype.
     """
-    def __init__(self, genotype, scale_factor, periodic_boundary, prev=False):
+    def __init__(self, genotype, scale_factor, periodic_boundary, prev=False,
+                 stats_max_steps=None, seed=None, n_threads=0):
         """
         Parameters:
             scale_factor (float): The scale factor for the simulation
                 associated with this phenotype.
             prev (bool): Whether this phenotype is restored from some
                 previously saved state.
+            stats_max_steps (int): If given, only the global properties of
+                the last stats_max_steps steps are kept.
+            seed (int): Seed of the random numbers of the simulation (drawn
+                at random if not given), see model.DA.
+            n_threads (int): Number of threads of the simulation, see
+                model.DA.Model.
             genotype, periodic_boundary: See ``Attributes``.
         """
         self.genotype = genotype
@@ -81,13 +118,36 @@ class Phenotype(object):
         self.periodic_boundary = periodic_boundary
         self.scale_factor = scale_factor
         self.model = Model(
-            genotype.copy_param(), scale_factor, periodic_boundary)
+            genotype.copy_param(), scale_factor, periodic_boundary,
+            stats_max_steps=stats_max_steps, seed=seed, n_threads=n_threads)
         if not prev:
             self.model.init_particles_state()
 
     def add_steps(self, n_steps):
+        """Evolve for n_steps, and return the global properties of these
+        steps."""
         self.step += n_steps
-        self.model.tick(n_steps)
+        return self.model.tick(n_steps)
+
+    def fork(self):
+        """Return a copy of this phenotype to be evolved in another thread
+        and synced back (see sync). The copy shares the genotype and the
+        trajectory recorder, and keeps the global properties of its own steps
+        only."""
+        model = self.model
+        stats = GlobalStats(offset=model.stats.n_steps,
+                            max_steps=model.stats.max_steps)
+        memo = {id(self.genotype): self.genotype, id(model.stats): stats,
+                id(model.recorder): model.recorder}
+        with PROFILER.span("fork", "model"):
+            return deepcopy(self, memo)
+
+    def sync(self, step, state, global_stats_slice):
+        """Catch up with a copy of this phenotype that has been evolved in a
+        worker process, given the new step, state, and the global properties
+        of the steps in between."""
+        self.model.extend(state, global_stats_slice, step - self.step)
+        self.step = step
 
 
 class GenoGenerator(object):
@@ -101,46 +161,47 @@ class GenoGenerator(object):
         new_population: Generate a population of completely random genotypes.
         crossover: Generate a population using crossover on chosen parents.
         mutate: Generate a population through mutating a chosen parent.
+
+    Attributes:
+        random (numpy.random.RandomState): The source of all random numbers
+            of this generator.
     """
-    @staticmethod
-    def randomize_d0(limits, res=2):
-        return limits[0]+round(np.random.random()*(limits[1]-limits[0]), res)
+    def randomize_d0(self, limits, res=2):
+        return limits[0]+round(self.random.rand()*(limits[1]-limits[0]), res)
 
-    @staticmethod
-    def randomize_d1_discrete(list_of_choices):
+    def randomize_d1_discrete(self, list_of_choices):
         def randomize_d0_discrete(choices):
             if "none" in choices:
                 if len(choices) == 1:
                     return "none"
                 temp = [_ for _ in choices if _ != "none"]
-                return np.random.choice(["none", np.random.choice(temp)],
-                                        p=[0.8, 0.2])
+                return self.random.choice(["none", self.random.choice(temp)],
+                                          p=[0.8, 0.2])
             else:
-                return np.random.choice(choices)
+                return self.random.choice(choices)
         return [randomize_d0_discrete(_) for _ in list_of_choices]
 
-    @staticmethod
-    def randomize_d1_ratio(limits, res=2):
+    def randomize_d1_ratio(self, limits, res=2):
         r1r2_min, r1r2_max, r3_min, r3_max = limits
         # If no restrictions, return
         if ((r1r2_min == 0.0) and (r1r2_max == float("inf")) and
                 (r3_min == 0.0) and (r3_max == 1.0)):
-            return np.random.dirichlet((1, 1, 1)).tolist()
-        ratio3 = round(r3_min + np.random.random()*(r3_max-r3_min), res)
+            return self.random.dirichlet((1, 1, 1)).tolist()
+        ratio3 = round(r3_min + self.random.rand()*(r3_max-r3_min), res)
         rest = 1 - ratio3
 
         if (r1r2_min == 0.0) and (r1r2_max == float("inf")):
-            ratio1 = round(np.random.random()*rest, res)
+            ratio1 = round(self.random.rand()*rest, res)
             ratio2 = round(rest - ratio1, res)
         elif r1r2_max == float("inf"):
             inv = 1/r1r2_min
-            ratio2 = round(np.random.random()*(inv/(inv+1.0)) * rest, res)
+            ratio2 = round(self.random.rand()*(inv/(inv+1.0)) * rest, res)
             ratio1 = round(rest - ratio2, res)
         else:
             r1_max = r1r2_max/(r1r2_max+1.0)
             r1_min = r1r2_min/(r1r2_min+1.0)
             ratio1 = round(
-                (r1_min + np.random.random() * (r1_max - r1_min)) * rest, res)
+                (r1_min + self.random.rand() * (r1_max - r1_min)) * rest, res)
             ratio2 = round(rest - ratio1, res)
 
         return [ratio1, ratio2, ratio3]
@@ -148,11 +209,10 @@ class GenoGenerator(object):
     def randomize_d1(self, limits, res=3):
         return [self.randomize_d0(_, res) for _ in limits]
 
-    @staticmethod
-    def randomize_d1_biased(limits, res=2):
+    def randomize_d1_biased(self, limits, res=2):
         def randomize_d0_biased(limits, res):
             return limits[0] + max(
-                0, round(np.random.random() * 3. * (limits[1] - limits[0])
+                0, round(self.random.rand() * 3. * (limits[1] - limits[0])
                          - 2.0 * (limits[1] - limits[0]), res))
         return [randomize_d0_biased(_, res) for _ in limits]
 
@@ -162,8 +222,16 @@ class GenoGenerator(object):
         return [[temp[i][j] if i <= j else temp[j][i]
                  for j in xrange(3)] for i in xrange(3)]
 
-    def __init__(self, session):
+    def __init__(self, session, seed=None):
+        """
+        Parameters:
+            session (SessionData): Provides the ranges of parameters and the
+                mutation settings.
+            seed (int): Seed of ``random`` (from the operating system if not
+                given).
+        """
         self.session = session
+        self.random = np.random.RandomState(seed)
         session.bind("param_info", self.update_ranges)
         self.update_ranges()
 
@@ -204,18 +272,18 @@ class GenoGenerator(object):
             children.append(self.randomize())
         return children
 
-    @staticmethod
-    def choose(parents, name):
+    def choose(self, parents, name):
         if isinstance(parents, list):
-            temp = np.random.choice(parents).parameters[name]
+            temp = parents[self.random.randint(len(parents))].parameters[name]
         else:
             temp = parents.parameters[name]
         if isinstance(temp, list):
             temp = deepcopy(temp)
         return temp
 
-    def crossover(self, parents):
-        num = 9 - len(parents)
+    def crossover(self, parents, num=None):
+        if num is None:
+            num = 9 - len(parents)
         children = []
         for _ in range(num):
             parameters = {
@@ -234,7 +302,7 @@ class GenoGenerator(object):
             parameters = {
                 name:
                 (generator(self.ranges[name])
-                 if (np.random.random() < rate) and (not_locked[name])
+                 if (self.random.rand() < rate) and (not_locked[name])
                  else self.choose(parent, name))
                 for name, generator in self.param_gen.items()
             }
@@ -262,15 +330,19 @@ class Simulation(object):
         id (str): {0,1,2,..8}. Identifies this simulation on the GUI.
         genotype (Genotype): The genotype associated with this simulation.
         phenotype (Phenotype): The phenotype associated with this simulation.
+        scheduler (Scheduler): Runs this simulation in the background.
     """
-    def __init__(self, geno_generator, session, sim_id):
+    def __init__(self, geno_generator, session, sim_id, scheduler):
         self.id = sim_id
         self.genotype = None
         self.phenotype = None
         self.geno_generator = geno_generator
         self.session = session
+        self.scheduler = scheduler
+        # new_stats: the global properties of some new steps were appended
+        # (posted after every chunk, unlike global_stats)
         self.bindings = {"params": [], "state": [],
-                         "global_stats": [], "step": []}
+                         "global_stats": [], "step": [], "new_stats": []}
 
     def __repr__(self):
         return self.id
@@ -291,6 +363,14 @@ class Simulation(object):
     def global_stats(self):
         return self.phenotype.model.global_stats
 
+    @property
+    def stats(self):
+        return self.phenotype.model.stats
+
+    @property
+    def seed(self):
+        return self.phenotype.model.seed
+
     @property
     def n_per_species(self):
         return self.phenotype.model.internal_params["n_per_species"]
@@ -301,7 +381,8 @@ class Simulation(object):
         function when calling a sequence of functions.
 
         Parameters:
-            data_name (str): {"params", "state", "global_stats", "step"}
+            data_name (str): {"params", "state", "global_stats", "step",
+                "new_stats"}
             func (function): Function to be binded to given data name
         """
         if first:
@@ -315,25 +396,32 @@ class Simulation(object):
 
     def call_bindings(self, data_name):
         """Call binded functions."""
-        for each_func in self.bindings[data_name]:
-            each_func()
+        with PROFILER.span("sim bindings ({})".format(data_name), "gui",
+                           sim=self.id):
+            for each_func in self.bindings[data_name]:
+                each_func()
 
     def load_prev_session(self, data):
         """Restore a simulation from previously saved session data."""
         session = self.session
         sf, pb, _ = session.pheno_settings
         self.genotype = Genotype(data["params"])
-        self.phenotype = Phenotype(self.genotype, sf, pb, prev=True)
-        self.phenotype.model.set(data["state"], data["global_stats"])
+        self.phenotype = Phenotype(self.genotype, sf, pb, prev=True,
+                                   seed=data.get("seed"),
+                                   n_threads=session.n_threads)
+        self.phenotype.model.set(data["state"], data["global_stats"],
+                                 data.get("global_stats_offset", 0))
         self.phenotype.step = data["step"]
         # Update
         for each_data_name in data.keys():
-            self.call_bindings(each_data_name)
+            if each_data_name in self.bindings:
+                self.call_bindings(each_data_name)
 
     def update_phenotype(self):
         """Update phenotype with the new genotype and phenotype settings."""
         sf, pb, _ = self.session.pheno_settings
-        self.phenotype = Phenotype(self.genotype, sf, pb)
+        self.phenotype = Phenotype(self.genotype, sf, pb,
+                                   n_threads=self.session.n_threads)
         self.call_bindings("state")
         self.call_bindings("step")
         self.call_bindings("global_stats")
@@ -362,20 +450,39 @@ class Simulation(object):
         self.update_phenotype()
 
     def add_steps(self, n_steps):
-        """Run the simulation for a given number of steps."""
-        movement = self.session.movement
-        if movement is False:
-            intervals = [n_steps]
-        else:
-            intervals = [movement] * (n_steps/movement)
-            if n_steps % movement > 0:
-                intervals.append(n_steps % movement)
-
-        for step in intervals:
-            self.phenotype.add_steps(step)
-            self.call_bindings("state")
-            self.call_bindings("step")
-        self.call_bindings("global_stats")
+        """Run the simulation for a given number of steps in this process, on
+        all CPUs if parallel update is on (see Model.n_threads), in the
+        background; return the job.
+
+        The steps are run on a copy of the phenotype (see Phenotype.fork),
+        which the phenotype catches up with after each chunk, so that the
+        GUI never sees a chunk half done. The job stops if the simulation
+        gets a new phenotype in the meantime.
+        """
+        scheduler, movement = self.scheduler, self.session.movement
+        phenotype = self.phenotype
+
+        def run(job):
+            work = phenotype.fork()
+            try:
+                for n, show in _chunks(job, n_steps, movement):
+                    # Recording may have been started or stopped in between
+                    work.model.recorder = phenotype.model.recorder
+                    global_stats_slice = work.add_steps(n)
+                    with scheduler.lock, PROFILER.span("sync", "model"):
+                        if self.phenotype is not phenotype:
+                            return
+                        phenotype.sync(
+                            work.step, [np.array(_) for _ in work.model.state],
+                            global_stats_slice)
+                    job.post(self, "new_stats")
+                    if show:
+                        job.post(self, "state", "step")
+            finally:
+                # Also when cancelled
+                if self.phenotype is phenotype:
+                    job.post(self, "state", "step", "global_stats")
+        return scheduler.submit(run, [self])
 
 
 class Population(object):
@@ -389,8 +496,6 @@ class Population(object):
         new_population: Generate a new random population.
         mutate: Apply the mutation operator on a chosen parent.
         crossover: Apply the crossover operator on some chosen parents.
-        mutate2: Apply mutation operator, but for the evolve_by_property
-            function.
         evolve_by_property: Apply a genetic algorithm which uses a global
             property (as opposed to human judgement) as the fitness function.
         insert_from_lib: Insert genes to the simulation frame from the library.
@@ -399,16 +504,30 @@ class Population(object):
             they reach certain target number of steps.
 
     Attributes:
+        scheduler (Scheduler): Runs the simulations in the background.
+        pool (SimulationPool): Worker processes, one for each simulation,
+            used by all methods that run simulations in parallel.
+        fitness_cache (FitnessCache): Fitnesses computed by
+            evolve_by_property, kept across calls and on disk.
     """
     def __init__(self, session):
         self.geno_generator = GenoGenerator(session)
         self.session = session
         session.bind("general_settings", self.update_phenotype)
         self.sf, self.pb, self.vt = session.pheno_settings
-        self.simulations = [Simulation(self.geno_generator, session, str(_))
-                            for _ in range(9)]
+        self.n_threads = session.n_threads
+        self.scheduler = Scheduler()
+        self.simulations = [
+            Simulation(self.geno_generator, session, str(_), self.scheduler)
+            for _ in range(9)]
+        self.pool = SimulationPool(len(self.simulations))
+        # Before the scheduler runs any job, so that the workers are never
+        # forked from a background thread
+        self.pool.start()
+        self.fitness_cache = FitnessCache(path=CACHE_PATH)
 
     def load_prev_session(self, model_data):
+        self.scheduler.cancel()
         self.sf, self.pb, self.vt = self.session.pheno_settings
         for data, sim in zip(model_data, self.simulations):
             sim.load_prev_session(data)
@@ -417,7 +536,8 @@ class Population(object):
         """
         {"periodic_boundary": bool,
         "scale_factor": float,
-        "velocity_trace": list of float}
+        "velocity_trace": list of float,
+        "parallel_update": bool}
         """
         pb_changed = self.pb != self.session.pb
         sf_changed = self.sf != self.session.sf
@@ -425,8 +545,11 @@ class Population(object):
         trace_changed = (not (new_trace[0] == 0 and old_trace[0] == 0)) and (
             (new_trace[0] != old_trace[0]) or (new_trace[1] != old_trace[1]))
         self.sf, self.pb, self.vt = self.session.pheno_settings
+        # Switching the update scheme changes the course of the simulations
+        scheme_changed = (self.n_threads > 0) != (self.session.n_threads > 0)
+        self.n_threads = self.session.n_threads
 
-        rerun_model = pb_changed or sf_changed
+        rerun_model = pb_changed or sf_changed or scheme_changed
         if rerun_model:
             for each in self.simulations:
                 each.update_phenotype()
@@ -471,90 +594,127 @@ class Population(object):
             DEFAULT_STEPS, sims=[each for each in self.simulations
                                  if each not in chosen_sims])
 
-    def mutate2(self, chosen_sim, target_steps):
-        """Mutate function customized for evolve_by_property
+    def evolve_by_property(self, which_prop, num_gen, equi_range,
+                           display_text, highlight_func, pop_size=9,
+                           selection="elitist", racing=0, done=None):
+        """Evolve a population of pop_size, starting from the genotypes on
+        display, using a global property as the fitness function (see
+        model.evolution), in the background; return the job, which stops
+        after the current generation if it is cancelled. After each
+        generation, the 9 fittest individuals are displayed, from the
+        fittest, which is highlighted, simulated again with all global
+        properties (see Evolution.rebuild). Fitnesses are looked up in, and
+        added to, fitness_cache. With racing (a number of rungs), the steps
+        saved by racing are spent on more generations, and the number of
+        steps saved is displayed at the end. done is called by the GUI once the
+        job has ended.
         """
-        sf, pb, _ = self.session.pheno_settings
-
-        # Take one simulation; generate eight new instances of genotypes
-        children = self.geno_generator.mutate(chosen_sim.genotype)
-
-        # Put them into simulations
-        for each in self.simulations:
-            if each != chosen_sim:
-                each.genotype = children.pop()
-                each.call_bindings("params")
-            # Start new Phenotype but not updating display
-            each.phenotype = Phenotype(each.genotype, sf, pb)
-        self.add_steps_all(target_steps)
+        from model.evolution import Evolution
 
-    def evolve_by_property(self, which_prop, num_gen, equi_range,
-                           display_text, highlight_func):
-        start_step, end_step = equi_range
-        prop_index = GLOBAL_STATS_NAMES_INV[which_prop]
-
-        # Prepare for initial step
-        self.add_steps_all_till(end_step)
-
-        # For each generation
-        for each_gen in range(num_gen):
-            fitnesses = [np.abs(
-                each_sim.global_stats[prop_index, start_step:end_step]).mean()
-                         for each_sim in self.simulations]
-            parent = self.simulations[np.argmax(fitnesses)]
-
-            # Update display text and highlight parent
-            display_text.set("Generation:{}/{}\tMax Fitness:{}".format(
-                each_gen, num_gen, round(np.max(fitnesses), 4)))
-            highlight_func(int(parent.id))
-            self.mutate2(parent, end_step)
-
-        # Final fitness
-        fitnesses = [np.abs(
-            each_sim.global_stats[prop_index, start_step:end_step]).mean()
-                     for each_sim in self.simulations]
-        parent = self.simulations[np.argmax(fitnesses)]
-
-        # Update display text and highlight parent
-        display_text.set("Generation:{}/{}\tMax Fitness:{}".format(
-            num_gen, num_gen, round(np.max(fitnesses), 4)))
-        highlight_func(int(parent.id))
+        scheduler = self.scheduler
+        # The evolution replaces all simulations
+        scheduler.cancel(self.simulations)
+        sf, pb, _ = self.session.pheno_settings
+        evolution = Evolution(self.geno_generator, which_prop, equi_range,
+                              sf, pb, pop_size=pop_size, selection=selection,
+                              pool=self.pool, seed=EVOLUTION_SEED,
+                              cache=self.fitness_cache, racing=racing,
+                              n_threads=self.session.n_threads)
+        step_budget = None
+        if racing:
+            # As many steps as num_gen generations would take without racing
+            step_budget = (pop_size + num_gen * (pop_size - evolution.n_elite)
+                           ) * equi_range[1]
+
+        def run(job):
+            # Phenotypes on display, simulated again with all global
+            # properties, by id of the phenotype of the evolution they show
+            shown = {}
+
+            def show_best(generation, ranked):
+                best = evolution.phenotypes(9)
+                missing = [each for each in best if id(each) not in shown]
+                rebuilt = evolution.rebuild(missing)
+                # Keeps the phenotypes of the evolution, so ids stay unique
+                shown.update((id(each), (each, phenotype))
+                             for each, phenotype in zip(missing, rebuilt))
+                phenotypes = [shown[id(each)][1] for each in best]
+                for key in set(shown) - set(id(each) for each in best):
+                    del shown[key]
+                with scheduler.lock:
+                    for each, phenotype in zip(self.simulations, phenotypes):
+                        each.genotype = phenotype.genotype
+                        each.phenotype = phenotype
+                for each in self.simulations:
+                    job.post(each, "params", "state", "step", "global_stats")
+                # Update display text and highlight the fittest
+                progress = "{}/{}".format(min(generation, num_gen), num_gen)
+                if generation > num_gen:
+                    # Extra generations, on the steps saved by racing
+                    progress += " +{}".format(generation - num_gen)
+                job.call(display_text.set,
+                         "Generation:{}\tMax Fitness:{}".format(
+                             progress, round(ranked[0][0], 4)))
+                job.call(highlight_func, 0)
+                job.checkpoint()
+
+            def show_report():
+                display_text.set("{}\n{}".format(display_text.get(),
+                                                 evolution.report()))
+
+            evolution.run(num_gen,
+                          [each.genotype for each in self.simulations],
+                          show_best, step_budget)
+            job.call(show_report)
+        return scheduler.submit(run, self.simulations, done)
 
     def insert_from_lib(self, param, chosen_sims):
         for each in chosen_sims:
             each.insert_new_param(param)
 
     def add_steps_all(self, n_steps, sims=None):
+        """Run simulations (all by default) for n_steps, in parallel in the
+        worker processes, in the background; return the job."""
         if sims is None:
             sims = self.simulations
-
-        movement = self.session.movement
-        if movement is False:
-            intervals = [n_steps]
-        else:
-            intervals = [movement] * (n_steps/movement)
-            if n_steps % movement > 0:
-                intervals.append(n_steps % movement)
-
-        for step in intervals:
-            args = [[sim.phenotype, step, i] for i, sim in enumerate(sims)]
-            with concurrent.futures.ProcessPoolExecutor() as executor:
-                for pheno, i in executor.map(ticks, args):
-                    sims[i].phenotype = pheno
-                    sims[i].call_bindings("state")
-                    sims[i].call_bindings("step")
-
-        for each in sims:
-            each.call_bindings("global_stats")
+        return self._run_all(sims, [n_steps] * len(sims),
+                             self.session.movement)
 
     def add_steps_all_till(self, target_step):
+        """Run all simulations until they reach target_step, in parallel in
+        the worker processes, in the background; return the job."""
         sims = self.simulations
-        args = [[sim.phenotype, max(0, target_step - sim.step), i]
-                for i, sim in enumerate(sims)]
-        with concurrent.futures.ProcessPoolExecutor() as executor:
-            for pheno, i in executor.map(ticks, args):
-                sims[i].phenotype = pheno
-                sims[i].call_bindings("state")
-                sims[i].call_bindings("step")
-        for each in sims:
-            each.call_bindings("global_stats")
+        return self._run_all(
+            sims, [max(0, target_step - sim.step) for sim in sims], False)
+
+    def _run_all(self, sims, n_steps, movement):
+        """Submit a job running each simulation in sims for the number of
+        steps at the same index in n_steps, in the worker processes. The
+        simulations that get a new phenotype in the meantime are left out.
+        """
+        scheduler = self.scheduler
+        phenotypes = [sim.phenotype for sim in sims]
+
+        def run(job):
+            remaining = list(n_steps)
+            try:
+                for n, show in _chunks(job, max(remaining + [0]),
+                                       movement):
+                    running = [i for i, sim in enumerate(sims)
+                               if sim.phenotype is phenotypes[i] and
+                               remaining[i] > 0]
+                    if not running:
+                        break
+                    jobs = [(int(sims[i].id), phenotypes[i],
+                             min(n, remaining[i])) for i in running]
+                    for j in self.pool.add_steps(jobs, scheduler.lock):
+                        remaining[running[j]] -= jobs[j][2]
+                        job.post(sims[running[j]], "new_stats")
+                        if show:
+                            job.post(sims[running[j]], "state", "step")
+            finally:
+                # Also when cancelled
+                for sim, phenotype in zip(sims, phenotypes):
+                    if sim.phenotype is phenotype:
+                        job.post(sim, "state", "step", "global_stats")
+        return scheduler.submit(run, sims)
@@ -0,0 +1,353 @@
+"""This module contains a pure-NumPy implementation of the simulation, used as
+a backend for Model when the C++ code cannot be compiled.
+
+The functions ``fb_tick`` and ``pb_tick`` take exactly the same arguments as
+their C++ counterparts in ``c_code`` and update the state arrays and the
+global properties in place, so either backend can be plugged into Model. So
+do ``fb_tick_batch`` and ``pb_tick_batch``, which advance a batch of replicas
+(see ModelBatch); the single-model functions are batches of one.
+
+Pairwise interactions are evaluated for a block of particles at a time, so
+that memory use stays bounded (about CHUNK_ELEMENTS pairs per block) however
+many particles there are. A block may span several small replicas, so that
+the cost of each NumPy call is shared between them; each particle is then
+paired with the particles of its own replica, padded to the largest one.
+
+All directions are updated simultaneously from those of the previous step,
+like the C++ code when it runs on one thread or more (see Model.n_threads),
+but unlike its default scheme, which updates particles one after the other
+so that later particles see the new directions of earlier ones. Both schemes
+describe the same model; they agree exactly when the alignment force is
+zero.
+
+The noise term uses the same counter-based random numbers as the C++ code
+(see ``uniform``): the number drawn for a particle at a step only depends on
+the seed of its model, the step and the particle, so both backends draw the
+same noise, whatever the batch. tests/test_numpy_backend.py checks that both
+backends agree.
+"""
+
+import numpy as np
+
+from common.parameters import N_GLOBAL_STATS
+
+# Maximum number of particle pairs evaluated at once
+CHUNK_ELEMENTS = 2**20
+
+
+def fb_dist(pos_i, pos_j, size):
+    """Displacement from particles i to particles j under fixed boundary
+    conditions."""
+    return pos_j - pos_i
+
+
+def pb_dist(pos_i, pos_j, size):
+    """Displacement from particles i to particles j under periodic boundary
+    conditions (nearest image)."""
+    dis = pos_j - pos_i
+    return dis - size * (dis > size/2.) + size * (dis < -size/2.)
+
+
+def fb_fit_into(pos, size):
+    """Fit coordinates into the arena under fixed boundary conditions."""
+    return np.clip(pos, 0., size)
+
+
+def pb_fit_into(pos, size):
+    """Fit coordinates into the arena under periodic boundary conditions."""
+    pos = np.where(pos >= size, pos - size, pos)
+    return np.where(pos < 0., pos + size, pos)
+
+
+def _mix(x):
+    """Scramble an array of 64-bit counters into 64-bit random numbers
+    (splitmix64), as rng_mix in the C++ code. Overflows wrap around."""
+    x = x + np.uint64(0x9E3779B97F4A7C15)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def uniform(seed, step, i):
+    """Random numbers in [0, 1) of particles i at a step of models with given
+    seeds (arrays of equal shapes), as rng_uniform in the C++ code."""
+    step_key = _mix((np.asarray(seed).astype(np.uint64) << np.uint64(32)) |
+                    np.asarray(step).astype(np.uint64))
+    x = _mix(step_key + np.asarray(i).astype(np.uint64))
+    return (x >> np.uint64(11)).astype(np.float64) * (1. / 2**53)
+
+
+def _neighbor_sums(dist, rep, first, last, species, movable, r0_x_2, r1, rv,
+                   ar_slopes, ar_intercs, pos_x, pos_y, dir_x, dir_y, size_x,
+                   size_y):
+    """Accumulate pairwise terms for every particle, a block at a time. Each
+    particle only interacts with particles of its own replica, which occupy
+    indices first[i] to last[i] (exclusive).
+
+    Returns:
+        align_x, align_y: Sum of directions of unpinned neighbors within rv.
+        f_x, f_y: Attraction-repulsion forces from neighbors within r1.
+        ingroup_nb, total_nb: Number of same-species and all neighbors within
+            r1.
+    """
+    n = len(pos_x)
+    align_x, align_y = np.zeros(n), np.zeros(n)
+    f_x, f_y = np.zeros(n), np.zeros(n)
+    ingroup_nb, total_nb = np.zeros(n), np.zeros(n)
+    # Each row is paired with the particles of its replica, padded to the size
+    # of the largest replica
+    width = (last - first).max() if n > 0 else 0
+    chunk = max(1, CHUNK_ELEMENTS // max(width, 1))
+    for start in range(0, n, chunk):
+        rows = slice(start, min(start + chunk, n))
+        n_rows = rows.stop - rows.start
+        rep_i = rep[rows, None]
+        if rep[rows.start] == rep[rows.stop - 1]:
+            # All rows belong to one replica
+            cols = np.arange(first[rows.start], last[rows.start])[None, :]
+            pos_x_j = pos_x[None, first[rows.start]:last[rows.start]]
+            pos_y_j = pos_y[None, first[rows.start]:last[rows.start]]
+            padding = None
+        else:
+            cols = first[rows, None] + np.arange(width)
+            padding = cols >= last[rows, None]
+            cols[padding] = 0
+            pos_x_j, pos_y_j = pos_x[cols], pos_y[cols]
+        dis_x = dist(pos_x[rows, None], pos_x_j, size_x[rep_i])
+        dis_y = dist(pos_y[rows, None], pos_y_j, size_y[rep_i])
+        r = np.sqrt(dis_x**2 + dis_y**2)
+        # Keep only pairs within interaction range, excluding each particle
+        # from its own neighborhood; sums below then run over neighbors in
+        # increasing index order, like the C++ code
+        near = r <= np.maximum(r1, rv)[rep_i]
+        if padding is not None:
+            near &= ~padding
+        i, c = np.nonzero(near)
+        j = np.broadcast_to(cols, near.shape)[i, c]
+        itself = j == i + rows.start
+        i, j, c = i[~itself], j[~itself], c[~itself]
+        r, dis_x, dis_y = r[i, c], dis_x[i, c], dis_y[i, c]
+        pair_rep = rep[i + rows.start]
+        # ALIGNMENT
+        aligned = (r <= rv[pair_rep]) & movable[j]
+        align_x[rows] = np.bincount(i[aligned], dir_x[j[aligned]], n_rows)
+        align_y[rows] = np.bincount(i[aligned], dir_y[j[aligned]], n_rows)
+        # ATTRACTION-REPULSION
+        within = r <= r1[pair_rep]
+        i, j, pair_rep = i[within], j[within], pair_rep[within]
+        r, dis_x, dis_y = r[within], dis_x[within], dis_y[within]
+        pair = pair_rep * 9 + species[i + rows.start] * 3 + species[j]
+        core = r0_x_2[pair_rep]
+        magnitude = np.zeros(r.shape)
+        outer = (r >= core) & (r > 0)
+        magnitude[outer] = ((r[outer] * ar_slopes[pair[outer]] +
+                             ar_intercs[pair[outer]]) / r[outer])
+        magnitude[r < core] = -10000
+        f_x[rows] = np.bincount(i, magnitude * dis_x, n_rows)
+        f_y[rows] = np.bincount(i, magnitude * dis_y, n_rows)
+        # STAT_SEG, STAT_CLU
+        same = species[i + rows.start] == species[j]
+        ingroup_nb[rows] = np.bincount(i[same], minlength=n_rows)
+        total_nb[rows] = np.bincount(i, minlength=n_rows)
+    return align_x, align_y, f_x, f_y, ingroup_nb, total_nb
+
+
+def _tick(dist, fit_into, periodic, n, eff_nop, size_x, size_y, r0_x_2, r1,
+          rv, iner_coef, f0, fa, noise_coef, v0, pinned, n_per_species, beta,
+          grad_x, grad_y, pos_x, pos_y, dir_x, dir_y, global_stats, steps,
+          seed, first_step, stats_mask, stats_stride):
+    """Run a batch of replicas for a given number of steps. Parameters are
+    arrays with one entry (three for per-species and nine for per-pair
+    parameters) per replica; the particles of each replica follow those of
+    the previous one in the state arrays. Like the C++ code, global
+    properties are only computed if enabled in stats_mask, for the steps
+    that are multiples of stats_stride, and the k-th step sampled by a
+    replica is written in its column k. See module docstring.
+    """
+    n_replicas = len(n)
+    n_total = len(pos_x)
+    # Replica and species of each particle, and both combined
+    group = np.repeat(np.arange(3 * n_replicas), n_per_species)
+    rep, species = group // 3, group % 3
+    ends = np.cumsum(n)
+    first, last = (ends - n)[rep], ends[rep]
+    # Index of each particle within its replica, for random numbers
+    index = np.arange(n_total) - first
+    movable = pinned[group] == 0
+    beta = np.asarray(beta, dtype=float).reshape(n_replicas, 9)
+    ar_slopes = ((1 + beta) * f0[:, None] / (r1 - r0_x_2)[:, None]).ravel()
+    ar_intercs = (- r0_x_2[:, None] * (1 + beta) * f0[:, None] /
+                  (r1 - r0_x_2)[:, None] - f0[:, None]).ravel()
+    speed = v0[group]
+    v0_k = v0.reshape(n_replicas, 3)
+    n_k = n_per_species.reshape(n_replicas, 3).astype(float)
+    has_eff = eff_nop > 0
+    eff_nop_or_1 = np.where(has_eff, eff_nop, 1.)
+    stats = global_stats.reshape(n_replicas, N_GLOBAL_STATS, steps)
+    # Column of the next sampled step of each replica
+    column = np.zeros(n_replicas, dtype=int)
+
+    for ith_step in range(steps):
+        sample = (first_step + ith_step) % stats_stride == 0
+        (align_x, align_y, f_x, f_y,
+         ingroup_nb, total_nb) = _neighbor_sums(
+             dist, rep, first, last, species, movable, r0_x_2, r1, rv,
+             ar_slopes, ar_intercs, pos_x, pos_y, dir_x, dir_y, size_x,
+             size_y)
+
+        # UPDATE DIRECTION (only if not pinned)
+        new_x = dir_x * iner_coef[rep] + (grad_x[group] + align_x*fa[rep] +
+                                          f_x)
+        new_y = dir_y * iner_coef[rep] + (grad_y[group] + align_y*fa[rep] +
+                                          f_y)
+        # NORMALIZE (ARG)
+        norm = np.sqrt(new_x**2 + new_y**2)
+        nonzero = norm > 0
+        new_x[nonzero] /= norm[nonzero]
+        new_y[nonzero] /= norm[nonzero]
+        # NOISE
+        noise = noise_coef[rep] * np.pi * (uniform(
+            seed[rep], first_step[rep] + ith_step, index)*2 - 1)
+        c, s = np.cos(noise), np.sin(noise)
+        new_x, new_y = new_x*c - new_y*s, new_x*s + new_y*c
+        dir_x[movable] = new_x[movable]
+        dir_y[movable] = new_y[movable]
+
+        # SEGREGATION PARAMETER
+        if sample.any() and any(stats_mask[2:5]):
+            has_nb = total_nb > 0
+            ratio = np.zeros(n_total)
+            ratio[has_nb] = ingroup_nb[has_nb] / total_nb[has_nb]
+            # (bincount returns integers when there are no particles at all)
+            stat_seg = np.bincount(group, ratio, 3 * n_replicas).reshape(
+                n_replicas, 3).astype(float)
+            nonempty = n_k > 0
+            stat_seg[nonempty] /= n_k[nonempty] * n_k[nonempty]
+            stats[sample, 2:5, column[sample]] = (stat_seg *
+                                                  n[:, None])[sample]
+
+        # UPDATE POSITION
+        pos_x[movable] = fit_into(
+            pos_x[movable] + speed[movable] * dir_x[movable],
+            size_x[rep[movable]])
+        pos_y[movable] = fit_into(
+            pos_y[movable] + speed[movable] * dir_y[movable],
+            size_y[rep[movable]])
+
+        # GROUP ANGULAR MOMENTUM
+        moving_rep = rep[movable]
+        if sample.any() and stats_mask[0]:
+            if periodic:
+                cm_x = _circular_mean(pos_x[movable], size_x, moving_rep,
+                                      eff_nop_or_1)
+                cm_y = _circular_mean(pos_y[movable], size_y, moving_rep,
+                                      eff_nop_or_1)
+            else:
+                cm_x = np.bincount(moving_rep, pos_x[movable],
+                                   n_replicas) / eff_nop_or_1
+                cm_y = np.bincount(moving_rep, pos_y[movable],
+                                   n_replicas) / eff_nop_or_1
+            rel_x = dist(cm_x[rep], pos_x, size_x[rep])
+            rel_y = dist(cm_y[rep], pos_y, size_y[rep])
+            moving_group = group[movable]
+            stat_angular = (v0_k * np.bincount(
+                moving_group, (rel_x * dir_y - rel_y * dir_x)[movable],
+                3 * n_replicas).reshape(n_replicas, 3)).sum(axis=1)
+            stat_angular_norm = (v0_k * np.bincount(
+                moving_group, np.sqrt(rel_x**2 + rel_y**2)[movable],
+                3 * n_replicas).reshape(n_replicas, 3)).sum(axis=1)
+            valid = sample & has_eff & (stat_angular_norm > 0)
+            stats[valid, 0, column[valid]] = (np.abs(stat_angular[valid]) /
+                                              stat_angular_norm[valid])
+        # ORDER PARAMETER
+        if sample.any() and stats_mask[1]:
+            stat_align_x = np.bincount(moving_rep, dir_x[movable],
+                                       n_replicas)
+            stat_align_y = np.bincount(moving_rep, dir_y[movable],
+                                       n_replicas)
+            valid = sample & has_eff
+            stats[valid, 1, column[valid]] = np.sqrt(
+                stat_align_x**2 + stat_align_y**2)[valid] / eff_nop[valid]
+        # CLUSTERING PARAMETER
+        if sample.any() and stats_mask[5]:
+            valid = sample & (n > 0)
+            stat_clu = np.bincount(rep, total_nb, n_replicas)[valid]
+            stats[valid, 5, column[valid]] = (stat_clu / (
+                n*np.pi*r1*r1/(size_x*size_y))[valid]) / n[valid]
+        column += sample
+
+
+def _circular_mean(pos, size, rep, eff_nop):
+    """Center of mass of each replica along one periodic dimension."""
+    theta = 2 * np.pi * pos / size[rep]
+    mean_c = np.bincount(rep, np.cos(theta), len(size)) / eff_nop
+    mean_s = np.bincount(rep, np.sin(theta), len(size)) / eff_nop
+    return size * (np.arctan2(-mean_s, -mean_c) + np.pi) / (2 * np.pi)
+
+
+def _batch_of_one(params):
+    """Convert the parameters of a single model to those of a batch of one
+    replica."""
+    return [np.ravel(value) for value in params]
+
+
+def fb_tick(n, eff_nop, size_x, size_y, r0_x_2, r1, rv, iner_coef, f0, fa,
+            noise_coef, v0, pinned, n_per_species, beta, grad_x, grad_y,
+            pos_x, pos_y, dir_x, dir_y, global_stats, steps, cell_size, seed,
+            first_step, n_threads, single_precision, stats_mask,
+            stats_stride):
+    """Run the simulation for a given number of steps under fixed boundary
+    conditions. ``cell_size``, ``n_threads`` and ``single_precision`` are
+    accepted for compatibility with the C++ code and not used."""
+    params = _batch_of_one([n, eff_nop, size_x, size_y, r0_x_2, r1, rv,
+                            iner_coef, f0, fa, noise_coef, v0, pinned,
+                            n_per_species, beta, grad_x, grad_y])
+    _tick(fb_dist, fb_fit_into, False, *params + [
+        pos_x, pos_y, dir_x, dir_y, global_stats, steps] +
+          _batch_of_one([seed, first_step]) + [stats_mask, stats_stride])
+
+
+def pb_tick(n, eff_nop, size_x, size_y, r0_x_2, r1, rv, iner_coef, f0, fa,
+            noise_coef, v0, pinned, n_per_species, beta, grad_x, grad_y,
+            pos_x, pos_y, dir_x, dir_y, global_stats, steps, cell_size, seed,
+            first_step, n_threads, single_precision, stats_mask,
+            stats_stride):
+    """Run the simulation for a given number of steps under periodic boundary
+    conditions. ``cell_size``, ``n_threads`` and ``single_precision`` are
+    accepted for compatibility with the C++ code and not used."""
+    params = _batch_of_one([n, eff_nop, size_x, size_y, r0_x_2, r1, rv,
+                            iner_coef, f0, fa, noise_coef, v0, pinned,
+                            n_per_species, beta, grad_x, grad_y])
+    _tick(pb_dist, pb_fit_into, True, *params + [
+        pos_x, pos_y, dir_x, dir_y, global_stats, steps] +
+          _batch_of_one([seed, first_step]) + [stats_mask, stats_stride])
+
+
+def fb_tick_batch(n, eff_nop, size_x, size_y, r0_x_2, r1, rv, iner_coef, f0,
+                  fa, noise_coef, v0, pinned, n_per_species, beta, grad_x,
+                  grad_y, pos_x, pos_y, dir_x, dir_y, global_stats, steps,
+                  cell_size, seed, first_step, n_threads, single_precision,
+                  stats_mask, stats_stride, offsets, n_replicas):
+    """Run a batch of replicas for a given number of steps under fixed
+    boundary conditions; see ModelBatch for the layout of the arguments.
+    Replicas must be stored one after the other; ``cell_size``,
+    ``n_threads``, ``single_precision``, ``offsets`` and ``n_replicas`` are
+    accepted for compatibility with the C++ code and not used."""
+    _tick(fb_dist, fb_fit_into, False, n, eff_nop, size_x, size_y, r0_x_2,
+          r1, rv, iner_coef, f0, fa, noise_coef, v0, pinned, n_per_species,
+          beta, grad_x, grad_y, pos_x, pos_y, dir_x, dir_y, global_stats,
+          steps, seed, first_step, stats_mask, stats_stride)
+
+
+def pb_tick_batch(n, eff_nop, size_x, size_y, r0_x_2, r1, rv, iner_coef, f0,
+                  fa, noise_coef, v0, pinned, n_per_species, beta, grad_x,
+                  grad_y, pos_x, pos_y, dir_x, dir_y, global_stats, steps,
+                  cell_size, seed, first_step, n_threads, single_precision,
+                  stats_mask, stats_stride, offsets, n_replicas):
+    """Run a batch of replicas for a given number of steps under periodic
+    boundary conditions; see ``fb_tick_batch``."""
+    _tick(pb_dist, pb_fit_into, True, n, eff_nop, size_x, size_y, r0_x_2,
+          r1, rv, iner_coef, f0, fa, noise_coef, v0, pinned, n_per_species,
+          beta, grad_x, grad_y, pos_x, pos_y, dir_x, dir_y, global_stats,
+          steps, seed, first_step, stats_mask, stats_stride)
+
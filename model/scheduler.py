@@ -0,0 +1,256 @@
+"""This module contains Scheduler, which runs simulations on background
+threads so that the GUI stays responsive while they run.
+
+Work is submitted as jobs: functions run on a thread of their own, which
+advance simulations at most CHUNK_STEPS steps at a time and call
+``job.checkpoint()`` in between. Only one job runs at a time. At a
+checkpoint, a job stops (raising Cancelled) if it has been cancelled, waits
+while the scheduler is paused, and gives way to any job of higher priority:
+jobs on the simulation in focus (the one open in EditWindow) alone come
+first, then the other jobs that run it, then the rest, each in the order
+they were submitted.
+
+Jobs never call the GUI. They hold ``lock`` while they change the data of
+simulations that the GUI reads, and ``post`` which data they have changed.
+The GUI calls ``poll`` every POLL_INTERVAL milliseconds (with Tk's
+``after``); it calls the bindings of the data posted since the last poll,
+once each however many times they were posted, so that the display is
+refreshed at most 1000 / POLL_INTERVAL times a second however fast the
+simulations run. A poll is skipped if a job holds the lock: the GUI never
+waits for the simulations. The state arrays shared with worker processes
+(see model.workers) are the exception to the lock: workers update them in
+place, so a plot may mix particles of two consecutive chunks. Jobs that run
+simulations in this process do not keep the GUI waiting either: the C++ code
+releases the GIL while it runs (see model.weave_compile).
+"""
+
+import itertools
+import sys
+import threading
+from collections import OrderedDict, deque
+
+from common.profiling import PROFILER
+
+# Milliseconds between two polls of the GUI
+POLL_INTERVAL = 40
+# Most steps run by a job between two checkpoints, unless adaptive
+CHUNK_STEPS = 50
+# Value of the show-movement setting (see SessionData.movement) for showing
+# the state as often as the display keeps up: chunks are sized to take about
+# FRAME_BUDGET seconds each, and the state is shown after every chunk
+ADAPTIVE = "adaptive"
+FRAME_BUDGET = 0.03
+# Order in which the bindings of the data posted are called
+DATA_NAMES = ["params", "state", "step", "global_stats", "new_stats"]
+
+
+class Cancelled(Exception):
+    """Raised at the checkpoint of a job that has been cancelled."""
+
+
+def _reraise(exc_info):
+    raise exc_info[0], exc_info[1], exc_info[2]
+
+
+class Job(object):
+    """Some work on simulations, run by a Scheduler on a thread of its own.
+
+    Methods:
+        checkpoint: Wait for the turn of this job; called between chunks.
+        post: Have the bindings of some data of a simulation called.
+        call: Have a function called by the GUI.
+        cancel: Stop this job at its next checkpoint.
+
+    Attributes:
+        sims (list): The simulations that the job runs.
+        cancelled (bool): Whether the job has been cancelled.
+        finished (bool): Whether the job has ended, however it ended.
+    """
+    def __init__(self, scheduler, func, sims, done, order):
+        """
+        Parameters:
+            scheduler (Scheduler): The scheduler running this job.
+            func (function): Called as func(job) to do the work.
+            done (function): Called by the GUI once the job has ended, if
+                given.
+            order (int): Rank of submission.
+            sims: See ``Attributes``.
+        """
+        self.scheduler = scheduler
+        self.func = func
+        self.sims = list(sims)
+        self.done = done
+        self.order = order
+        self.cancelled = False
+        self.finished = False
+
+    def _main(self):
+        scheduler = self.scheduler
+        try:
+            self.checkpoint()
+            self.func(self)
+        except Cancelled:
+            pass
+        except Exception:
+            # Raised again by the GUI, which reports it
+            self.call(_reraise, sys.exc_info())
+        finally:
+            with scheduler._cond:
+                scheduler._jobs.remove(self)
+                if scheduler._running is self:
+                    scheduler._running = None
+                scheduler._cond.notify_all()
+            self.finished = True
+            if self.done is not None:
+                self.call(self.done)
+
+    def checkpoint(self):
+        """Let other jobs run if it is their turn, and return once it is the
+        turn of this job again; raise Cancelled if it has been cancelled."""
+        scheduler = self.scheduler
+        with scheduler._cond:
+            if scheduler._running is self:
+                scheduler._running = None
+                scheduler._cond.notify_all()
+            while not self.cancelled and (
+                    scheduler.paused or scheduler._running is not None or
+                    scheduler._next() is not self):
+                scheduler._cond.wait()
+            if self.cancelled:
+                raise Cancelled()
+            scheduler._running = self
+
+    def post(self, sim, *data_names):
+        """Have the bindings of some data of a simulation called at the next
+        poll."""
+        scheduler = self.scheduler
+        with scheduler._cond:
+            scheduler._updates.setdefault(sim, set()).update(data_names)
+
+    def call(self, func, *args):
+        """Have func(*args) called at the next poll, after the bindings."""
+        self.scheduler._calls.append((func, args))
+
+    def cancel(self):
+        """Stop this job at its next checkpoint."""
+        scheduler = self.scheduler
+        with scheduler._cond:
+            self.cancelled = True
+            scheduler._cond.notify_all()
+
+
+class Scheduler(object):
+    """Runs jobs on simulations on background threads, one at a time, and
+    passes their updates on to the GUI.
+
+    Methods:
+        submit: Start a job.
+        pause, resume: Hold jobs at their next checkpoint, and let them go.
+        cancel: Cancel the jobs on some simulations.
+        set_focus: Give priority to the jobs on a simulation.
+        poll: Call the bindings of the data changed by jobs; called by the
+            GUI.
+        wait: Wait until all jobs have ended.
+
+    Attributes:
+        lock (threading.RLock): Held by jobs while they change the data of
+            simulations, and by the GUI while it reads them.
+        focus (Simulation): The simulation whose jobs come first, or None.
+        paused (bool): Whether jobs are held at their checkpoints.
+    """
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.focus = None
+        self.paused = False
+        self._cond = threading.Condition(threading.Lock())
+        # Jobs not ended yet, in order of submission
+        self._jobs = []
+        # The job between two checkpoints, if any
+        self._running = None
+        self._order = itertools.count()
+        # Data posted since the last poll, by simulation
+        self._updates = OrderedDict()
+        # Functions to be called at the next poll, with their arguments
+        self._calls = deque()
+
+    def _next(self):
+        """Return the job whose turn it is, among those not cancelled."""
+        focus = self.focus
+
+        def rank(job):
+            if job.sims == [focus]:
+                return 0, job.order
+            return (1 if focus in job.sims else 2), job.order
+        jobs = [each for each in self._jobs if not each.cancelled]
+        return min(jobs, key=rank) if jobs else None
+
+    def submit(self, func, sims, done=None):
+        """Start a job, and return it.
+
+        Parameters:
+            func (function): Called as func(job) on a new thread to do the
+                work, see Job.
+            sims (list): The simulations that the job runs.
+            done (function): Called by the GUI once the job has ended,
+                however it ended.
+        """
+        job = Job(self, func, sims, done, next(self._order))
+        with self._cond:
+            self._jobs.append(job)
+        thread = threading.Thread(target=job._main)
+        thread.daemon = True
+        thread.start()
+        return job
+
+    def pause(self):
+        """Hold all jobs at their next checkpoint."""
+        with self._cond:
+            self.paused = True
+
+    def resume(self):
+        """Let jobs held by ``pause`` go on."""
+        with self._cond:
+            self.paused = False
+            self._cond.notify_all()
+
+    def cancel(self, sims=None):
+        """Cancel the jobs on any of sims (all jobs if sims is None)."""
+        with self._cond:
+            jobs = list(self._jobs)
+        for job in jobs:
+            if sims is None or any(sim in job.sims for sim in sims):
+                job.cancel()
+
+    def set_focus(self, sim):
+        """Give priority to the jobs on sim (to none if sim is None)."""
+        with self._cond:
+            self.focus = sim
+            self._cond.notify_all()
+
+    def poll(self):
+        """Call the bindings of the data posted by jobs since the last poll,
+        and then the functions they passed to ``call``, unless a job holds
+        the lock, in which case they are left for the next poll."""
+        if not self.lock.acquire(False):
+            return
+        try:
+            with PROFILER.span("poll", "gui"):
+                with self._cond:
+                    updates, self._updates = self._updates, OrderedDict()
+                for sim, data_names in updates.items():
+                    for name in DATA_NAMES:
+                        if name in data_names:
+                            sim.call_bindings(name)
+                # One at a time, so that those after an error are left for
+                # the next poll
+                while self._calls:
+                    func, args = self._calls.popleft()
+                    func(*args)
+        finally:
+            self.lock.release()
+
+    def wait(self):
+        """Wait until all jobs have ended (not to be called while paused)."""
+        with self._cond:
+            while self._jobs:
+                self._cond.wait()
@@ -0,0 +1,260 @@
+"""This module contains GlobalStats, the store of the global properties of a
+Model over time.
+
+Steps are appended at amortized constant cost: the underlying array grows by
+doubling its capacity rather than being reallocated on every append. In
+bounded mode only the most recent ``max_steps`` steps are retained (older ones
+are discarded in batches, again at amortized constant cost), while running
+summaries keep covering every step ever appended.
+
+Either way, the retained steps are exposed as one contiguous [stat, step]
+array, ``view``, so code written for a plain array keeps working.
+
+Initial values that are memory-mapped (for example, from a session file, see
+common.io_utils) are used in place rather than copied, so that they are read
+from disk as they are accessed; they are copied once the store needs to grow.
+Their summaries are only computed when first asked for.
+
+Global properties need not be computed at every step: a Model may sample one
+step out of a stride (see ``sampled_steps``) and skip some properties, which
+are then NaN. The store keeps one column per sampled step, and ``steps``
+records the absolute step of each; with every step sampled, which is the
+default, column i is simply step ``offset + i``.
+"""
+
+import numpy as np
+
+from common.parameters import N_GLOBAL_STATS
+
+# Initial number of steps that fit in a store before it needs to grow
+MIN_CAPACITY = 64
+
+
+def sampled_steps(first_step, n_steps, stride=1):
+    """Return the absolute steps sampled among n_steps steps from first_step
+    on, with a given stride: those that are multiples of stride."""
+    start = first_step + (-first_step) % stride
+    return np.arange(start, first_step + n_steps, stride)
+
+
+class GlobalStats(object):
+    """A growable, optionally bounded, store of global properties.
+
+    Methods:
+        append: Add the global properties of some new (sampled) steps.
+        window: Return the values for a range of absolute steps.
+        mean, abs_mean: Running means over all steps appended so far.
+
+    Attributes:
+        view (numpy.ndarray): The retained values, indexed [stat, step].
+        steps (numpy.ndarray): The absolute step of each retained column.
+        offset (int): The absolute step of the first retained column
+            (n_steps if there is none).
+        origin (int): The first absolute step retained if sampled; steps
+            before it were discarded (in bounded mode) or never appended.
+        n_steps (int): The number of steps appended so far, sampled or not.
+        max_steps (int): The number of steps (columns) retained in bounded
+            mode, or None to retain all steps.
+        minimum, maximum (numpy.ndarray): Running extremes of each property.
+    """
+    def __init__(self, values=None, offset=0, max_steps=None,
+                 n_stats=N_GLOBAL_STATS):
+        """
+        Parameters:
+            values (array-like): Initial [stat, step] values, if any; used in
+                place if memory-mapped, see module docstring.
+            offset (int): The absolute step of the first initial value.
+            max_steps (int): See ``Attributes``.
+            n_stats (int): The number of global properties.
+        """
+        self.max_steps = max_steps
+        self._data = np.zeros([n_stats, MIN_CAPACITY])
+        self._steps = np.zeros(MIN_CAPACITY, dtype=np.int64)
+        self._start = self._stop = 0
+        # Steps from _origin on are retained if they were sampled
+        self._origin = self._n_steps = offset
+        # Summaries over all appended steps, including discarded ones
+        self._count = 0
+        self._total = np.zeros(n_stats)
+        self._abs_total = np.zeros(n_stats)
+        self._minimum = np.full(n_stats, np.inf)
+        self._maximum = np.full(n_stats, -np.inf)
+        # Adopted values not summarized yet, see _adopt
+        self._unsummarized = None
+        if (isinstance(values, np.memmap) and values.dtype == float and
+                values.ndim == 2 and values.shape[0] == n_stats and
+                (max_steps is None or values.shape[1] <= max_steps)):
+            self._adopt(values)
+        elif values is not None:
+            self.append(np.asarray(values, dtype=float).reshape(n_stats, -1))
+
+    def __getstate__(self):
+        """Pickle only the retained values, not the spare capacity."""
+        self._summarize_adopted()
+        state = self.__dict__.copy()
+        # A plain array, even if the values are memory-mapped
+        state["_data"] = np.array(self.view)
+        state["_steps"] = self.steps.copy()
+        state["_start"], state["_stop"] = 0, self._stop - self._start
+        return state
+
+    @property
+    def view(self):
+        return self._data[:, self._start:self._stop]
+
+    @property
+    def steps(self):
+        return self._steps[self._start:self._stop]
+
+    @property
+    def offset(self):
+        if self._stop > self._start:
+            return int(self._steps[self._start])
+        return self._n_steps
+
+    @property
+    def origin(self):
+        return self._origin
+
+    @property
+    def n_steps(self):
+        return self._n_steps
+
+    @property
+    def shape(self):
+        return self.view.shape
+
+    @property
+    def count(self):
+        self._summarize_adopted()
+        return self._count
+
+    @property
+    def total(self):
+        self._summarize_adopted()
+        return self._total
+
+    @property
+    def abs_total(self):
+        self._summarize_adopted()
+        return self._abs_total
+
+    @property
+    def minimum(self):
+        self._summarize_adopted()
+        return self._minimum
+
+    @property
+    def maximum(self):
+        self._summarize_adopted()
+        return self._maximum
+
+    def append(self, values, n_steps=None, stride=1):
+        """Add the global properties of some new steps, given as a
+        [stat, step] array. If only some of them were sampled, n_steps is the
+        number of new steps and values has a column for each step sampled
+        with the given stride (see ``sampled_steps``)."""
+        n_new = values.shape[1]
+        if n_steps is None:
+            n_steps = n_new
+        steps = sampled_steps(self._n_steps, n_steps, stride)
+        if len(steps) != n_new:
+            raise ValueError("{} columns given for {} sampled steps.".format(
+                n_new, len(steps)))
+        self._n_steps += n_steps
+        if n_new == 0:
+            return
+        self._summarize(values)
+        # Drop steps that will fall outside the bound
+        if self.max_steps is not None:
+            if n_new >= self.max_steps:
+                if n_new > self.max_steps:
+                    self._origin = steps[n_new - self.max_steps - 1] + 1
+                elif self._stop > self._start:
+                    self._origin = self._steps[self._stop - 1] + 1
+                self._start = self._stop = 0
+                values = values[:, n_new - self.max_steps:]
+                steps = steps[n_new - self.max_steps:]
+                n_new = self.max_steps
+            else:
+                excess = self._stop - self._start + n_new - self.max_steps
+                if excess > 0:
+                    self._start += excess
+                    self._origin = self._steps[self._start - 1] + 1
+        self._reserve(n_new)
+        self._data[:, self._stop:self._stop + n_new] = values
+        self._steps[self._stop:self._stop + n_new] = steps
+        self._stop += n_new
+
+    def _summarize(self, values):
+        """Update the summaries with new [stat, step] values (NaN for the
+        properties that were not computed)."""
+        self._count += values.shape[1]
+        with np.errstate(invalid="ignore"):
+            self._total += values.sum(axis=1)
+            self._abs_total += np.abs(values).sum(axis=1)
+            self._minimum = np.minimum(self._minimum, values.min(axis=1))
+            self._maximum = np.maximum(self._maximum, values.max(axis=1))
+
+    def _summarize_adopted(self):
+        """Add the adopted values to the summaries, if not done yet."""
+        if self._unsummarized is not None:
+            values, self._unsummarized = self._unsummarized, None
+            self._summarize(values)
+
+    def _adopt(self, values):
+        """Take initial values, one per step from the offset on, as the
+        underlying array without copying them (nor reading them: they are
+        summarized when the summaries are first asked for)."""
+        n_new = values.shape[1]
+        self._unsummarized = values
+        self._data = values
+        self._steps = np.arange(self._n_steps, self._n_steps + n_new,
+                                dtype=np.int64)
+        self._stop = n_new
+        self._n_steps += n_new
+
+    def _reserve(self, n_new):
+        """Make room for n_new more columns after the retained ones, by
+        shifting them to the front or by doubling the capacity."""
+        capacity = self._data.shape[1]
+        if self._stop + n_new <= capacity:
+            return
+        length = self._stop - self._start
+        if self.max_steps is not None:
+            needed = 2 * self.max_steps
+        else:
+            needed = length + n_new
+        if needed > capacity or length + n_new > capacity:
+            # Unpickled stores may have no spare (or any) capacity
+            new_capacity = max(capacity, MIN_CAPACITY)
+            while new_capacity < max(needed, length + n_new):
+                new_capacity *= 2
+            data = np.zeros([self._data.shape[0], new_capacity])
+            steps = np.zeros(new_capacity, dtype=np.int64)
+        else:
+            data, steps = self._data, self._steps
+        data[:, :length] = self._data[:, self._start:self._stop]
+        steps[:length] = self._steps[self._start:self._stop]
+        self._data, self._steps = data, steps
+        self._start, self._stop = 0, length
+
+    def window(self, start, end):
+        """Return the [stat, step] values for absolute steps start to end
+        (exclusive), those sampled; raise IndexError if some of them are not
+        retained."""
+        if start < self._origin or end > self.n_steps:
+            raise IndexError(
+                "Steps {}-{} are not retained (steps {}-{} are).".format(
+                    start, end, self._origin, self.n_steps))
+        first, last = np.searchsorted(self.steps, [start, end])
+        return self.view[:, first:last]
+
+    def mean(self):
+        """Return the mean of each global property over all steps."""
+        return self.total / max(self.count, 1)
+
+    def abs_mean(self):
+        """Return the mean absolute value of each global property over all
+        steps."""
+        return self.abs_total / max(self.count, 1)
@@ -0,0 +1,397 @@
+"""This module records the trajectory of a Model (its state every few steps)
+to disk and reads it back: TrajectoryRecorder writes, Trajectory reads.
+
+A trajectory is a directory of three files:
+
+    * meta.json: the number of particles, the field size (xlim, ylim), the
+      recording interval and the format version.
+    * frames.bin: the frames, one after the other.
+    * index.bin: one INDEX_DTYPE record per frame, with its step and where
+      it lies in frames.bin.
+
+Each frame holds pos_x, pos_y, dir_x and dir_y quantized to 16-bit fixed
+point, positions over [0, xlim] and [0, ylim] and directions over [-1, 1]
+(a resolution of about 1.5e-4 for the default field, and 3e-5 for
+directions). Every KEYFRAME_INTERVAL frames, a keyframe stores these values
+as they are; the frames in between store their differences from the previous
+frame (modulo 2**16, so that nothing is lost, even across a periodic
+boundary). Either way, the high and low bytes of the values are grouped
+before being compressed with zlib, which turns the small differences of
+consecutive frames into long runs of equal bytes.
+
+Both files are only appended to, and the index is read memory-mapped, so a
+trajectory can be read while it is being recorded. Seeking to a step decodes
+at most KEYFRAME_INTERVAL frames, from the keyframe before it; playing frames
+in order decodes each frame once. For playback, FramePrefetcher decodes the
+frames ahead of the one shown on a background thread.
+
+Removing the directory of a trajectory stops its recording, in every copy of
+the recorder (see TrajectoryRecorder).
+"""
+import json
+import os
+import threading
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+TRAJECTORY_FORMAT = 1
+META_FILE = "meta.json"
+FRAMES_FILE = "frames.bin"
+INDEX_FILE = "index.bin"
+INDEX_DTYPE = np.dtype([("step", "<i8"), ("offset", "<i8"), ("size", "<i4"),
+                        ("keyframe", "<i4")])
+# Number of frames from one keyframe to the next
+KEYFRAME_INTERVAL = 64
+ZLIB_LEVEL = 6
+QUANTA = 2**16 - 1
+
+
+def _scales(meta):
+    """Return the lower bounds and widths of the ranges of pos_x, pos_y,
+    dir_x and dir_y."""
+    lower = np.array([0., 0., -1., -1.])[:, None]
+    width = np.array([meta["xlim"], meta["ylim"], 2., 2.])[:, None]
+    return lower, width
+
+
+def quantize(state, meta):
+    """Return the state (pos_x, pos_y, dir_x, dir_y) as a [4, nop] uint16
+    array of fixed-point values."""
+    lower, width = _scales(meta)
+    values = (np.asarray(state, dtype=float) - lower) / width
+    return np.rint(np.clip(values, 0., 1.) * QUANTA).astype(np.uint16)
+
+
+def dequantize(values, meta):
+    """Return the state (pos_x, pos_y, dir_x, dir_y) of quantized values."""
+    lower, width = _scales(meta)
+    return tuple(values * (width / QUANTA) + lower)
+
+
+def _encode(values):
+    """Compress a [4, nop] uint16 array, grouping high and low bytes."""
+    return zlib.compress(
+        values.astype("<u2").view(np.uint8).reshape(-1, 2).T.tobytes(),
+        ZLIB_LEVEL)
+
+
+def _decode(data, nop):
+    """Decompress a [4, nop] uint16 array written by _encode."""
+    grouped = np.frombuffer(zlib.decompress(data), dtype=np.uint8)
+    return grouped.reshape(2, -1).T.copy().view("<u2").reshape(4, nop)
+
+
+class TrajectoryRecorder(object):
+    """Appends the state of a Model to a trajectory every few steps (see
+    Model.record_trajectory).
+
+    A recorder can be pickled with its Model and go on recording in another
+    process (for example, a SimulationPool worker): its files are reopened
+    there, and before each frame it checks that no other copy has recorded
+    in the meantime, catching up from the files if one has. As copies may
+    live in processes out of reach, recording is stopped by removing the
+    directory: copies then record nothing more.
+
+    Methods:
+        intervals: Split a number of steps at the recorded steps.
+        record: Append a frame, if the step is a recorded one.
+        close: Close the files.
+
+    Attributes:
+        path (str): The directory of the trajectory.
+        every (int): Frames are recorded at the steps that are multiples of
+            every.
+        meta (dict): The contents of meta.json.
+    """
+    def __init__(self, path, nop, xlim, ylim, every=1):
+        """Start a new trajectory at path, replacing any there.
+
+        Parameters:
+            nop (int): Number of particles.
+            xlim, ylim (float): Size of the field.
+            path, every: See ``Attributes``.
+        """
+        if every < 1:
+            raise ValueError("Frames are recorded every 1 step or more.")
+        self.path = path
+        self.every = every
+        self.meta = {"format": TRAJECTORY_FORMAT, "nop": int(nop),
+                     "xlim": float(xlim), "ylim": float(ylim),
+                     "every": int(every)}
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        with open(os.path.join(path, META_FILE), "w") as outfile:
+            json.dump(self.meta, outfile)
+        for name in [FRAMES_FILE, INDEX_FILE]:
+            open(os.path.join(path, name), "wb").close()
+        self._files = None
+        # Frames recorded, and the step and quantized values of the last
+        # one, as far as this copy knows
+        self._count = 0
+        self._last_step = None
+        self._last = None
+
+    def __getstate__(self):
+        """Pickle without the open files."""
+        state = self.__dict__.copy()
+        state["_files"] = None
+        return state
+
+    def _open(self):
+        if self._files is None:
+            self._files = [open(os.path.join(self.path, name), "ab")
+                           for name in [FRAMES_FILE, INDEX_FILE]]
+        return self._files
+
+    def _catch_up(self):
+        """Reload the last frame if another copy has recorded since this one
+        last did."""
+        count = os.path.getsize(os.path.join(self.path, INDEX_FILE)) // \
+            INDEX_DTYPE.itemsize
+        if count == 0:
+            self._count, self._last_step, self._last = 0, None, None
+        elif count != self._count:
+            trajectory = Trajectory(self.path)
+            self._count = len(trajectory)
+            self._last_step = int(trajectory.steps[-1])
+            self._last = trajectory.quantized(-1)
+        return self._count
+
+    def intervals(self, first_step, steps):
+        """Return numbers of steps adding up to steps, from first_step on,
+        such that each recorded step ends one of them."""
+        result = []
+        step, end = first_step, first_step + steps
+        while step < end:
+            stop = min((step // self.every + 1) * self.every, end)
+            result.append(stop - step)
+            step = stop
+        return result
+
+    def record(self, step, state):
+        """Append the state as the frame of step, if step is a multiple of
+        every and comes after the last frame."""
+        if step % self.every:
+            return
+        try:
+            self._record(step, state)
+        except (IOError, OSError):
+            if os.path.isdir(self.path):
+                raise
+            # Recording stopped: the directory was deleted, maybe while this
+            # copy was reading or writing it
+            self.close()
+
+    def _record(self, step, state):
+        count = self._catch_up()
+        if count and self._last_step >= step:
+            return
+        values = quantize(state, self.meta)
+        if values.shape[1] != self.meta["nop"]:
+            raise ValueError("The trajectory has {} particles, not {}.".format(
+                self.meta["nop"], values.shape[1]))
+        keyframe = count % KEYFRAME_INTERVAL == 0
+        if keyframe:
+            data = _encode(values)
+        else:
+            data = _encode(values - self._last)
+        frames_file, index_file = self._open()
+        frames_file.seek(0, os.SEEK_END)
+        record = np.array([(step, frames_file.tell(), len(data), keyframe)],
+                          dtype=INDEX_DTYPE)
+        frames_file.write(data)
+        frames_file.flush()
+        # The index entry comes last, so that readers never see a frame
+        # that is not fully written
+        index_file.write(record.tobytes())
+        index_file.flush()
+        self._count += 1
+        self._last_step = step
+        self._last = values
+
+    def close(self):
+        """Close the files; recording again reopens them."""
+        if self._files is not None:
+            for each in self._files:
+                each.close()
+            self._files = None
+
+
+class Trajectory(object):
+    """A recorded trajectory, read lazily from disk.
+
+    Methods:
+        frame: Return the state of a frame.
+        frame_at: Return the state at the last frame at or before a step.
+        find: Return the frame at or before a step.
+        quantized: Return the quantized values of a frame.
+        refresh: See frames recorded since opening.
+
+    Attributes:
+        path (str): The directory of the trajectory.
+        meta (dict): The contents of meta.json.
+        steps (numpy.ndarray): The step of each frame.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, META_FILE)) as infile:
+            self.meta = json.load(infile)
+        if self.meta["format"] > TRAJECTORY_FORMAT:
+            raise IOError("Trajectory {} has a newer format.".format(path))
+        self._frames = self._index = None
+        # Index and quantized values of the frame decoded last
+        self._cached = (None, None)
+        self.refresh()
+
+    def refresh(self):
+        """Map the files again, to see the frames recorded since."""
+        count = os.path.getsize(os.path.join(self.path, INDEX_FILE)) // \
+            INDEX_DTYPE.itemsize
+        if count == 0:
+            self._index = np.zeros(0, dtype=INDEX_DTYPE)
+            self._frames = None
+            return
+        # Empty files cannot be mapped; neither can be empty here
+        self._index = np.memmap(os.path.join(self.path, INDEX_FILE),
+                                dtype=INDEX_DTYPE, mode="r", shape=(count,))
+        self._frames = np.memmap(os.path.join(self.path, FRAMES_FILE),
+                                 dtype=np.uint8, mode="r")
+
+    def __len__(self):
+        return len(self._index)
+
+    @property
+    def steps(self):
+        return self._index["step"]
+
+    def find(self, step):
+        """Return the index of the last frame at or before step; raise
+        IndexError if there is none."""
+        i = int(np.searchsorted(self.steps, step, side="right")) - 1
+        if i < 0:
+            raise IndexError("No frame at or before step {}.".format(step))
+        return i
+
+    def _read(self, i):
+        record = self._index[i]
+        start = int(record["offset"])
+        return self._frames[start:start + int(record["size"])].tobytes()
+
+    def quantized(self, i):
+        """Return the quantized values of frame i, as a [4, nop] uint16
+        array."""
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("No frame {}.".format(i))
+        cached_i, values = self._cached
+        if (cached_i is not None and
+                i - i % KEYFRAME_INTERVAL <= cached_i <= i):
+            # Go on from the frame decoded last, after the same keyframe
+            start = cached_i + 1
+        else:
+            start = i - i % KEYFRAME_INTERVAL
+            values = _decode(self._read(start), self.meta["nop"])
+            start += 1
+        for j in range(start, i + 1):
+            values = values + _decode(self._read(j), self.meta["nop"])
+        self._cached = (i, values)
+        return values
+
+    def frame(self, i):
+        """Return the state (pos_x, pos_y, dir_x, dir_y) of frame i."""
+        return dequantize(self.quantized(i), self.meta)
+
+    def frame_at(self, step):
+        """Return the state at the last frame at or before step."""
+        return self.frame(self.find(step))
+
+
+class FramePrefetcher(object):
+    """Serves the frames of a trajectory for playback, decoding the frames
+    after the one last asked for on a background thread, so that playing
+    forward mostly finds them ready. Decoded frames are kept in a bounded
+    cache, least recently used first out.
+
+    Methods:
+        get: Return the state of a frame, and prefetch the following ones.
+        refresh: See frames recorded since opening.
+        close: Stop the background thread.
+
+    Attributes:
+        trajectory (Trajectory): The trajectory, as read by the caller's
+            thread (the background thread reads its own copy).
+        ahead (int): Number of frames decoded ahead of the one asked for.
+        capacity (int): Number of decoded frames kept.
+    """
+    def __init__(self, path, ahead=32, capacity=128):
+        self.trajectory = Trajectory(path)
+        self.ahead = ahead
+        self.capacity = capacity
+        self._cache = OrderedDict()
+        self._condition = threading.Condition()
+        # Frame from which to prefetch, or None if there is nothing to do
+        self._target = None
+        self._stopped = False
+        self._thread = threading.Thread(target=self._prefetch, args=(path,))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __len__(self):
+        return len(self.trajectory)
+
+    def refresh(self):
+        """See frames recorded since opening."""
+        self.trajectory.refresh()
+
+    def get(self, i):
+        """Return the state (pos_x, pos_y, dir_x, dir_y) of frame i, and have
+        the following frames decoded in the background."""
+        with self._condition:
+            state = self._cache.pop(i, None)
+            if state is not None:
+                self._cache[i] = state
+            self._target = i + 1
+            self._condition.notify()
+        if state is None:
+            state = self.trajectory.frame(i)
+            self._store(i, state)
+        return state
+
+    def _store(self, i, state):
+        with self._condition:
+            self._cache.pop(i, None)
+            self._cache[i] = state
+            while len(self._cache) > self.capacity:
+                self._cache.popitem(last=False)
+
+    def _prefetch(self, path):
+        """Main loop of the background thread."""
+        trajectory = Trajectory(path)
+        while True:
+            with self._condition:
+                while self._target is None and not self._stopped:
+                    self._condition.wait()
+                if self._stopped:
+                    return
+                target, self._target = self._target, None
+            end = target + self.ahead
+            if end > len(trajectory):
+                trajectory.refresh()
+            for i in range(target, min(end, len(trajectory))):
+                with self._condition:
+                    if self._target is not None or self._stopped:
+                        # Asked for another frame in the meantime
+                        break
+                    if i in self._cache:
+                        continue
+                self._store(i, trajectory.frame(i))
+
+    def close(self):
+        """Stop the background thread."""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        self._thread.join()
@@ -10,9 +10,36 @@ from common.parameters import N_GLOBAL_STATS
 
 CODE_PATH = os.path.join(os.path.dirname(__file__), "_c_code")
 
-def weave_compile():
+# Arguments of the tick functions, in order
+TICK_ARGS = [
+    "n", "eff_nop", "size_x", "size_y", "r0_x_2", "r1", "rv", "iner_coef",
+    "f0", "fa", "noise_coef", "v0", "pinned", "n_per_species", "beta",
+    "grad_x", "grad_y", "pos_x", "pos_y", "dir_x", "dir_y", "global_stats",
+    "steps", "cell_size", "seed", "first_step", "n_threads",
+    "single_precision", "stats_mask", "stats_stride"]
+# Arguments of the batch tick functions: the same, packed over replicas
+# (prefixed with "b_") except for those shared by all replicas, followed by
+# where each replica's particles start and the number of replicas
+SHARED_ARGS = ["steps", "n_threads", "single_precision", "stats_mask",
+               "stats_stride"]
+BATCH_TICK_ARGS = ["b_" + name if name not in SHARED_ARGS else name
+                   for name in TICK_ARGS] + ["offsets", "n_replicas"]
+
+
+def release_gil(code):
+    """Wrap C++ code so that it runs without holding the GIL, and other
+    Python threads (the GUI, while the scheduler runs a simulation) go on
+    meanwhile. The code must not touch Python objects, only the C arrays and
+    numbers that weave converted the arguments to."""
+    return "Py_BEGIN_ALLOW_THREADS\n{}\nPy_END_ALLOW_THREADS\n".format(code)
+
+
+def weave_compile(location=".", compiler="gcc", extra_compile_args=(),
+                  extra_link_args=()):
     """Compile C++ simulation code using numpy.weave so that it can be used in
-    the Python program. Generate c_code.so file.
+    the Python program. Generate c_code.so file in the directory location.
+    Builds used by the application are made through model/build.py, which
+    caches them.
     """
     # ---------------------Specify variable types--------------------
     # The parameters below are used only to specify the types of variables
@@ -63,15 +90,50 @@ def weave_compile():
                            params["Gradient Intensity"])])
     pinned = np.array([0 if x == "none" else 1 for x in
                        params["Pinned Cells"]]).astype(np.int32)
+    # Side length of neighbor search cells (non-positive for all pairs)
+    cell_size = max(r1, rv)
+    # Seed of the random numbers, and absolute step of the first step run
+    seed = 0
+    first_step = 0
+    # Number of threads (0 for the sequential update scheme)
+    n_threads = 0
+    # Pairwise terms in float instead of double (only when n_threads > 0)
+    single_precision = 0
+    # Which global properties to compute, and for one step out of how many
+    stats_mask = np.ones(N_GLOBAL_STATS, dtype=np.int32)
+    stats_stride = 1
     # Particles positions and velocities
     pos_x = np.random.random(n)*size_x
     pos_y = np.random.random(n)*size_y
     dir_x = np.zeros(n)
     dir_y = np.zeros(n)
+    # Packed arguments of the batch functions, for a batch of one replica
+    batch_args = {"n_replicas": 1, "offsets": np.zeros(1, dtype=np.int32)}
+    for name in TICK_ARGS:
+        if name in SHARED_ARGS:
+            batch_args[name] = locals()[name]
+        else:
+            value = np.ravel(locals()[name])
+            batch_args["b_" + name] = value.astype(
+                np.int32 if value.dtype.kind == "i" else np.float64)
 
     # ---------------------C file name---------------------
     mod = ext_tools.ext_module('c_code')
 
+    # ---------------------Neighbor search---------------------
+    # Bin particles into a uniform grid of cells for neighbor search
+    with open(os.path.join(CODE_PATH, "cell_list.cpp"), "r") as infile:
+        cell_list = infile.read()
+
+    # Particles in cell order and vectorized sums over their neighbors
+    with open(os.path.join(CODE_PATH, "soa.cpp"), "r") as infile:
+        soa = infile.read()
+
+    # ---------------------Random numbers---------------------
+    # Counter-based random numbers for the noise term
+    with open(os.path.join(CODE_PATH, "rng.cpp"), "r") as infile:
+        rng = infile.read()
+
     # ---------------------Main code: fixed boundary---------------------
     # Measure distance for fixed boundary condition
     with open(os.path.join(CODE_PATH, "fb_dist.cpp"), "r") as infile:
@@ -97,37 +159,68 @@ def weave_compile():
     with open(os.path.join(CODE_PATH, "pb_main_code.cpp"), "r") as infile:
         pb_main_code = infile.read()
 
+    # ---------------------Batches of replicas---------------------
+    # Run the main code for each replica in turn
+    with open(os.path.join(CODE_PATH, "batch_main_code.cpp"), "r") as infile:
+        batch_code = infile.read()
+
     # ---------------------Fixed boundary---------------------
     # Create main function from C++ code and specify input
-    fb_tick_func = ext_tools.ext_function(
-        'fb_tick', fb_main_code,
-        ["n", "eff_nop", "size_x", "size_y", "r0_x_2", "r1", "rv", "iner_coef",
-         "f0", "fa", "noise_coef", "v0", "pinned", "n_per_species", "beta",
-         "grad_x", "grad_y", "pos_x", "pos_y", "dir_x", "dir_y",
-         "global_stats", "steps"])
+    fb_tick_func = ext_tools.ext_function('fb_tick',
+                                          release_gil(fb_main_code),
+                                          TICK_ARGS)
     # Add helper functions to main function
     fb_tick_func.customize.add_support_code(fb_dist)
     fb_tick_func.customize.add_support_code(fb_fit)
+    fb_tick_func.customize.add_support_code(cell_list)
+    fb_tick_func.customize.add_support_code(soa)
+    fb_tick_func.customize.add_support_code(rng)
     fb_tick_func.customize.add_header("<math.h>")
     # Add main function to module
     mod.add_function(fb_tick_func)
+    # Same for a batch of replicas
+    fb_batch_tick_func = ext_tools.ext_function(
+        'fb_tick_batch',
+        release_gil(batch_code.replace("// MAIN CODE", fb_main_code)),
+        BATCH_TICK_ARGS, local_dict=batch_args)
+    fb_batch_tick_func.customize.add_support_code(fb_dist)
+    fb_batch_tick_func.customize.add_support_code(fb_fit)
+    fb_batch_tick_func.customize.add_support_code(cell_list)
+    fb_batch_tick_func.customize.add_support_code(soa)
+    fb_batch_tick_func.customize.add_support_code(rng)
+    fb_batch_tick_func.customize.add_header("<math.h>")
+    mod.add_function(fb_batch_tick_func)
 
     # ---------------------Periodic boundary---------------------
     # Create main function from C++ code and specify input
-    pb_tick_func = ext_tools.ext_function(
-        'pb_tick', pb_main_code,
-        ["n", "eff_nop", "size_x", "size_y", "r0_x_2", "r1", "rv", "iner_coef",
-         "f0", "fa", "noise_coef", "v0", "pinned", "n_per_species", "beta",
-         "grad_x", "grad_y", "pos_x", "pos_y", "dir_x", "dir_y",
-         "global_stats", "steps"])
+    pb_tick_func = ext_tools.ext_function('pb_tick',
+                                          release_gil(pb_main_code),
+                                          TICK_ARGS)
     # Add helper functions to main function
     pb_tick_func.customize.add_support_code(pb_dist)
     pb_tick_func.customize.add_support_code(pb_fit)
+    pb_tick_func.customize.add_support_code(cell_list)
+    pb_tick_func.customize.add_support_code(soa)
+    pb_tick_func.customize.add_support_code(rng)
     pb_tick_func.customize.add_header("<math.h>")
     # Add main function to module
     mod.add_function(pb_tick_func)
+    # Same for a batch of replicas
+    pb_batch_tick_func = ext_tools.ext_function(
+        'pb_tick_batch',
+        release_gil(batch_code.replace("// MAIN CODE", pb_main_code)),
+        BATCH_TICK_ARGS, local_dict=batch_args)
+    pb_batch_tick_func.customize.add_support_code(pb_dist)
+    pb_batch_tick_func.customize.add_support_code(pb_fit)
+    pb_batch_tick_func.customize.add_support_code(cell_list)
+    pb_batch_tick_func.customize.add_support_code(soa)
+    pb_batch_tick_func.customize.add_support_code(rng)
+    pb_batch_tick_func.customize.add_header("<math.h>")
+    mod.add_function(pb_batch_tick_func)
     # Compile
-    mod.compile(compiler="gcc", verbose=1)
+    mod.compile(location=location, compiler=compiler, verbose=1,
+                extra_compile_args=list(extra_compile_args),
+                extra_link_args=list(extra_link_args))
 
 if __name__ == "__main__":
     weave_compile()
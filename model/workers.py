@@ -0,0 +1,254 @@
+"""This module contains SimulationPool, a set of long-lived worker processes
+that run the simulations of a Population in parallel.
+
+Each simulation slot (0-8 on the GUI) is served by its own worker process,
+which keeps a resident copy of the slot's Phenotype between calls. The whole
+Phenotype is sent to the worker only when the slot gets a new one (or when it
+has been advanced in the main process, or has started or stopped recording
+its trajectory, in the meantime); afterwards, each call sends just the number
+of steps to run, and only the newly produced slice of global properties
+comes back.
+
+The particle state itself is not sent back at all: when a phenotype is made
+resident, its state arrays are moved into a memory-mapped file (in /dev/shm
+where available) that both processes map, so the worker updates them in place
+and the GUI plots them without copying. The file is unlinked as soon as both
+sides have mapped it; the memory is released once neither uses it any more.
+Since workers write the state of a phenotype before its step and global
+properties are synced, code that needs all three to match (saving a session)
+holds ``busy``, which ``add_steps`` holds while workers run.
+
+The same workers also run other work, such as the evaluations of an
+Evolution, with ``imap``; it leaves their resident phenotypes alone. ``start``
+starts the workers up front, from the main thread, so that they are not
+forked later from a background thread.
+"""
+
+import itertools
+import multiprocessing
+import os
+import tempfile
+import threading
+import traceback
+
+from common.profiling import PROFILER
+
+# Where to create state buffers: a RAM-backed file system if there is one
+BUFFER_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+
+
+def _serve(conn):
+    """Main loop of a worker process: execute commands sent by the main
+    process until told to stop.
+
+    Commands:
+        ("load", (phenotype, path)): Make the given phenotype resident, with
+            its state in the buffer at path (None if it is not shared).
+        ("add_steps", (n_steps, profile)): Advance the resident phenotype
+            and reply with (step, state, global_stats_slice, spans); state is
+            None if it has been updated in the shared buffer. With profile,
+            spans are those recorded meanwhile (see common.profiling).
+        ("call", (func, arg, profile)): Reply with (func(arg), spans), spans
+            as for "add_steps".
+        ("stop", None): Exit.
+    """
+    # Spans recorded in the main process before the fork are not ours
+    PROFILER.reset()
+    pheno, error = None, None
+    while True:
+        command, arg = conn.recv()
+        if command == "stop":
+            break
+        if command == "load":
+            # No reply; a failure is reported on the next "add_steps"
+            pheno, path = arg
+            # Slots run side by side, one thread each; the results do not
+            # depend on the number of threads (see Model.n_threads)
+            pheno.model.n_threads = min(pheno.model.n_threads, 1)
+            try:
+                if path is not None:
+                    pheno.model.attach_state_buffer(path)
+                error = None
+            except Exception:
+                pheno, error = None, traceback.format_exc()
+        elif command == "add_steps":
+            if error is not None:
+                conn.send(("error", error))
+                continue
+            n_steps, PROFILER.enabled = arg
+            try:
+                model = pheno.model
+                global_stats_slice = pheno.add_steps(n_steps)
+                state = model.state if model.state_buffer is None else None
+                conn.send(("ok", (pheno.step, state, global_stats_slice,
+                                  PROFILER.drain())))
+            except Exception:
+                conn.send(("error", traceback.format_exc()))
+        elif command == "call":
+            func, func_arg, PROFILER.enabled = arg
+            try:
+                conn.send(("ok", (func(func_arg), PROFILER.drain())))
+            except Exception:
+                conn.send(("error", traceback.format_exc()))
+
+
+class SimulationPool(object):
+    """A pool of worker processes, one per simulation slot, each holding a
+    resident copy of the phenotype of its slot.
+
+    Methods:
+        start: Start all worker processes.
+        add_steps: Advance the phenotypes of some slots in parallel.
+        imap: Call a function on each of a list of arguments in parallel.
+        close: Stop all worker processes.
+
+    Attributes:
+        busy (threading.Lock): Held by ``add_steps`` from the moment workers
+            start writing states in place until every phenotype is synced;
+            to be acquired before any lock passed to ``add_steps``.
+    """
+    def __init__(self, n_slots):
+        """
+        Parameters:
+            n_slots (int): Number of simulation slots (and worker processes).
+        """
+        self.connections = [None] * n_slots
+        self.processes = [None] * n_slots
+        # (phenotype, step, recorder) last made resident in each worker
+        self.resident = [None] * n_slots
+        self.busy = threading.Lock()
+        # Unique names for state buffer files
+        self.buffer_names = ("soie-{}-{}.state".format(os.getpid(), i)
+                             for i in itertools.count())
+
+    def _connection(self, slot):
+        """Return the connection to the worker of a slot, starting the worker
+        on first use."""
+        if self.connections[slot] is None:
+            conn, child_conn = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=_serve,
+                                              args=(child_conn,))
+            process.daemon = True
+            process.start()
+            self.connections[slot] = conn
+            self.processes[slot] = process
+        return self.connections[slot]
+
+    def start(self):
+        """Start the worker processes that are not running yet (they are
+        started on first use otherwise)."""
+        for slot in range(len(self.connections)):
+            self._connection(slot)
+
+    def add_steps(self, jobs, lock=None):
+        """Advance phenotypes in their workers and update the local copies.
+
+        Parameters:
+            jobs (list): Tuples of (slot, phenotype, n_steps).
+            lock (threading.Lock): Held while each local copy is updated, if
+                given, so that other threads holding it never see one half
+                updated.
+
+        Yields:
+            The index in ``jobs`` of each job once its phenotype has been
+            updated, in the order of ``jobs``.
+        """
+        if lock is None:
+            lock = threading.Lock()
+        with self.busy:
+            for i in self._add_steps(jobs, lock):
+                yield i
+
+    def _add_steps(self, jobs, lock):
+        new_buffers = []
+        # Trajectory recorders of the phenotypes as sent: one that starts or
+        # stops recording is sent again, so that its worker records too
+        recorders = [pheno.model.recorder for _, pheno, _ in jobs]
+        for (slot, pheno, n_steps), recorder in zip(jobs, recorders):
+            conn = self._connection(slot)
+            resident = self.resident[slot]
+            if (resident is None or resident[0] is not pheno or
+                    resident[1] != pheno.step or resident[2] is not recorder):
+                path = os.path.join(BUFFER_DIR, next(self.buffer_names))
+                if pheno.model.attach_state_buffer(path, create=True):
+                    new_buffers.append(path)
+                else:
+                    path = None
+                with PROFILER.span("ipc load", "ipc", slot=slot):
+                    conn.send(("load", (pheno, path)))
+            conn.send(("add_steps", (n_steps, PROFILER.enabled)))
+        received = 0
+        try:
+            for i, (slot, pheno, _) in enumerate(jobs):
+                with PROFILER.span("ipc wait", "ipc", slot=slot):
+                    status, result = self.connections[slot].recv()
+                received += 1
+                if status == "error":
+                    self.resident[slot] = None
+                    raise RuntimeError(
+                        "Simulation {} failed in worker process:\n{}".format(
+                            slot, result))
+                step, state, global_stats_slice, spans = result
+                PROFILER.merge(spans)
+                with lock, PROFILER.span("sync", "ipc", slot=slot):
+                    pheno.sync(step, state, global_stats_slice)
+                self.resident[slot] = (pheno, pheno.step, recorders[i])
+                yield i
+        finally:
+            # Collect replies left unread (after an error, or if the caller
+            # stopped early) so that the next call starts afresh; the local
+            # phenotypes of these slots are now behind their workers
+            for slot, _, _ in jobs[received:]:
+                self.connections[slot].recv()
+                self.resident[slot] = None
+            # Workers have mapped their buffers once they have replied
+            for path in new_buffers:
+                os.remove(path)
+
+    def imap(self, func, args):
+        """Call func on each of args in the worker processes, one call per
+        worker at a time, like multiprocessing.Pool.imap. func and args must
+        be picklable. Not to be called while ``add_steps`` runs.
+
+        Yields:
+            func(arg) for each of args, in the order of args.
+        """
+        args = list(args)
+        n_slots = len(self.connections)
+
+        def send(i):
+            self._connection(i % n_slots).send(
+                ("call", (func, args[i], PROFILER.enabled)))
+        # Each worker gets every n_slots-th call, and replies in order
+        sent = min(n_slots, len(args))
+        for i in range(sent):
+            send(i)
+        received = 0
+        try:
+            for i in range(len(args)):
+                status, result = self.connections[i % n_slots].recv()
+                received += 1
+                if sent < len(args):
+                    send(sent)
+                    sent += 1
+                if status == "error":
+                    raise RuntimeError(
+                        "Call failed in worker process:\n{}".format(result))
+                result, spans = result
+                PROFILER.merge(spans)
+                yield result
+        finally:
+            # Collect replies left unread, so that the next call starts
+            # afresh
+            for i in range(received, sent):
+                self.connections[i % n_slots].recv()
+
+    def close(self):
+        """Stop all worker processes."""
+        for slot, conn in enumerate(self.connections):
+            if conn is not None:
+                conn.send(("stop", None))
+                self.processes[slot].join()
+        self.connections = [None] * len(self.connections)
+        self.processes = [None] * len(self.processes)
+        self.resident = [None] * len(self.resident)
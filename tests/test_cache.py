@@ -0,0 +1,115 @@
+"""The cache of fitnesses (model.cache).
+
+    python -m unittest discover -s tests -t .
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from model.cache import FitnessCache, summarize
+
+PARAMETERS = {"Cell Density": 0.5, "Velocity": [0.05, 0.03, 0.02]}
+SETTINGS = (PARAMETERS, 1.0, False, (100, 200), 7)
+
+
+def summary(value):
+    return summarize(np.full([6, 3], float(value)))
+
+
+class TestKey(unittest.TestCase):
+    def test_same_simulation(self):
+        self.assertEqual(FitnessCache.key(*SETTINGS),
+                         FitnessCache.key(dict(PARAMETERS), 1, 0, [100, 200],
+                                          7))
+        # Only the update scheme matters, not the number of threads
+        self.assertEqual(FitnessCache.key(*SETTINGS, n_threads=1),
+                         FitnessCache.key(*SETTINGS, n_threads=8))
+
+    def test_changes(self):
+        base = FitnessCache.key(*SETTINGS)
+        changed = [
+            FitnessCache.key(dict(PARAMETERS, **{"Cell Density": 0.6}),
+                             *SETTINGS[1:]),
+            FitnessCache.key(PARAMETERS, 2.0, *SETTINGS[2:]),
+            FitnessCache.key(PARAMETERS, 1.0, True, *SETTINGS[3:]),
+            FitnessCache.key(PARAMETERS, 1.0, False, (100, 300), 7),
+            FitnessCache.key(PARAMETERS, 1.0, False, (100, 200), 8),
+            # Scheme, precision, neighbor search and backend
+            FitnessCache.key(*SETTINGS, n_threads=1),
+            FitnessCache.key(*SETTINGS, precision="float32"),
+            FitnessCache.key(*SETTINGS, neighbor_search="all_pairs"),
+            FitnessCache.key(*SETTINGS, backend="numpy"),
+            # Global properties computed
+            FitnessCache.key(*SETTINGS, stats_mask=[1, 0, 0, 0, 0, 0]),
+            FitnessCache.key(*SETTINGS, stats_mask=[0, 1, 0, 0, 0, 0])]
+        self.assertEqual(len(set(changed + [base])), len(changed) + 1)
+
+
+class TestFitnessCache(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp(prefix="soie-test-")
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def test_lru_eviction(self):
+        cache = FitnessCache(max_entries=3)
+        for key in "abc":
+            cache.put(key, summary(key == "a"))
+        # "a" is now the most recently used, "b" the least
+        self.assertEqual(cache.get("a"), summary(1))
+        cache.put("d", summary(0))
+        self.assertIsNone(cache.get("b"))
+        for key in "acd":
+            self.assertIsNotNone(cache.get(key))
+        self.assertEqual((cache.hits, cache.misses), (4, 1))
+
+    def test_disk_tier_persists(self):
+        cache = FitnessCache(max_entries=1, path=self.path)
+        cache.put("a", summary(1))
+        cache.put("b", summary(2))
+        # Evicted from memory, read back from disk
+        self.assertEqual(cache.get("a"), summary(1))
+        # And by another cache, as after a restart
+        other = FitnessCache(path=self.path)
+        self.assertEqual(other.get("b"), summary(2))
+        self.assertEqual(sorted(os.listdir(self.path)),
+                         ["a.json", "b.json"])
+
+    def test_disk_tier_pruned(self):
+        cache = FitnessCache(path=self.path, max_files=20)
+        for i in range(20):
+            cache.put("{:02}".format(i), summary(i))
+            # Least recently used first
+            os.utime(cache._file("{:02}".format(i)), (i, i))
+        # A lookup makes an entry the most recently used
+        cache.entries.clear()
+        self.assertEqual(cache.get("00"), summary(0))
+        # Pruned every max_files // 10 writes
+        cache.put("20", summary(20))
+        self.assertEqual(len(os.listdir(self.path)), 21)
+        cache.put("21", summary(21))
+        names = sorted(os.listdir(self.path))
+        self.assertEqual(len(names), 20)
+        self.assertNotIn("01.json", names)
+        self.assertNotIn("02.json", names)
+        self.assertIn("00.json", names)
+        # And when opened
+        FitnessCache(path=self.path, max_files=5)
+        self.assertEqual(len(os.listdir(self.path)), 5)
+
+    def test_summary_of_masked_properties(self):
+        global_stats = np.full([6, 4], np.nan)
+        global_stats[2] = [1., -3., 2., 0.]
+        result = summarize(global_stats)
+        self.assertEqual([result[name][2] for name in
+                          ["mean", "abs_mean", "min", "max"]],
+                         [0., 1.5, -3., 2.])
+        self.assertTrue(np.isnan(result["mean"][0]))
+
+
+if __name__ == "__main__":
+    unittest.main()
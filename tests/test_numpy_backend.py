@@ -0,0 +1,136 @@
+"""Parity of the NumPy backend with the C++ code.
+
+The NumPy backend implements the simultaneous update scheme, which the C++
+code runs with n_threads >= 1 (see Model.n_threads); both draw the same
+noise, so on the same seed the two must agree up to rounding. With no
+alignment force, the sequential scheme (n_threads = 0) agrees too.
+
+    python -m unittest discover -s tests -t .
+"""
+import unittest
+
+import numpy as np
+
+from model.DA import BACKENDS, Model
+
+# Maximum difference allowed in particle states and global properties.
+# Rounding differences grow over a run (the dynamics are chaotic), so runs
+# are compared over a few steps, or one step at a time from the same state.
+TOLERANCE = 1e-10
+TRAJECTORY_TOLERANCE = 1e-8
+TRAJECTORY_STEPS = 8
+STEPS = 10
+# Parameters of the runs compared, all forces switched on
+PARAMS = [
+    {
+        "Alignment Range": 5.0,
+        "Pinned Cells": ["none", "ring", "none"],
+        "Interaction Force": 0.5,
+        "Gradient Intensity": [0.1, 0.0, 0.2],
+        "Cell Ratio": [0.5, 0.3, 0.2],
+        "Alignment Force": 1.5,
+        "Noise Intensity": 0.3,
+        "Angular Inertia": 0.5,
+        "Adhesion": [[1.2, 1.4, 0.5], [1.4, 1.8, 0.3], [0.5, 0.3, 2.0]],
+        "Gradient Direction": [0.3, 0.0, 1.2],
+        "Cell Density": 0.2,
+        "Velocity": [0.05, 0.03, 0.02],
+        "Interaction Range": 8.0
+    },
+    {
+        "Alignment Range": 12.0,
+        "Pinned Cells": ["none", "none", "square"],
+        "Interaction Force": 3.2,
+        "Gradient Intensity": [1.5, 0.8, 0.0],
+        "Cell Ratio": [0.2, 0.7, 0.1],
+        "Alignment Force": 4.0,
+        "Noise Intensity": 0.05,
+        "Angular Inertia": 2.5,
+        "Adhesion": [[4.5, 0.2, 1.0], [0.2, 0.8, 3.3], [1.0, 3.3, 0.05]],
+        "Gradient Direction": [1.7, 0.9, 0.0],
+        "Cell Density": 0.6,
+        "Velocity": [0.15, 0.01, 0.08],
+        "Interaction Range": 3.5
+    },
+    {
+        "Alignment Range": 2.5,
+        "Pinned Cells": ["random", "none", "none"],
+        "Interaction Force": 1.1,
+        "Gradient Intensity": [0.0, 2.0, 0.6],
+        "Cell Ratio": [0.1, 0.1, 0.8],
+        "Alignment Force": 0.7,
+        "Noise Intensity": 0.5,
+        "Angular Inertia": 0.1,
+        "Adhesion": [[0.3, 2.2, 2.2], [2.2, 0.3, 2.2], [2.2, 2.2, 0.3]],
+        "Gradient Direction": [0.5, 1.5, 1.0],
+        "Cell Density": 0.9,
+        "Velocity": [0.2, 0.2, 0.005],
+        "Interaction Range": 16.0
+    }
+]
+
+
+def _models(params, periodic_boundary, n_threads):
+    """Return a Model of each backend, weave first, in the same state."""
+    models = [Model(params, periodic_boundary=periodic_boundary,
+                    backend=backend, seed=0, n_threads=n_threads)
+              for backend in ["weave", "numpy"]]
+    for each in models:
+        each.init_particles_state()
+    return models
+
+
+@unittest.skipIf("weave" not in BACKENDS, "C++ code not available")
+class TestNumpyBackend(unittest.TestCase):
+    def assertClose(self, weave, numpy, tolerance):
+        for a, b in zip(weave.state, numpy.state):
+            self.assertLess(np.abs(a - b).max(), tolerance)
+        np.testing.assert_array_equal(np.isnan(weave.global_stats),
+                                      np.isnan(numpy.global_stats))
+        self.assertLess(np.nanmax(np.abs(weave.global_stats -
+                                         numpy.global_stats)), tolerance)
+
+    def _compare_steps(self, params, periodic_boundary, n_threads):
+        """Compare each step of a run, starting the NumPy backend from the
+        state the C++ code has reached."""
+        weave, numpy = _models(params, periodic_boundary, n_threads)
+        for step in range(STEPS):
+            numpy.set(weave.state, np.array(weave.global_stats))
+            # Some steps only compute some global properties
+            stats_mask = [0, 1, 1, 0, 0, 1] if step % 2 else None
+            for each in (weave, numpy):
+                each.tick(1, stats_mask=stats_mask)
+            self.assertClose(weave, numpy, TOLERANCE)
+
+    def _compare_trajectory(self, params, periodic_boundary, n_threads):
+        """Compare a short run, sampling some global properties in the
+        second half."""
+        weave, numpy = _models(params, periodic_boundary, n_threads)
+        for each in (weave, numpy):
+            each.tick(TRAJECTORY_STEPS // 2)
+            each.tick(TRAJECTORY_STEPS // 2, stats_mask=[0, 1, 1, 0, 0, 1],
+                      stats_stride=3)
+        self.assertClose(weave, numpy, TRAJECTORY_TOLERANCE)
+
+    def test_steps(self):
+        for params in PARAMS:
+            for periodic_boundary in [False, True]:
+                for n_threads in [1, 2]:
+                    self._compare_steps(params, periodic_boundary, n_threads)
+
+    def test_trajectory(self):
+        for params in PARAMS:
+            for periodic_boundary in [False, True]:
+                for n_threads in [1, 2]:
+                    self._compare_trajectory(params, periodic_boundary,
+                                             n_threads)
+
+    def test_sequential_without_alignment(self):
+        for params in PARAMS:
+            params = dict(params, **{"Alignment Force": 0.0})
+            for periodic_boundary in [False, True]:
+                self._compare_steps(params, periodic_boundary, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,151 @@
+"""Saving and loading sessions (common.io_utils).
+
+    python -m unittest discover -s tests -t .
+"""
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+import numpy as np
+
+from common import io_utils
+from common.io_utils import (SESSION_FORMAT, SESSION_HEADER,
+                             load_session_data, save_session_data)
+
+
+def session_data(n_sims=3, n_steps=100):
+    """Return session data with random model data."""
+    random = np.random.RandomState(0)
+    return {
+        "general_settings": {"periodic_boundary": 1},
+        "evolve_property_settings": {"num_gen": 5},
+        "model_data": [
+            {"params": {"Cell Density": 0.1 * (i + 1)},
+             "state": random.uniform(0, 1, [4, 20 + i]),
+             "global_stats": random.uniform(0, 1, [6, n_steps + i]),
+             "global_stats_offset": 10 * i, "seed": i, "step": n_steps + i}
+            for i in range(n_sims)]}
+
+
+class TestSession(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="soie-test-")
+        self.path = os.path.join(self.directory, "session.soie")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def assertSameSession(self, loaded, saved):
+        self.assertEqual(loaded["general_settings"],
+                         saved["general_settings"])
+        self.assertEqual(loaded["evolve_property_settings"],
+                         saved["evolve_property_settings"])
+        for got, expected in zip(loaded["model_data"], saved["model_data"]):
+            self.assertEqual(sorted(got), sorted(expected))
+            for key in expected:
+                np.testing.assert_array_equal(got[key], expected[key])
+
+    def test_round_trip(self):
+        data = session_data()
+        save_session_data(self.path, data)
+        self.assertTrue(zipfile.is_zipfile(self.path))
+        with zipfile.ZipFile(self.path) as archive:
+            header = json.loads(archive.read(SESSION_HEADER))
+        self.assertEqual(header["format"], SESSION_FORMAT)
+        loaded = load_session_data(self.path)
+        self.assertSameSession(loaded, data)
+        self.assertNotIn("format", loaded)
+
+    def test_global_stats_memory_mapped(self):
+        data = session_data()
+        save_session_data(self.path, data)
+        loaded = load_session_data(self.path)
+        for each in loaded["model_data"]:
+            self.assertIsInstance(each["global_stats"], np.memmap)
+            # Copy on write: changes stay in memory
+            each["global_stats"][0, 0] = -1
+        self.assertSameSession(load_session_data(self.path), data)
+
+    def test_compressed_global_stats(self):
+        data = session_data()
+        save_session_data(self.path, data, compress_stats=True)
+        loaded = load_session_data(self.path)
+        for each in loaded["model_data"]:
+            self.assertNotIsInstance(each["global_stats"], np.memmap)
+        self.assertSameSession(loaded, data)
+
+    def test_local_header_offsets(self):
+        # Members whose local headers carry an extra field, and whose names
+        # differ in length: the data is found from the local header
+        array = np.arange(12.).reshape(3, 4)
+        with zipfile.ZipFile(self.path, "w") as archive:
+            for i, name in enumerate(["a.npy", "a/much/longer/name.npy"]):
+                buf = io.BytesIO()
+                np.lib.format.write_array(buf, array * (i + 1))
+                info = zipfile.ZipInfo(name)
+                info.extra = b"\xfe\xca\x04\x00" + b"x" * 4 * (i + 1)
+                archive.writestr(info, buf.getvalue())
+        with zipfile.ZipFile(self.path) as archive:
+            for i, name in enumerate(["a.npy", "a/much/longer/name.npy"]):
+                values = io_utils._read_array(archive, name, self.path)
+                self.assertIsInstance(values, np.memmap)
+                np.testing.assert_array_equal(values, array * (i + 1))
+
+    def test_empty_global_stats(self):
+        data = session_data(n_sims=1, n_steps=0)
+        data["model_data"][0]["global_stats"] = np.zeros([6, 0])
+        save_session_data(self.path, data)
+        self.assertSameSession(load_session_data(self.path), data)
+
+    def test_save_over_loaded_session(self):
+        save_session_data(self.path, session_data())
+        loaded = load_session_data(self.path)
+        # Saved over the file its arrays are mapped from
+        save_session_data(self.path, loaded)
+        self.assertSameSession(load_session_data(self.path), session_data())
+        self.assertEqual(os.listdir(self.directory), ["session.soie"])
+
+    def test_not_mapped_on_windows(self):
+        save_session_data(self.path, session_data())
+        name = os.name
+        os.name = "nt"
+        try:
+            loaded = load_session_data(self.path)
+        finally:
+            os.name = name
+        for each in loaded["model_data"]:
+            self.assertNotIsInstance(each["global_stats"], np.memmap)
+        self.assertSameSession(loaded, session_data())
+
+    def test_old_json_format(self):
+        data = session_data()
+        for each in data["model_data"]:
+            for key in ["state", "global_stats"]:
+                each[key] = each[key].tolist()
+            # Sessions of older versions have neither
+            del each["global_stats_offset"], each["seed"]
+        with open(self.path, "w") as outfile:
+            json.dump(data, outfile)
+        self.assertSameSession(load_session_data(self.path), data)
+
+    def test_newer_format(self):
+        save_session_data(self.path, session_data())
+        with zipfile.ZipFile(self.path) as archive:
+            members = [(info, archive.read(info.filename))
+                       for info in archive.infolist()]
+        with zipfile.ZipFile(self.path, "w") as archive:
+            for info, data in members:
+                if info.filename == SESSION_HEADER:
+                    header = json.loads(data)
+                    header["format"] = SESSION_FORMAT + 1
+                    data = json.dumps(header)
+                archive.writestr(info, data)
+        self.assertRaises(IOError, load_session_data, self.path)
+
+
+if __name__ == "__main__":
+    unittest.main()
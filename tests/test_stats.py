@@ -0,0 +1,114 @@
+"""The store of global properties (model.stats).
+
+    python -m unittest discover -s tests -t .
+"""
+import pickle
+import unittest
+
+import numpy as np
+
+from model.stats import MIN_CAPACITY, GlobalStats, sampled_steps
+
+N_STATS = 6
+
+
+def columns(start, stop):
+    """Return distinct values for steps start to stop: property i of step s
+    is s + i / 10."""
+    return (np.arange(start, stop)[None, :] +
+            np.arange(N_STATS)[:, None] / 10.)
+
+
+class TestGlobalStats(unittest.TestCase):
+    def test_growth_by_doubling(self):
+        stats = GlobalStats()
+        capacities = set()
+        for start in range(0, 1000, 7):
+            stats.append(columns(start, start + 7))
+            capacities.add(stats._data.shape[1])
+        self.assertEqual(sorted(capacities),
+                         [MIN_CAPACITY * 2**i for i in range(5)])
+        np.testing.assert_array_equal(stats.view, columns(0, 1001))
+        np.testing.assert_array_equal(stats.steps, np.arange(1001))
+        self.assertEqual((stats.offset, stats.origin, stats.n_steps),
+                         (0, 0, 1001))
+
+    def test_initial_values(self):
+        stats = GlobalStats(columns(50, 80), offset=50)
+        stats.append(columns(80, 90))
+        np.testing.assert_array_equal(stats.view, columns(50, 90))
+        self.assertEqual((stats.offset, stats.origin, stats.n_steps),
+                         (50, 50, 90))
+
+    def test_bounded_wraps(self):
+        max_steps = 100
+        stats = GlobalStats(max_steps=max_steps)
+        for start in range(0, 1000, 30):
+            stats.append(columns(start, start + 30))
+            stop = start + 30
+            first = max(0, stop - max_steps)
+            np.testing.assert_array_equal(stats.view, columns(first, stop))
+            self.assertEqual((stats.offset, stats.origin, stats.n_steps),
+                             (first, first, stop))
+        # Discarded in batches: the capacity stays bounded (twice max_steps,
+        # rounded up by doubling)
+        self.assertLess(stats._data.shape[1], 4 * max_steps)
+        # More steps at once than are retained
+        stats.append(columns(1020, 1270))
+        np.testing.assert_array_equal(stats.view, columns(1170, 1270))
+        self.assertEqual((stats.offset, stats.origin), (1170, 1170))
+
+    def test_bounded_offset(self):
+        stats = GlobalStats(columns(500, 520), offset=500, max_steps=50)
+        stats.append(columns(520, 560))
+        np.testing.assert_array_equal(stats.view, columns(510, 560))
+        self.assertEqual((stats.offset, stats.origin, stats.n_steps),
+                         (510, 510, 560))
+
+    def test_running_summaries(self):
+        values = columns(0, 500) * np.where(np.arange(500) % 3, 1, -1)
+        stats = GlobalStats(max_steps=64)
+        for start in range(0, 500, 50):
+            stats.append(values[:, start:start + 50])
+        # Over every step appended, not just those retained
+        self.assertEqual(stats.count, 500)
+        np.testing.assert_allclose(stats.mean(), values.mean(axis=1))
+        np.testing.assert_allclose(stats.abs_mean(),
+                                   np.abs(values).mean(axis=1))
+        np.testing.assert_array_equal(stats.minimum, values.min(axis=1))
+        np.testing.assert_array_equal(stats.maximum, values.max(axis=1))
+        # Kept when pickled (as sent to and from worker processes)
+        copy = pickle.loads(pickle.dumps(stats, pickle.HIGHEST_PROTOCOL))
+        np.testing.assert_allclose(copy.mean(), stats.mean())
+        np.testing.assert_array_equal(copy.view, stats.view)
+
+    def test_sampled_steps(self):
+        np.testing.assert_array_equal(sampled_steps(7, 10, 3), [9, 12, 15])
+        stats = GlobalStats()
+        stats.append(columns(0, 4)[:, ::3], n_steps=4, stride=3)
+        stats.append(columns(4, 10)[:, 2::3], n_steps=6, stride=3)
+        np.testing.assert_array_equal(stats.steps, [0, 3, 6, 9])
+        self.assertEqual(stats.n_steps, 10)
+        self.assertRaises(ValueError, stats.append, columns(10, 12),
+                          n_steps=3, stride=3)
+
+    def test_window(self):
+        stats = GlobalStats(max_steps=100)
+        stats.append(columns(0, 300))
+        np.testing.assert_array_equal(stats.window(250, 280),
+                                      columns(250, 280))
+        np.testing.assert_array_equal(stats.window(200, 300),
+                                      columns(200, 300))
+        # Discarded, or not run yet
+        self.assertRaises(IndexError, stats.window, 199, 250)
+        self.assertRaises(IndexError, stats.window, 250, 301)
+
+    def test_window_sampled(self):
+        stats = GlobalStats()
+        stats.append(columns(0, 20)[:, ::5], n_steps=20, stride=5)
+        np.testing.assert_array_equal(stats.window(3, 16),
+                                      columns(0, 20)[:, [5, 10, 15]])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,170 @@
+"""Round trips of the trajectory codec (model.trajectory).
+
+    python -m unittest discover -s tests -t .
+"""
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from model.trajectory import (INDEX_DTYPE, INDEX_FILE, KEYFRAME_INTERVAL,
+                              QUANTA, Trajectory, TrajectoryRecorder,
+                              dequantize, quantize)
+
+NOP = 50
+XLIM, YLIM = 12.0, 7.5
+META = {"xlim": XLIM, "ylim": YLIM}
+
+
+def random_state(random, nop=NOP):
+    """Return a random state (pos_x, pos_y, dir_x, dir_y) within the field."""
+    angle = random.uniform(0, 2 * np.pi, nop)
+    return (random.uniform(0, XLIM, nop), random.uniform(0, YLIM, nop),
+            np.cos(angle), np.sin(angle))
+
+
+def pickle_copy(obj):
+    return pickle.loads(pickle.dumps(obj, pickle.HIGHEST_PROTOCOL))
+
+
+def max_error(a, b):
+    return [np.abs(np.asarray(x) - np.asarray(y)).max() for x, y in zip(a, b)]
+
+
+class TestQuantize(unittest.TestCase):
+    def test_error_bounds(self):
+        state = random_state(np.random.RandomState(0), 10000)
+        errors = max_error(dequantize(quantize(state, META), META), state)
+        # Half a quantum of each range, plus rounding
+        bounds = [XLIM / QUANTA / 2, YLIM / QUANTA / 2, 1. / QUANTA,
+                  1. / QUANTA]
+        for error, bound in zip(errors, bounds):
+            self.assertLessEqual(error, bound * (1 + 1e-9))
+
+    def test_range_ends(self):
+        state = ([0., XLIM], [0., YLIM], [-1., 1.], [-1., 1.])
+        values = quantize(state, META)
+        self.assertEqual(values.dtype, np.uint16)
+        np.testing.assert_array_equal(values, [[0, QUANTA]] * 4)
+        np.testing.assert_allclose(dequantize(values, META), state)
+
+
+class TestTrajectory(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp(prefix="soie-test-")
+        self.random = np.random.RandomState(1)
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def _record(self, n_frames, every=1, recorder=None):
+        """Record n_frames random walks, every steps apart; return the
+        states recorded, by step."""
+        if recorder is None:
+            recorder = TrajectoryRecorder(self.path, NOP, XLIM, YLIM,
+                                          every=every)
+        states = {}
+        state = random_state(self.random)
+        for i in range(n_frames):
+            # Small moves, some across the edges of the field (wrapping
+            # around, as under periodic boundaries)
+            pos_x = (state[0] + self.random.normal(0, 0.5, NOP)) % XLIM
+            pos_y = (state[1] + self.random.normal(0, 0.5, NOP)) % YLIM
+            angle = np.arctan2(state[3], state[2]) + \
+                self.random.normal(0, 0.3, NOP)
+            state = (pos_x, pos_y, np.cos(angle), np.sin(angle))
+            recorder.record(i * every, state)
+            states[i * every] = state
+        recorder.close()
+        return states
+
+    def test_round_trip(self):
+        states = self._record(3 * KEYFRAME_INTERVAL + 5)
+        trajectory = Trajectory(self.path)
+        self.assertEqual(len(trajectory), len(states))
+        for i, step in enumerate(trajectory.steps):
+            expected = quantize(states[step], trajectory.meta)
+            np.testing.assert_array_equal(trajectory.quantized(i), expected)
+
+    def test_delta_wrap_around(self):
+        # Particles crossing the edge jump from one end of the range to the
+        # other: the uint16 delta wraps around
+        recorder = TrajectoryRecorder(self.path, 2, XLIM, YLIM)
+        ends = np.array([0., XLIM])
+        frames = [(ends, ends[::-1], -ends / XLIM, ends / XLIM),
+                  (ends[::-1], ends, ends / XLIM, -ends / XLIM)]
+        for step, state in enumerate(frames):
+            recorder.record(step, state)
+        recorder.close()
+        trajectory = Trajectory(self.path)
+        for i, state in enumerate(frames):
+            np.testing.assert_array_equal(trajectory.quantized(i),
+                                          quantize(state, trajectory.meta))
+
+    def test_keyframe_spacing(self):
+        self._record(2 * KEYFRAME_INTERVAL + 1)
+        index = np.fromfile(os.path.join(self.path, INDEX_FILE),
+                            dtype=INDEX_DTYPE)
+        np.testing.assert_array_equal(
+            np.flatnonzero(index["keyframe"]),
+            [0, KEYFRAME_INTERVAL, 2 * KEYFRAME_INTERVAL])
+
+    def test_seek_by_step(self):
+        every = 3
+        states = self._record(2 * KEYFRAME_INTERVAL + 10, every=every)
+        trajectory = Trajectory(self.path)
+        # Out of order, so that frames are decoded from their keyframes as
+        # well as from the frame decoded last
+        for step in [200, 5, 190, 191, 3, 0, 383, 1000]:
+            frame_step = min(step - step % every, max(states))
+            np.testing.assert_array_equal(
+                quantize(trajectory.frame_at(step), trajectory.meta),
+                quantize(states[frame_step], trajectory.meta))
+        self.assertRaises(IndexError, trajectory.find, -1)
+
+    def test_recorded_steps(self):
+        recorder = TrajectoryRecorder(self.path, NOP, XLIM, YLIM, every=5)
+        self.assertEqual(recorder.intervals(3, 14), [2, 5, 5, 2])
+        state = random_state(self.random)
+        for step in [0, 3, 5, 5, 4, 10]:
+            recorder.record(step, state)
+        recorder.close()
+        # Steps that are not multiples of every, or that do not come after
+        # the last frame, are not recorded
+        self.assertEqual(list(Trajectory(self.path).steps), [0, 5, 10])
+
+    def test_copies_catch_up(self):
+        recorder = TrajectoryRecorder(self.path, NOP, XLIM, YLIM)
+        # A copy, as sent to a worker process
+        copy = pickle_copy(recorder)
+        states = self._record(KEYFRAME_INTERVAL - 2, recorder=recorder)
+        state = random_state(self.random)
+        steps = sorted(states)
+        # The copy records on from where the original stopped, as a delta
+        # from the last frame the original recorded
+        copy.record(steps[-1] + 1, state)
+        copy.record(steps[-1], state)
+        copy.close()
+        recorder.record(steps[-1] + 2, state)
+        recorder.close()
+        states[steps[-1] + 1] = states[steps[-1] + 2] = state
+        trajectory = Trajectory(self.path)
+        self.assertEqual(list(trajectory.steps), sorted(states))
+        for i, step in enumerate(trajectory.steps):
+            np.testing.assert_array_equal(
+                trajectory.quantized(i), quantize(states[step],
+                                                  trajectory.meta))
+
+    def test_stopped_by_removal(self):
+        recorder = TrajectoryRecorder(self.path, NOP, XLIM, YLIM)
+        recorder.record(0, random_state(self.random))
+        shutil.rmtree(self.path)
+        recorder.record(1, random_state(self.random))
+        self.assertFalse(os.path.exists(self.path))
+
+
+if __name__ == "__main__":
+    unittest.main()